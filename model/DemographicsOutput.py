@@ -13,9 +13,9 @@ class DemographicsOutput(OutputWriter):
                                                  filename=filename,
                                                  delimiter=delimiter)
 
-        self.writer.writerow(['Time', 'Population', 'Size', 'Producers',
-                              'PropProducers', 'NonProducers',
-                              'PropNonProducers', 'AvgFitness'])
+        self.writeheader(['Time', 'Population', 'Size', 'Producers',
+                          'PropProducers', 'NonProducers',
+                          'PropNonProducers', 'AvgFitness'])
 
     def update(self, time):
         for n, d in self.metapopulation.topology.nodes_iter(data=True):
@@ -29,12 +29,20 @@ class DemographicsOutput(OutputWriter):
                 average_fitness = 'NA'
             else:
                 num_producers = d['population'].num_producers()
+
+                # Counts are written as integers where earlier versions did.
+                # The in-place engine has no earlier version, so it always
+                # writes integers.
+                if self.metapopulation.engine is not None or \
+                        d['population'].signed_counts:
+                    num_producers = int(num_producers)
+
                 num_nonproducers = size - num_producers
                 prop_producers = 1.0*num_producers/size
                 prop_nonproducers = 1.0*num_nonproducers/size
                 average_fitness = d['population'].average_fitness()
 
-            self.writer.writerow([time, n, size, num_producers, prop_producers,
-                                  num_nonproducers, prop_nonproducers,
-                                  average_fitness])
+            self.writerow([time, n, size, num_producers, prop_producers,
+                           num_nonproducers, prop_nonproducers,
+                           average_fitness])
 
@@ -14,8 +14,8 @@ class FitnessOutput(OutputWriter.OutputWriter):
                                             filename=filename,
                                             delimiter=delimiter)
 
-        self.writer.writerow(['Time', 'Producers', 'Nonproducers'])
+        self.writeheader(['Time', 'Producers', 'Nonproducers'])
 
     def update(self, time):
         maxfit = self.metapopulation.max_fitnesses()
-        self.writer.writerow([time, max(maxfit[0]), max(maxfit[1])])
+        self.writerow([time, max(maxfit[0]), max(maxfit[1])])
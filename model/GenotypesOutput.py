@@ -17,10 +17,9 @@ class GenotypesOutput(OutputWriter):
                                               filename=filename,
                                               delimiter=delimiter)
 
-        self.genome_length = self.metapopulation.config.getint(section='Population',
-                                           option='genome_length')
+        self.genome_length = self.metapopulation.params.Population.genome_length
 
-        self.writer.writerow(['Time', 'Genotype', 'AvgAbundance', 'IsProducer'])
+        self.writeheader(['Time', 'Genotype', 'AvgAbundance', 'IsProducer'])
 
     def update(self, time):
         abundances = []
@@ -30,5 +29,5 @@ class GenotypesOutput(OutputWriter):
         for i in range(2**(self.genome_length+1)):
             isprod = genome.is_producer(i, self.genome_length)
             genotype = i & 2**(self.genome_length)-1
-            self.writer.writerow([time, genotype, av[i], isprod])
+            self.writerow([time, genotype, av[i], isprod])
 
@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+def abundance_dtype(params, topology):
+    """Get the narrowest unsigned integer type that can safely hold abundances
+
+    When every non-empty population is diluted and regrown each cycle, no
+    population can hold more than its capacity plus the immigrants from each
+    of its neighbors. When populations can receive individuals from anywhere
+    (mixing or migration to far populations), the bound is the size of the
+    whole metapopulation. Populations that are not diluted (spite) can
+    accumulate immigrants without bound, so the model's usual 32-bit type is
+    used for them.
+
+    * params: a Parameters object containing the parameter values
+    * topology: the topology.Graph connecting the populations
+
+    """
+    num_populations = topology.number_of_nodes()
+    max_degree = int(np.diff(topology.indptr).max()) if num_populations > 0 else 0
+
+    return bounded_dtype(params=params, num_populations=num_populations,
+                         max_degree=max_degree)
+
+
+def bounded_dtype(params, num_populations, max_degree):
+    """Get the narrowest type that can hold abundances for a topology of the
+    given size (see abundance_dtype)
+
+    * params: a Parameters object containing the parameter values
+    * num_populations: the number of populations
+    * max_degree: the largest number of neighbors of any population
+
+    """
+    pop = params.Population
+    meta = params.Metapopulation
+
+    capacity = max(pop.capacity_max, pop.capacity_min)
+
+    if pop.dilution_prob_min < 1:
+        return np.uint32
+    elif meta.mix_frequency > 0 or meta.migration_p_far > 0:
+        bound = capacity * num_populations * max(1, max_degree)
+    else:
+        bound = capacity * (1 + max_degree)
+
+    for dtype in [np.uint16, np.uint32]:
+        if bound <= np.iinfo(dtype).max:
+            return dtype
+
+    # NumPy's samplers accept signed, but not unsigned, 64-bit counts
+    return np.int64
+
+
+class InPlaceEngine(object):
+    """Advance a metapopulation using vectorized operations and fixed buffers
+
+    InPlaceEngine carries out dilution, growth, mutation, and migration on the
+    metapopulation's abundances array as a whole rather than population by
+    population. Arrays that span the whole metapopulation are allocated once,
+    when the engine is created, and are re-used each cycle with in-place
+    operations, including the census of each population's size and producers.
+
+    Cycles are not free of allocation. NumPy's random samplers cannot write
+    into existing arrays, so every draw returns a new array, and selecting
+    entries, numbering their populations, and merging in the entries that
+    mutation fills (np.union1d, once per locus with mutants) make temporary
+    arrays. These are proportional to the number of non-zero abundances,
+    since only those are sampled. Scheduling dilutions and choosing
+    destinations for migrants also make a few temporary arrays with one entry
+    per population, and finding the non-zero abundances at the start of each
+    cycle makes one array of their indices. For figure3a.cfg on a 200x200
+    grid (39 MB of abundances, around 120,000 non-zero), these temporaries
+    raised peak memory by 6 to 9 MB during cycles.
+
+    Mutation is carried out one locus at a time: at each locus, the number of
+    individuals of each genotype whose allele flips is drawn from a binomial
+    distribution, and those individuals are moved to the genotype differing at
+    that locus. Since loci mutate independently, this has the same
+    distribution as drawing each individual's new genotype from the table of
+    mutation probabilities, which is therefore not needed.
+
+    Migration draws all emigrants at once and adds them to their destinations
+    directly, so no separate census is needed.
+
+    When not every population is diluted each cycle (dilution_prob_min less
+    than 1), dilutions are scheduled in advance, and growth and mutation only
+    touch the populations that were diluted. The whole abundances array is
+    searched once per cycle, and the other steps re-use the entries found by
+    the step before them.
+
+    Random numbers are drawn from the metapopulation's dynamics stream. Since
+    all populations are handled at once, paired random streams cannot be
+    aligned population by population as they are with the reference engine.
+
+    * metapopulation: the Metapopulation to advance
+
+    """
+
+    def __init__(self, metapopulation):
+        self.metapopulation = metapopulation
+        self.params = metapopulation.params
+        self.rng = metapopulation.rng
+
+        pop = self.params.Population
+        meta = self.params.Metapopulation
+
+        num_populations, num_genotypes = metapopulation.abundances.shape
+        self.num_genotypes = num_genotypes
+        self.genome_length = pop.genome_length
+
+        # A flat view of the abundances array, indexed by
+        # population * num_genotypes + genotype
+        self.flat = metapopulation.abundances.reshape(-1)
+        self.first_producer = num_genotypes // 2
+
+        self.dilution_factor = pop.dilution_factor
+        self.dilution_prob_min = pop.dilution_prob_min
+        self.capacity_min = pop.capacity_min
+        self.capacity_max = pop.capacity_max
+        self.migration_rate = meta.migration_rate
+        self.migration_dest = meta.migration_dest
+        self.migration_p_far = meta.migration_p_far
+
+        # The mutation rate at each locus. The highest-order locus is the
+        # social locus.
+        self.mutation_rates = [pop.mutation_rate_adaptation] * pop.genome_length + \
+                              [pop.mutation_rate_social]
+
+        # The structure of the topology
+        topology = metapopulation.topology
+        self.num_populations = num_populations
+        self.indptr = np.asarray(topology.indptr, dtype=np.int64)
+        self.indices = np.asarray(topology.indices, dtype=np.int64)
+        self.degree = np.diff(self.indptr)
+        self.isolated = self.degree == 0
+
+        # Buffers re-used each cycle
+        self.sizes = np.zeros(num_populations, dtype=np.int64)
+        self.producers = np.zeros(num_populations, dtype=np.int64)
+        self.denominators = np.zeros(num_populations, dtype=np.int64)
+        self.prop_producers = np.zeros(num_populations)
+        self.targets = np.zeros(num_populations)
+        self.totals = np.zeros(num_populations)
+        self.nonempty = np.zeros(num_populations, dtype=bool)
+        self.active = np.zeros(num_populations, dtype=bool)
+        self.destinations = np.zeros(num_populations, dtype=np.int64)
+        self.delta = np.zeros(num_populations * num_genotypes, dtype=np.int64)
+
+        # The schedule of dilutions (see schedule_dilutions). Each population
+        # is next diluted at the dilution count in next_dilution, which was
+        # drawn when its proportion of producers was scheduled_prop. NaN
+        # means a new time must be drawn.
+        self.dilutions = 0
+        self.next_dilution = np.zeros(num_populations, dtype=np.int64)
+        self.scheduled_prop = np.empty(num_populations)
+        self.scheduled_prop.fill(np.nan)
+
+        # The flat indices of the non-zero abundances found by the last step,
+        # extended with every entry it could have made non-zero, and the name
+        # of that step (see occupied)
+        self.known = None
+        self.known_step = None
+
+    def group(self, populations):
+        """Number the distinct populations that entries belong to, so that
+        sums over each population's entries need one element per population
+        present rather than one per population
+
+        Returns the group of each entry and the population of each group.
+
+        * populations: the population of each entry, in increasing order
+
+        """
+        first = np.empty(populations.size, dtype=bool)
+        first[:1] = True
+        np.not_equal(populations[1:], populations[:-1], out=first[1:])
+        return np.cumsum(first) - 1, populations[first]
+
+    def update_census(self, indices):
+        """Update the size and proportion of producers of each population
+
+        * indices: the flat indices of the non-zero abundances (see occupied)
+
+        """
+        self.sizes.fill(0)
+        self.producers.fill(0)
+
+        # Older versions of NumPy reject a minlength of 0
+        if indices.size > 0:
+            groups, members = self.group(indices // self.num_genotypes)
+            counts = self.flat[indices]
+            producing = indices % self.num_genotypes >= self.first_producer
+
+            self.sizes[members] = np.bincount(groups, weights=counts)
+            self.producers[members] = np.bincount(groups[producing],
+                                                  weights=counts[producing],
+                                                  minlength=members.size)
+
+        np.maximum(self.sizes, 1, out=self.denominators)
+        np.true_divide(self.producers, self.denominators,
+                       out=self.prop_producers)
+        np.greater(self.sizes, 0, out=self.nonempty)
+
+    def update_active(self):
+        """Find the non-empty populations that were diluted
+
+        Returns True if every non-empty population was diluted.
+        """
+        np.logical_and(self.nonempty, self.metapopulation.diluted,
+                       out=self.active)
+        return np.array_equal(self.active, self.nonempty)
+
+    def occupied(self, step, previous=None):
+        """Get the flat indices of the non-zero abundances
+
+        Sampling only the non-zero abundances is much faster than sampling the
+        whole abundances array, since most genotypes are absent from most
+        populations. Dilution and growth only change entries that are already
+        non-zero, and mutation records the entries it adds to, so when a step
+        directly follows the step that it always follows in a cycle, only the
+        entries found by that step are checked. Otherwise, such as after the
+        environment changes, the whole array is searched.
+
+        * step: the name of the step asking
+        * previous: the name of the step it follows in a cycle
+
+        """
+        if self.known is not None and previous is not None and \
+                self.known_step == previous:
+            indices = self.known[self.flat[self.known] > 0]
+        else:
+            indices = np.flatnonzero(self.metapopulation.abundances)
+
+        self.known = indices
+        self.known_step = step
+        return indices
+
+    def select_active(self, indices):
+        """Get the indices that belong to populations that were diluted"""
+        return indices[self.active[indices // self.num_genotypes]]
+
+    def schedule_dilutions(self):
+        """Decide which populations are diluted
+
+        Rather than deciding whether each population is diluted every cycle,
+        the number of cycles until each population's next dilution is drawn
+        from a geometric distribution with its probability of dilution. Since
+        the geometric distribution is memoryless, a population's scheduled
+        dilution remains valid until its proportion of producers, and so its
+        probability of dilution, changes. Only the populations whose
+        proportion has changed since their dilution was scheduled, or which
+        were just diluted, are rescheduled, so this has the same distribution
+        as deciding each cycle. Populations that cannot be diluted (no
+        producers with a dilution_prob_min of 0) are never scheduled.
+        """
+        m = self.metapopulation
+
+        stale = self.nonempty & (self.prop_producers != self.scheduled_prop)
+        rows = np.flatnonzero(stale)
+
+        if rows.size > 0:
+            probs = self.dilution_prob_min + (1.0 - self.dilution_prob_min) * self.prop_producers[rows]
+            waits = np.empty(rows.size, dtype=np.int64)
+            waits.fill(np.iinfo(np.int64).max - self.dilutions)
+
+            possible = probs > 0
+            waits[possible] = self.rng.geometric(probs[possible],
+                                                 size=possible.sum()) - 1
+
+            self.next_dilution[rows] = self.dilutions + waits
+            self.scheduled_prop[rows] = self.prop_producers[rows]
+
+        np.copyto(m.diluted, self.next_dilution <= self.dilutions,
+                  where=self.nonempty)
+
+        # Diluted populations are rescheduled, even if their proportion of
+        # producers does not change
+        self.scheduled_prop[m.diluted & self.nonempty] = np.nan
+        self.dilutions += 1
+
+    def dilute(self, stochastic=True):
+        """Dilute each population
+
+        As in Population.dilute, each non-empty population is diluted with
+        probability that increases with its proportion of producers, from
+        dilution_prob_min with no producers to 1 with only producers.
+        """
+        m = self.metapopulation
+        flat = self.flat
+
+        # Entries may have been changed outside the engine since the last
+        # step, for example by mixing
+        indices = self.occupied(step='dilute')
+        self.update_census(indices)
+
+        if self.dilution_prob_min == 1:
+            m.diluted[self.nonempty] = True
+        else:
+            self.schedule_dilutions()
+
+        if not self.update_active():
+            indices = self.select_active(indices)
+
+        if stochastic:
+            flat[indices] = self.rng.binomial(flat[indices], self.dilution_factor)
+        else:
+            flat[indices] = np.floor(flat[indices] * self.dilution_factor)
+
+    def grow(self):
+        """Grow each diluted population to carrying capacity
+
+        As in Population.grow, each population's final size is determined by
+        its proportion of producers, and the abundances are drawn from a
+        multinomial with each genotype's probability proportional to its
+        abundance times its fitness.
+
+        Only the genotypes present are sampled. The multinomial is drawn as a
+        cascade of binomials: each genotype present receives a binomial share
+        of the individuals not yet placed, with probability given by its
+        weight relative to the weight of the genotypes not yet visited. This
+        has the same distribution as the multinomial. The cascade is carried
+        out for all populations at once, one genotype per population at a
+        time, so the number of steps is the largest number of genotypes
+        present in any population.
+        """
+        m = self.metapopulation
+        flat = self.flat
+
+        indices = self.occupied(step='grow', previous='dilute')
+        self.update_census(indices)
+        if not self.update_active():
+            indices = self.select_active(indices)
+
+        np.multiply(self.prop_producers, self.capacity_max - self.capacity_min,
+                    out=self.targets)
+        self.targets += self.capacity_min
+
+        if indices.size == 0:
+            return
+
+        populations = indices // self.num_genotypes
+        weights = flat[indices] * m.fitness_landscape[indices % self.num_genotypes]
+
+        # Populations whose genotypes all have zero fitness are left as they
+        # are. In the rest, genotypes with zero fitness die out.
+        groups, members = self.group(populations)
+        totals = self.totals
+        totals[members] = np.bincount(groups, weights=weights)
+        growing = totals[populations] > 0
+        flat[indices[growing]] = 0
+
+        sampled = weights > 0
+        indices = indices[sampled]
+        populations = populations[sampled]
+        weights = weights[sampled]
+        if indices.size == 0:
+            return
+
+        # Since indices are sorted, each population's genotypes are
+        # contiguous. Each group is one population's genotypes.
+        starts = np.flatnonzero(np.concatenate(([True], populations[1:] != populations[:-1])))
+        counts = np.diff(np.append(starts, indices.size))
+        remaining = self.targets[populations[starts]].astype(np.int64)
+        remaining_weight = totals[populations[starts]]
+
+        groups = np.arange(starts.size)
+        rank = 0
+        while groups.size > 0:
+            entries = starts[groups] + rank
+            w = weights[entries]
+
+            # Rounding can leave slightly less weight than the genotype's
+            # own, and the last genotype must receive everyone left
+            probs = w / np.maximum(remaining_weight[groups], w)
+            probs[counts[groups] == rank + 1] = 1.0
+
+            drawn = self.rng.binomial(remaining[groups], probs, size=groups.size)
+            flat[indices[entries]] = drawn
+            remaining[groups] -= drawn
+            remaining_weight[groups] -= w
+
+            rank += 1
+            groups = groups[(counts[groups] > rank) & (remaining[groups] > 0)]
+
+    def mutate(self):
+        """Mutate each diluted population
+
+        Loci are mutated one at a time. See the class description.
+        """
+        flat = self.flat
+
+        indices = self.occupied(step='mutate', previous='grow')
+        self.update_census(indices)
+
+        # Mutants can only appear next to genotypes that are present, so the
+        # occupied entries are found once and extended as mutants appear
+        if not self.update_active():
+            indices = self.select_active(indices)
+        mutants = False
+
+        for locus, rate in enumerate(self.mutation_rates):
+            if rate == 0:
+                continue
+
+            # Older versions of NumPy return a scalar for a single count
+            # unless the size is given
+            flipped = self.rng.binomial(flat[indices], rate, size=indices.size)
+            mutated = flipped > 0
+
+            if not mutated.any():
+                continue
+
+            sources = indices[mutated]
+            flipped = flipped[mutated]
+
+            # Since the number of genotypes is a power of two, flipping a bit
+            # of the flat index flips the same bit of the genotype. Each
+            # genotype has one partner, so there are no repeated indices.
+            partners = sources ^ (1 << locus)
+            flat[sources] -= flipped
+            flat[partners] += flipped
+
+            indices = np.union1d(indices, partners)
+            mutants = True
+
+        # The entries left out by select_active are already known
+        if mutants:
+            self.known = np.union1d(self.known, indices)
+
+    def migrate(self):
+        """Migrate individuals among the populations
+
+        With migration_dest 'single', the emigrants from each population all
+        move to one neighbor. With 'neighbors', a separate group of emigrants
+        moves to each neighbor. In both cases, each group instead moves to a
+        randomly-chosen population with probability migration_p_far.
+        Populations without neighbors keep their emigrants.
+        """
+        if self.migration_rate == 0:
+            return
+
+        flat = self.flat
+        indices = self.occupied(step='migrate', previous='mutate')
+        sources = indices // self.num_genotypes
+        genotypes = indices % self.num_genotypes
+
+        if self.migration_dest.lower() == 'single':
+            offsets = (self.rng.random_sample(self.num_populations) * self.degree).astype(np.int64)
+            offsets += self.indptr[:-1]
+            np.minimum(offsets, max(self.indices.size - 1, 0), out=offsets)
+
+            if self.indices.size > 0:
+                np.take(self.indices, offsets, out=self.destinations)
+            self.destinations[self.isolated] = np.flatnonzero(self.isolated)
+
+            if self.migration_p_far > 0:
+                far = self.rng.random_sample(self.num_populations) < self.migration_p_far
+                self.destinations[far] = self.rng.randint(0, self.num_populations,
+                                                          size=far.sum())
+
+            emigrants = self.rng.binomial(flat[indices], self.migration_rate,
+                                          size=indices.size)
+            moving = emigrants > 0
+            emigrants = emigrants[moving]
+            indices = indices[moving]
+            destinations = self.destinations[sources[moving]] * self.num_genotypes + \
+                           genotypes[moving]
+
+            flat[indices] -= emigrants.astype(flat.dtype)
+            np.add.at(flat, destinations, emigrants.astype(flat.dtype))
+
+        elif self.migration_dest.lower() == 'neighbors':
+            # Expand each non-zero abundance into one entry per edge leaving
+            # its population
+            degree = self.degree[sources]
+            starts = np.cumsum(degree) - degree
+            edges = np.arange(degree.sum()) - np.repeat(starts - self.indptr[sources],
+                                                        degree)
+
+            emigrants = self.rng.binomial(np.repeat(flat[indices], degree),
+                                          self.migration_rate / np.repeat(degree, degree),
+                                          size=edges.size)
+            destinations = self.indices[edges]
+
+            if self.migration_p_far > 0:
+                far = self.rng.random_sample(destinations.size) < self.migration_p_far
+                destinations[far] = self.rng.randint(0, self.num_populations,
+                                                     size=far.sum())
+
+            # Populations can send more emigrants in total than they hold (as
+            # in Population.select_migrants), so changes are accumulated with
+            # a signed type
+            delta = self.delta
+            delta.fill(0)
+            np.subtract.at(delta, np.repeat(indices, degree), emigrants)
+            np.add.at(delta, destinations * self.num_genotypes +
+                      np.repeat(genotypes, degree), emigrants)
+            np.add(flat, delta, out=flat, casting='unsafe')
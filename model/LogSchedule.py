@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# The logs made after an event, in the order they are made. They have the
+# same time as the log made before the event, in the same cycle.
+AFTER_EVENT_REASONS = ['after_mix', 'after_change']
+
+
+def step(reason):
+    """Get the order of a log among those made at the same time
+
+    Returns 0 for the log made before any event, and 1 and 2 for the logs
+    made after mixing and after changing the environment. The time and step
+    together identify a log.
+
+    * reason: the reason the state was logged
+
+    """
+    if reason in AFTER_EVENT_REASONS:
+        return AFTER_EVENT_REASONS.index(reason) + 1
+    return 0
+
+
+class LogSchedule(object):
+    """Decide when the metapopulation's state is logged
+
+    With the 'fixed' schedule, the state is logged every log_frequency cycles.
+
+    With the 'adaptive' schedule, the state is also logged immediately before
+    and after the metapopulation is mixed or its environment is changed, and
+    whenever the proportion of producers has changed by more than
+    log_threshold since it was last logged. After each of these events, the
+    state is logged every cycle, and the interval between logs is multiplied
+    by log_thinning each time the state is logged without an event, up to
+    log_max_interval cycles. This logs transients densely and stationary
+    periods sparsely.
+
+    Each log is given a reason, which is written in the Reason column of the
+    output files when the adaptive schedule is used:
+
+    * interval: the time since the last log reached the logging interval
+    * threshold: the proportion of producers changed by more than log_threshold
+    * before_mix and after_mix: the metapopulation was mixed
+    * before_change and after_change: the environment was changed
+
+    Logs made after an event have the same time as the log made before it, so
+    consumers of the output files tell them apart by their step (see step).
+
+    * metapopulation: the Metapopulation being logged
+
+    """
+
+    def __init__(self, metapopulation):
+        self.metapopulation = metapopulation
+
+        sim = metapopulation.params.Simulation
+
+        self.adaptive = sim.log_schedule == 'adaptive'
+        self.log_frequency = sim.log_frequency
+        self.threshold = sim.log_threshold
+        self.thinning = sim.log_thinning
+        self.max_interval = sim.log_max_interval
+
+        self.interval = self.log_frequency
+        self.next_time = 0
+        self.last_prop_producers = None
+
+    def reason(self, time, mixing=False, changing=False):
+        """Get the reason for logging the state at the given time
+
+        Returns None if the state should not be logged.
+
+        * time: the current time
+        * mixing: whether the metapopulation is about to be mixed
+        * changing: whether the environment is about to be changed
+
+        """
+        if not self.adaptive:
+            if time % self.log_frequency == 0:
+                return 'interval'
+            return None
+
+        if mixing:
+            return 'before_mix'
+        elif changing:
+            return 'before_change'
+        elif time >= self.next_time:
+            return 'interval'
+        elif self.changed():
+            return 'threshold'
+
+        return None
+
+    def changed(self):
+        """Check whether the proportion of producers has changed by more than
+        the threshold since the state was last logged"""
+        prop_producers = self.metapopulation.prop_producers()
+
+        if prop_producers == 'NA' or self.last_prop_producers == 'NA':
+            return prop_producers != self.last_prop_producers
+
+        return abs(prop_producers - self.last_prop_producers) > self.threshold
+
+    def logged(self, time, reason):
+        """Record that the state was logged
+
+        * time: the current time
+        * reason: the reason the state was logged
+
+        """
+        if not self.adaptive:
+            return
+
+        if reason == 'interval':
+            self.interval = min(self.interval * self.thinning,
+                                self.max_interval)
+        else:
+            self.interval = 1
+
+        self.next_time = time + max(1, int(self.interval))
+        self.last_prop_producers = self.metapopulation.prop_producers()
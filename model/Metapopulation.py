@@ -1,156 +1,201 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import time
 
-import networkx as nx
 import numpy as np
-from numpy.random import binomial, choice as nchoice, random_integers
 
+import cache
 import genome
+import resources
+from InPlaceEngine import InPlaceEngine, abundance_dtype
+from LogSchedule import LogSchedule
+from parameters import Parameters, TOPOLOGY_SECTIONS
 from Population import Population
 import topology
-from DemographicsOutput import DemographicsOutput
-from GenotypesOutput import GenotypesOutput
-from FitnessOutput import FitnessOutput
+
+
+# With paired random streams, each of these uses its own stream of random
+# numbers (see Metapopulation)
+STREAM_LANDSCAPE = 1
+STREAM_INITIALIZATION = 2
+STREAM_DYNAMICS = 3
+STREAM_POPULATION = 4
 
 
 class Metapopulation(object):
+    """A collection of populations connected by migration
+
+    Random numbers are drawn from NumPy's global generator by default. When
+    Simulation/random_streams is 'paired', fitness landscapes, the initial
+    state, and the dynamics each have their own stream, seeded from
+    Simulation/seed, and each population has its own stream for dilution,
+    growth, mutation, and migration. Runs of different treatments with the
+    same seed then share random numbers wherever their structure allows: they
+    have the same fitness landscapes, their populations start from the same
+    random state after initialization, and each population's dynamics draw
+    from the same stream as the population with the same index in the other
+    treatment. This makes differences between treatments less noisy.
+    """
+
+    def __init__(self, config, params=None):
+        """Initialize a Metapopulation object
+
+        * config: a ConfigParser object containing the configuration
+        * params: a Parameters object for config. If not given, one is created.
 
-    def __init__(self, config):
-        """Initialize a Metapopulation object"""
+        """
         self.config = config
         self.time = 0
 
-        self.migration_rate = self.config.getfloat(section='Metapopulation',
-                                                   option='migration_rate')
-        self.migration_dest = self.config.get(section='Metapopulation',
-                                              option='migration_dest')
-        self.migration_p_far = self.config.getfloat(section='Metapopulation',
-                                                    option='migration_p_far')
-        self.topology_type = self.config.get(section='Metapopulation',
-                                             option='topology')
-        self.log_frequency = self.config.getint(section='Simulation',
-                                                option='log_frequency')
-        self.dilution_stochastic = self.config.getboolean(section='Population',
-                                                          option='dilution_stochastic')
-
-
-        assert self.migration_rate >= 0 and self.migration_rate <= 1
-        assert self.migration_dest in ['single', 'neighbors']
-        assert 0 <= self.migration_p_far <= 1
-        assert self.topology_type is not None, 'Topology must be specified'
-        assert self.topology_type in ['moore', 'vonneumann', 'smallworld',
-                                      'complete', 'regular']
-        assert self.log_frequency > 0
-
-        if self.topology_type.lower() == 'moore':
-            width = self.config.getint(section='MooreTopology',
-                                       option='width')
-            height = self.config.getint(section='MooreTopology',
-                                        option='height')
-            periodic = self.config.getboolean(section='MooreTopology',
-                                              option='periodic')
-            radius = self.config.getint(section='MooreTopology',
-                                        option='radius')
-
-            assert width > 0
-            assert height > 0
-            assert radius > 0
-
-            self.topology = topology.moore_lattice(rows=height, columns=width,
-                                                   radius=radius,
-                                                   periodic=periodic)
-
-        elif self.topology_type.lower() == 'vonneumann':
-            width = self.config.getint(section='VonNeumannTopology',
-                                       option='width')
-            height = self.config.getint(section='VonNeumannTopology',
-                                        option='height')
-            periodic = self.config.getboolean(section='VonNeumannTopology',
-                                              option='periodic')
-
-            assert width > 0
-            assert height > 0
-
-            self.topology = topology.vonneumann_lattice(rows=height,
-                                                        columns=width,
-                                                        periodic=periodic)
-
-        elif self.topology_type.lower() == 'smallworld':
-            size = self.config.getint(section='SmallWorldTopology',
-                                      option='size')
-            neighbors = self.config.getint(section='SmallWorldTopology',
-                                           option='neighbors')
-            edgeprob = self.config.getfloat(section='SmallWorldTopology',
-                                            option='edgeprob')
-
-            if config.has_option(section='SmallWorldTopology', option='seed') is not True:
-                config.set(section='SmallWorldTopology', option='seed', value=self.config.get(section='Simulation', option='seed'))
-
-            seed = self.config.getint(section='SmallWorldTopology', option='seed')
-
-            assert size > 0
-            assert neighbors >= 0
-            assert edgeprob >= 0 and edgeprob <= 1
-
-            self.topology = topology.smallworld(size=size, neighbors=neighbors,
-                                                edgeprob=edgeprob, seed=seed)
-
-        elif self.topology_type.lower() == 'complete':
-            size = self.config.getint(section='CompleteTopology',
-                                      option='size')
-
-            assert size > 0
-
-            self.topology = nx.complete_graph(n=size)
-
-        elif self.topology_type.lower() == 'regular':
-            size = self.config.getint(section='RegularTopology',
-                                      option='size')
-            degree = self.config.getint(section='RegularTopology',
-                                        option='degree')
-
-            if config.has_option(section='RegularTopology', option='seed') is not True:
-                config.set(section='RegularTopology', option='seed', value=self.config.get(section='Simulation', option='seed'))
-
-            seed = self.config.getint(section='RegularTopology', option='seed')
-
-            self.topology = topology.regular(size=size, degree=degree,
-                                             seed=seed)
-
-
-        export_topology = self.config.getboolean(section='Simulation',
-                                                 option='export_topology')
+        # setup_times records how long each stage of initialization took
+        self.setup_times = []
+        tic = time.time()
+
+        if params is None:
+            params = Parameters(config)
+
+        # Refuse runs that would not fit in the memory budget, or switch them
+        # to the in-place engine, before anything large is allocated
+        self.estimate = resources.check_budget(params=params, config=config)
+
+        self.params = params
+        self.migration_rate = params.Metapopulation.migration_rate
+        self.migration_dest = params.Metapopulation.migration_dest
+        self.migration_p_far = params.Metapopulation.migration_p_far
+        self.topology_type = params.Metapopulation.topology.lower()
+        self.log_frequency = params.Simulation.log_frequency
+        self.dilution_stochastic = params.Population.dilution_stochastic
+        self.mutation_rate_tolerance = params.Population.mutation_rate_tolerance
+        self.paired_streams = params.Simulation.random_streams == 'paired'
+
+        # The sources of random numbers (see the class description)
+        self.landscape_rng = self.random_stream(STREAM_LANDSCAPE)
+        self.initialization_rng = self.random_stream(STREAM_INITIALIZATION)
+        self.rng = self.random_stream(STREAM_DYNAMICS)
+
+        # If a cache directory is given, topologies and mutation tables are
+        # stored there and shared among runs
+        self.cache = None
+        if params.Simulation.cache_dir:
+            self.cache = cache.Cache(directory=params.Simulation.cache_dir)
+
+        # Long-lived processes also keep them in memory (see cache.shared)
+        self.caching = self.cache is not None or cache.shared is not None
+
+        self.setup_times.append(('parameters', time.time() - tic))
+        tic = time.time()
+
+        # The reference engine chooses neighbors by their position in each
+        # population's list of neighbors, so topologies list them as the
+        # networkx graphs of earlier versions did
+        networkx_order = params.Simulation.engine == 'reference'
+
+        if self.topology_type == 'moore':
+            p = params.MooreTopology
+            self.topology = self.build_topology(topology.moore_lattice,
+                                                rows=p.height, columns=p.width,
+                                                radius=p.radius,
+                                                periodic=p.periodic,
+                                                networkx_order=networkx_order)
+
+        elif self.topology_type == 'vonneumann':
+            p = params.VonNeumannTopology
+            self.topology = self.build_topology(topology.vonneumann_lattice,
+                                                rows=p.height, columns=p.width,
+                                                periodic=p.periodic,
+                                                networkx_order=networkx_order)
+
+        elif self.topology_type == 'smallworld':
+            p = params.SmallWorldTopology
+            self.topology = self.build_topology(topology.smallworld,
+                                                size=p.size,
+                                                neighbors=p.neighbors,
+                                                edgeprob=p.edgeprob,
+                                                seed=p.seed,
+                                                networkx_order=networkx_order)
+
+        elif self.topology_type == 'complete':
+            p = params.CompleteTopology
+            self.topology = self.build_topology(topology.complete, size=p.size)
+
+        elif self.topology_type == 'regular':
+            p = params.RegularTopology
+            self.topology = self.build_topology(topology.regular, size=p.size,
+                                                degree=p.degree, seed=p.seed,
+                                                networkx_order=networkx_order)
+
 
         # Export the structure of the topology, allowing the topology to be
         # re-created. This is especially useful for randomly-generated
-        # topologies.
-        if export_topology:
-            data_dir = self.config.get(section='Simulation', option='data_dir')
-            nx.write_gml(self.topology, os.path.join(data_dir, 'topology.gml'))
-
+        # topologies. The edgelist format is a NumPy array of node pairs, which
+        # is much faster to write and read than GML for large topologies.
+        if params.Simulation.export_topology:
+            data_dir = params.Simulation.data_dir
+
+            if params.Simulation.topology_format == 'gml':
+                import networkx as nx
+                nx.write_gml(self.topology.to_networkx(),
+                             os.path.join(data_dir, 'topology.gml'))
+            elif params.Simulation.topology_format == 'edgelist':
+                np.save(os.path.join(data_dir, 'topology.npy'),
+                        self.topology.edge_array())
+
+        self.setup_times.append(('topology', time.time() - tic))
+        tic = time.time()
+
+
+        # Store the probabilities of mutations between all pairs of genotypes.
+        # The in-place engine mutates each locus separately, so it does not
+        # need them.
+        if params.Simulation.engine == 'inplace':
+            self.mutation_probs = None
+        elif not self.caching:
+            self.mutation_probs = self.get_mutation_probabilities()
+        else:
+            key = {'genome_length': params.Population.genome_length,
+                   'mutation_rate_social': params.Population.mutation_rate_social,
+                   'mutation_rate_adaptation': params.Population.mutation_rate_adaptation}
+            arrays, attributes = self.get_cached('mutation_probabilities', key,
+                                                 build=lambda: ({'mutation_probs': self.get_mutation_probabilities()}, {}))
+            self.mutation_probs = arrays['mutation_probs']
 
-        # Store the probabilities of mutations between all pairs of genotypes
-        self.mutation_probs = self.get_mutation_probabilities()
+        self.setup_times.append(('mutation table', time.time() - tic))
+        tic = time.time()
 
         # Create the fitness landscape
         self.fitness_landscape = self.build_fitness_landscape()
 
-        initial_state = self.config.get(section='Metapopulation',
-                                        option='initial_state')
-        genome_length = self.config.getint(section='Population',
-                                           option='genome_length')
-        max_cap = self.config.getint(section='Population', option='capacity_max')
-        min_cap = self.config.getint(section='Population', option='capacity_min')
-        initial_producer_proportion = self.config.getfloat(section='Population',
-                                                           option='initial_producer_proportion')
-        mutation_rate_tolerance = self.config.getfloat(section='Population',
-                                                       option='mutation_rate_tolerance')
+        initial_state = params.Metapopulation.initial_state
+        genome_length = params.Population.genome_length
+        max_cap = params.Population.capacity_max
+        min_cap = params.Population.capacity_min
+        initial_producer_proportion = params.Population.initial_producer_proportion
+
+
+        # The abundance of each genotype at each population. Each row holds
+        # the abundances of one population. The in-place engine uses the
+        # narrowest type that can hold them.
+        if params.Simulation.engine == 'inplace':
+            dtype = abundance_dtype(params=params, topology=self.topology)
+        else:
+            dtype = np.uint32
+
+        self.abundances = np.zeros((len(self.topology), 2**(genome_length + 1)),
+                                   dtype=dtype)
 
+        # Whether or not each population was diluted in the last cycle
+        self.diluted = np.ones(len(self.topology), dtype=bool)
+
+        # Whether or not the abundances of each population were last replaced
+        # by signed integers (see Population.signed_counts)
+        self.signed_counts = np.zeros(len(self.topology), dtype=bool)
 
         # Create each of the populations
         for n, d in self.topology.nodes_iter(data=True):
-            d['population'] = Population(metapopulation=self, config=config)
+            d['population'] = Population(metapopulation=self, params=params,
+                                         index=n, rng=self.initialization_rng)
 
             if initial_state == 'corners':
                 # Place all producers in one corner and all non-producers in
@@ -169,49 +214,95 @@ class Metapopulation(object):
 
                 d['population'].abundances[0] = num_producers
                 d['population'].abundances[2**genome_length] = num_nonproducers
-                d['population'].bottleneck(survival_rate=mutation_rate_tolerance)
+                d['population'].bottleneck(survival_rate=self.mutation_rate_tolerance)
+
+            # Once initialized, each population draws from its own stream.
+            # The in-place engine draws from the dynamics stream instead, so
+            # it does not need them.
+            if params.Simulation.engine != 'inplace':
+                d['population'].rng = self.random_stream(STREAM_POPULATION, n)
+
+        # The in-place engine carries out each step of the cycle for all
+        # populations at once. Otherwise, each population is handled in turn.
+        if params.Simulation.engine == 'inplace':
+            self.engine = InPlaceEngine(metapopulation=self)
+        else:
+            self.engine = None
+
+        self.setup_times.append(('populations', time.time() - tic))
+        tic = time.time()
 
         # How frequently should the metapopulation be mixed?
-        self.mix_frequency = self.config.getint(section='Metapopulation',
-                                                option='mix_frequency')
-        assert self.mix_frequency >= 0
+        self.mix_frequency = params.Metapopulation.mix_frequency
 
 
         # How frequently should the environment be changed?
         self.environment_changed = False
-        self.env_change_frequency = self.config.getint(section='Metapopulation',
-                                                       option='env_change_frequency')
-        assert self.env_change_frequency >= 0
+        self.env_change_frequency = params.Metapopulation.env_change_frequency
 
 
-        data_dir = self.config.get(section='Simulation', option='data_dir')
-        self.log_demographics = self.config.getboolean(section='Simulation',
-                                                       option='log_demographics')
-        self.log_genotypes = self.config.getboolean(section='Simulation',
-                                                    option='log_genotypes')
-        self.log_fitness = self.config.getboolean(section='Simulation',
-                                                  option='log_fitness')
+        data_dir = params.Simulation.data_dir
+        self.log_demographics = params.Simulation.log_demographics
+        self.log_genotypes = params.Simulation.log_genotypes
+        self.log_fitness = params.Simulation.log_fitness
+        self.log_summary = params.Simulation.log_summary
+        self.log_trajectory = params.Simulation.log_trajectory
+        self.log_spatial = params.Simulation.log_spatial
 
         # log_objects is a list of any logging objects used by this simulation
         self.log_objects = []
+        self.log_schedule = LogSchedule(metapopulation=self)
 
 
         if self.log_demographics:
+            from DemographicsOutput import DemographicsOutput
             out_demographics = DemographicsOutput(metapopulation=self,
                                                   filename=os.path.join(data_dir, 'demographics.csv.bz2'))
 
             self.log_objects.append(out_demographics)
 
         if self.log_genotypes:
+            from GenotypesOutput import GenotypesOutput
             out_genotypes = GenotypesOutput(metapopulation=self,
                                             filename=os.path.join(data_dir, 'genotypes.csv.bz2'))
             self.log_objects.append(out_genotypes)
 
         if self.log_fitness:
+            from FitnessOutput import FitnessOutput
             out_fitness = FitnessOutput(metapopulation=self,
                                         filename=os.path.join(data_dir, 'fitness.csv.bz2'))
             self.log_objects.append(out_fitness)
 
+        if self.log_summary:
+            from SummaryOutput import SummaryOutput
+            out_summary = SummaryOutput(metapopulation=self,
+                                        filename=os.path.join(data_dir, 'summary.csv.bz2'))
+            self.log_objects.append(out_summary)
+
+        if self.log_trajectory:
+            from TrajectoryOutput import TrajectoryOutput
+            out_trajectory = TrajectoryOutput(metapopulation=self,
+                                              filename=os.path.join(data_dir, 'trajectory.dat'))
+            self.log_objects.append(out_trajectory)
+
+        if self.log_spatial:
+            from SpatialOutput import SpatialOutput, TileOutput
+            out_spatial = SpatialOutput(metapopulation=self,
+                                        filename=os.path.join(data_dir, 'spatial.csv.bz2'),
+                                        bins=params.Simulation.spatial_bins)
+            self.log_objects.append(out_spatial)
+
+            # Tiles are only defined for lattices
+            if self.topology_type in ['moore', 'vonneumann']:
+                p = getattr(params, TOPOLOGY_SECTIONS[self.topology_type])
+                out_tiles = TileOutput(metapopulation=self, rows=p.height,
+                                       columns=p.width,
+                                       tile_size=params.Simulation.spatial_tile_size,
+                                       filename=os.path.join(data_dir, 'tiles.csv.bz2'))
+                self.log_objects.append(out_tiles)
+
+        self.setup_times.append(('outputs', time.time() - tic))
+
 
     def __repr__(self):
         """Return a string representation of the Metapopulation object"""
@@ -239,44 +330,101 @@ class Metapopulation(object):
 
         return res
 
+    def random_stream(self, *key):
+        """Get a source of random numbers
+
+        With paired random streams, this is a numpy.random.RandomState seeded
+        with the simulation's seed and the given key. Otherwise, it is
+        numpy.random, which draws from NumPy's global generator.
+
+        * key: integers identifying the stream
+
+        """
+        if self.paired_streams:
+            return np.random.RandomState([self.params.Simulation.seed] + list(key))
+        return np.random
+
+    def build_topology(self, builder, **params):
+        """Build the topology connecting the populations
+
+        The topology is built by calling builder, one of the functions in the
+        topology module, with the given parameters. If a cache directory is
+        configured, the structure of the topology is stored there and re-used
+        by later runs with the same builder and parameters. Randomly-generated
+        topologies are only cached when a seed is given. Topologies generated
+        by networkx or listing neighbors in its order are keyed on the
+        versions of networkx and Python too, since the graph drawn from a
+        seed and the order of neighbors may differ between versions.
+
+        """
+
+        if not self.caching or params.get('seed', True) in (None, 0):
+            return builder(**params)
+
+        def build():
+            g = builder(**params)
+            arrays = {'indptr': g.indptr, 'indices': g.indices}
+            if g.positions is not None:
+                arrays['positions'] = g.positions
+            return (arrays, {'name': g.name})
+
+        key_params = dict(params)
+        if builder in (topology.smallworld, topology.regular) or \
+                params.get('networkx_order'):
+            import networkx as nx
+            key_params['networkx'] = nx.__version__
+            key_params['python'] = '{0}.{1}'.format(*sys.version_info[:2])
+
+        arrays, attributes = self.get_cached(builder.__name__, key_params,
+                                             build=build)
+
+        return topology.Graph(indptr=arrays['indptr'],
+                              indices=arrays['indices'],
+                              name=attributes['name'],
+                              positions=arrays.get('positions'))
+
+    def get_cached(self, builder, params, build):
+        """Get precomputed arrays from the caches, building and storing them
+        if necessary (see cache.Cache.get)"""
+        if cache.shared is not None:
+            return cache.shared.get(builder, params, build=build,
+                                    backing=self.cache)
+        return self.cache.get(builder, params, build=build)
+
     def build_fitness_landscape(self):
         """Build a fitness landscape
 
         """
 
-        genome_length = self.config.getint(section='Population',
-                                           option='genome_length')
-        base_fitness = self.config.getfloat(section='Population',
-                                            option='base_fitness')
-        production_cost = self.config.getfloat(section='Population',
-                                               option='production_cost')
-        exponential = self.config.getboolean(section='Population',
-                                             option='fitness_exponential')
-        avg_effect = self.config.getfloat(section='Population',
-                                          option='fitness_avg_effect')
-        min_effect = self.config.getfloat(section='Population',
-                                          option='fitness_min_effect')
-
-        assert genome_length >= 0
-        assert base_fitness >= 0
+        genome_length = self.params.Population.genome_length
+        base_fitness = self.params.Population.base_fitness
+        production_cost = self.params.Population.production_cost
+        exponential = self.params.Population.fitness_exponential
+        avg_effect = self.params.Population.fitness_avg_effect
+        min_effect = self.params.Population.fitness_min_effect
 
         if exponential:
-            effects = np.random.exponential(scale=avg_effect,
-                                            size=genome_length)
+            effects = self.landscape_rng.exponential(scale=avg_effect,
+                                                     size=genome_length)
         else:
-            effects = np.random.uniform(low=min_effect,
-                                        high=2*avg_effect-min_effect,
-                                        size=genome_length)
+            effects = self.landscape_rng.uniform(low=min_effect,
+                                                 high=2*avg_effect-min_effect,
+                                                 size=genome_length)
 
         effects = np.append(-1.0*production_cost, effects)
 
-        landscape = np.zeros(2**(genome_length + 1))
+        # Each genotype's fitness is the sum of the effects of its 1 bits,
+        # with the social locus as the highest-order bit. The effects are
+        # added one locus at a time, in the same order as summing each
+        # genotype's effects, so the result is the same.
+        genotypes = np.arange(2**(genome_length + 1))
+        landscape = np.zeros(genotypes.size)
 
-        for i in range(2**(genome_length + 1)):
-            genotype = genome.base10_as_bitarray(i)
-            genotype = np.append(np.zeros(len(effects) - len(genotype)),
-                                 genotype)
-            landscape[i] = sum(genotype * effects) + (base_fitness + production_cost)
+        for locus, effect in enumerate(effects):
+            bits = (genotypes >> (genome_length - locus)) & 1
+            landscape += bits * effect
+
+        landscape += base_fitness + production_cost
 
         return landscape
 
@@ -295,12 +443,9 @@ class Metapopulation(object):
         
         """
 
-        genome_length = self.config.getint(section='Population',
-                                           option='genome_length')
-        mutation_rate_social = self.config.getfloat(section='Population',
-                                                    option='mutation_rate_social')
-        mutation_rate_adaptation = self.config.getfloat(section='Population',
-                                                        option='mutation_rate_adaptation')
+        genome_length = self.params.Population.genome_length
+        mutation_rate_social = self.params.Population.mutation_rate_social
+        mutation_rate_adaptation = self.params.Population.mutation_rate_adaptation
 
         S = np.vstack((np.array([[0]*2**genome_length + [1]*2**genome_length]).repeat(repeats=2**genome_length, axis=0),
                        np.array([[1]*2**genome_length + [0]*2**genome_length]).repeat(repeats=2**genome_length, axis=0)))
@@ -344,32 +489,49 @@ class Metapopulation(object):
             taking the floor.
 
         """
+        if self.engine is not None:
+            self.engine.dilute(stochastic=stochastic)
+            return
+
         for n, d in self.topology.nodes_iter(data=True):
             d['population'].dilute(stochastic=stochastic)
 
     def mix(self):
         """Mix the population
 
-        Mix the population. The abundances at all populations are combined and
-        re-distributed.
+        Mix the population. The individuals at all populations are pooled and
+        re-distributed among the populations, with each individual equally
+        likely to be placed in any population. The pooled abundance of each
+        genotype is split among all populations with a single multinomial
+        draw, so the number of individuals of each genotype is conserved.
         """
 
-        abundances = np.zeros(self.fitness_landscape.size, dtype=np.int)
+        pooled = self.abundances.sum(axis=0)
+        num_populations = len(self.topology)
+        probs = np.ones(num_populations) / num_populations
 
-        for n, d in self.topology.nodes_iter(data=True):
-            abundances += d['population'].abundances
+        # Genotypes that are absent remain absent everywhere
+        for genotype in np.flatnonzero(pooled):
+            self.abundances[:, genotype] = self.rng.multinomial(pooled[genotype], probs)
 
-        for n, d in self.topology.nodes_iter(data=True):
-            d['population'].abundances = binomial(abundances, 1.0/len(self.topology))
+        self.signed_counts.fill(True)
 
 
     def grow(self):
         """Grow the metapopulation ...."""
+        if self.engine is not None:
+            self.engine.grow()
+            return
+
         for n, d in self.topology.nodes_iter(data=True):
             d['population'].grow()
 
     def mutate(self):
         """Mutate the metapopulation ...."""
+        if self.engine is not None:
+            self.engine.mutate()
+            return
+
         for n, d in self.topology.nodes_iter(data=True):
             d['population'].mutate()
 
@@ -384,6 +546,10 @@ class Metapopulation(object):
         if self.migration_rate == 0:
             return
 
+        if self.engine is not None:
+            self.engine.migrate()
+            return
+
         for n, d in self.topology.nodes_iter(data=True):
             pop = d['population']
 
@@ -391,10 +557,10 @@ class Metapopulation(object):
             if self.migration_dest.lower() == 'single':
                 migrants = pop.select_migrants(migration_rate=self.migration_rate)
 
-                if binomial(n=1, p=self.migration_p_far, size=None) == 1:
-                    neighbor_index = random_integers(low=0,high=self.topology.number_of_nodes()-1)
+                if pop.rng.binomial(n=1, p=self.migration_p_far, size=None) == 1:
+                    neighbor_index = pop.rng.random_integers(low=0,high=self.topology.number_of_nodes()-1)
                 else:
-                    neighbor_index = nchoice(self.topology.neighbors(n))
+                    neighbor_index = pop.rng.choice(self.topology.neighbors(n))
 
                 neighbor = self.topology.node[neighbor_index]['population']
                 neighbor.add_immigrants(migrants)
@@ -404,8 +570,8 @@ class Metapopulation(object):
             elif self.migration_dest.lower() == 'neighbors':
                 num_neighbors = self.topology.degree(n)
                 for neighbor_node in self.topology.neighbors_iter(n):
-                    if binomial(n=1, p=self.migration_p_far, size=None) == 1: 
-                        neighbor_node = random_integers(low=0,high=self.topology.number_of_nodes()-1)
+                    if pop.rng.binomial(n=1, p=self.migration_p_far, size=None) == 1: 
+                        neighbor_node = pop.rng.random_integers(low=0,high=self.topology.number_of_nodes()-1)
                     migrants = pop.select_migrants(migration_rate=self.migration_rate/num_neighbors)
                     neighbor = self.topology.node[neighbor_node]['population']
                     neighbor.add_immigrants(migrants)
@@ -413,7 +579,14 @@ class Metapopulation(object):
 
 
     def census(self):
-        """Update each population's abundance to account for migration"""
+        """Update each population's abundance to account for migration
+
+        The in-place engine adds migrants directly, so this does nothing when
+        it is used.
+        """
+        if self.engine is not None:
+            return
+
         for n, d in self.topology.nodes_iter(data=True):
             d['population'].census()
 
@@ -430,16 +603,27 @@ class Metapopulation(object):
         self.migrate()
         self.census()
 
-        self.write_logfiles()
+        mixing = self.mix_frequency > 0 and self.time > 0 and \
+                (self.time % self.mix_frequency == 0)
+        changing = self.env_change_frequency > 0 and self.time > 0 and \
+                (self.time % self.env_change_frequency == 0)
 
-        if self.mix_frequency > 0 and self.time > 0 and \
-                (self.time % self.mix_frequency == 0):
+        self.write_logfiles(reason=self.log_schedule.reason(time=self.time,
+                                                            mixing=mixing,
+                                                            changing=changing))
+
+        if mixing:
             self.mix()
 
-        if self.env_change_frequency > 0 and self.time > 0 and \
-                (self.time % self.env_change_frequency == 0):
+            if self.log_schedule.adaptive:
+                self.write_logfiles(reason='after_mix')
+
+        if changing:
             self.change_environment()
             self.environment_changed = True
+
+            if self.log_schedule.adaptive:
+                self.write_logfiles(reason='after_change')
         else:
             self.dilute(stochastic=self.dilution_stochastic)
             self.environment_changed = False
@@ -456,16 +640,30 @@ class Metapopulation(object):
         individuals of each genotype that survive this event are proportional to
         the abundance of that genotype times the mutation rate (representing
         individuals that acquired the mutation that allows them to persist).
+
+        This is done for all populations at once. Since the survivors of each
+        genotype are a binomial sample of its abundance, and sums of binomial
+        samples with the same probability are themselves binomial, the
+        abundances are first collapsed to the two genotypes with reset loci and
+        the survivors of each are then drawn.
         """
 
         self.fitness_landscape = self.build_fitness_landscape()
 
-        mutation_rate_tolerance = self.config.getfloat(section='Population',
-                                                       option='mutation_rate_tolerance')
+        # Genotypes below this index are non-producers
+        first_producer = self.abundances.shape[1] // 2
 
-        for n, d in self.topology.nodes_iter(data=True):
-            d['population'].bottleneck(survival_rate=mutation_rate_tolerance)
-            d['population'].reset_loci()
+        nonproducers = self.abundances[:, :first_producer].sum(axis=1,
+                                                               dtype=np.int64)
+        producers = self.abundances[:, first_producer:].sum(axis=1,
+                                                            dtype=np.int64)
+
+        self.abundances.fill(0)
+        self.abundances[:, 0] = self.rng.binomial(nonproducers,
+                                                  self.mutation_rate_tolerance)
+        self.abundances[:, first_producer] = self.rng.binomial(producers,
+                                                               self.mutation_rate_tolerance)
+        self.signed_counts.fill(True)
 
     def size(self):
         """Return the size of the metapopulation
@@ -473,7 +671,7 @@ class Metapopulation(object):
         The size of the metapopulation is the sum of the sizes of the
         subpopulations
         """
-        return sum(len(d['population']) for n, d in self.topology.nodes_iter(data=True))
+        return self.abundances.sum()
 
     def __len__(self):
         """Return the length of a Metapopulation
@@ -486,7 +684,7 @@ class Metapopulation(object):
 
     def num_producers(self):
         """Return the number of producers in the metapopulation"""
-        return sum(d['population'].num_producers() for n, d in self.topology.nodes_iter(data=True))
+        return self.abundances[:, self.abundances.shape[1] // 2:].sum()
 
     def prop_producers(self):
         """Get the proportion of producers in the metapopulation"""
@@ -506,12 +704,80 @@ class Metapopulation(object):
 
         return (prod_max, nonprod_max)
 
-    def write_logfiles(self):
-        """Write any log files"""
+    def write_logfiles(self, reason='interval'):
+        """Write any log files
+
+        * reason: the reason the state is being logged (see LogSchedule). If
+            None, nothing is written.
+
+        """
+        if reason is None:
+            return
 
-        if self.time % self.log_frequency == 0:
-            for l in self.log_objects:
-                l.update(time=self.time)
+        for l in self.log_objects:
+            l.log(time=self.time, reason=reason)
+
+        self.log_schedule.logged(time=self.time, reason=reason)
+
+    def get_state(self):
+        """Get a copy of the state of the metapopulation
+
+        The state contains the time, the abundances, whether each population
+        was diluted, the fitness landscape, and the structure of the topology.
+        It can be given to restore_state to continue from this point, for
+        example to run several continuations of one burn-in.
+        """
+        return {'time': self.time,
+                'abundances': self.abundances.copy(),
+                'diluted': self.diluted.copy(),
+                'fitness_landscape': self.fitness_landscape.copy(),
+                'environment_changed': self.environment_changed,
+                'indptr': np.asarray(self.topology.indptr),
+                'indices': np.asarray(self.topology.indices)}
+
+    def save_state(self, filename):
+        """Save the state of the metapopulation to a file
+
+        The state (see get_state) is saved as a NumPy .npz file, which can be
+        read with numpy.load and given to restore_state.
+
+        * filename: the name of the file. If it does not end in .npz, that is
+            added.
+
+        """
+        np.savez(filename, **self.get_state())
+
+    def restore_state(self, state):
+        """Continue from a saved state
+
+        The metapopulation takes on the time, abundances, and fitness
+        landscape of the state. Other parameters can differ from those of the
+        metapopulation that the state came from, but the topology and genome
+        length must be the same.
+
+        * state: a dict (from get_state) or file (from save_state, read with
+            numpy.load) containing the state
+
+        """
+        assert state['abundances'].shape == self.abundances.shape, \
+                'The state has a different number of populations or genotypes'
+        assert np.array_equal(state['indptr'], self.topology.indptr) and \
+                np.array_equal(state['indices'], self.topology.indices), \
+                'The state has a different topology. Random topologies must be given the same seed.'
+        assert state['abundances'].max() <= np.iinfo(self.abundances.dtype).max, \
+                'The abundances of the state are too large for this engine'
+
+        # The arrays are updated in place, since the populations and engine
+        # refer to them
+        self.abundances[...] = state['abundances']
+        self.diluted[...] = state['diluted']
+        self.fitness_landscape = np.array(state['fitness_landscape'])
+        self.environment_changed = bool(state['environment_changed'])
+        self.time = int(state['time'])
+
+        if self.engine is not None:
+            # Every population may have changed
+            self.engine.known = None
 
     def cleanup(self):
         for l in self.log_objects:
@@ -11,6 +11,33 @@ class OutputWriter(object):
         self.outfile = bz2.BZ2File(self.filename, 'w')
         self.writer = csv.writer(self.outfile, delimiter=delimiter)
 
+        # With the adaptive log schedule, each row includes the reason the
+        # state was logged
+        self.write_reasons = metapopulation.params.Simulation.log_schedule == 'adaptive'
+        self.reason = None
+
+    def writeheader(self, columns):
+        """Write the names of the columns"""
+        if self.write_reasons:
+            columns = columns + ['Reason']
+        self.writer.writerow(columns)
+
+    def writerow(self, row):
+        """Write a row of data"""
+        if self.write_reasons:
+            row = row + [self.reason]
+        self.writer.writerow(row)
+
+    def log(self, time, reason):
+        """Log the state of the metapopulation
+
+        * time: the current time
+        * reason: the reason the state is being logged (see LogSchedule)
+
+        """
+        self.reason = reason
+        self.update(time=time)
+
     def update(self, time):
         pass
 
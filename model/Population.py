@@ -3,8 +3,6 @@
 import numpy as np
 from numpy import sum as nsum
 from numpy import zeros as zeros
-from numpy.random import binomial
-from numpy.random import multinomial
 
 import genome
 
@@ -37,41 +35,32 @@ class Population(object):
 
     """
 
-    def __init__(self, metapopulation, config):
-        """Initialize a Population object"""
+    def __init__(self, metapopulation, params, index, rng=np.random):
+        """Initialize a Population object
+
+        * metapopulation: the Metapopulation containing this population
+        * params: a Parameters object containing the parameter values
+        * index: the row of the metapopulation's abundances array that holds
+            this population's abundances
+        * rng: the source of random numbers, either numpy.random (default) or
+            a numpy.random.RandomState
+
+        """
         self.metapopulation = metapopulation
-        self.config = config
-
-        self.genome_length = config.getint(section='Population',
-                                           option='genome_length')
-        self.mutation_rate_tolerance = config.getfloat(section='Population',
-                                                       option='mutation_rate_tolerance')
-        self.mutation_rate_social = config.getfloat(section='Population',
-                                                    option='mutation_rate_social')
-        self.mutation_rate_adaptation = config.getfloat(section='Population',
-                                                        option='mutation_rate_adaptation')
-        self.dilution_factor = config.getfloat(section='Population',
-                                               option='dilution_factor')
-        self.dilution_prob_min = config.getfloat(section='Population',
-                                                 option='dilution_prob_min')
-        self.capacity_min = config.getint(section='Population',
-                                          option='capacity_min')
-        self.capacity_max = config.getint(section='Population',
-                                          option='capacity_max')
-        self.production_cost = config.getfloat(section='Population',
-                                          option='production_cost')
-        self.initialize = config.get(section='Population',
-                                     option='initialize')
-
-        assert self.genome_length >= 0, 'genome_length must be non-negative'
-        assert self.mutation_rate_tolerance >= 0 and self.mutation_rate_tolerance <= 1
-        assert self.mutation_rate_social >= 0 and self.mutation_rate_social <= 1
-        assert self.mutation_rate_adaptation >= 0 and self.mutation_rate_adaptation <= 1
-        assert self.dilution_factor >=0 and self.dilution_factor <= 1, 'dilution_factor must be between 0 and 1'
-        assert self.dilution_prob_min >=0 and self.dilution_prob_min <= 1, 'dilution_prob_min must be between 0 and 1'
-        assert self.capacity_min >= 0
-        assert self.capacity_max >= 0 and self.capacity_max >= self.capacity_min
-        assert self.initialize.lower() in ['empty', 'random'], "initialize must be one of 'empty', 'random'"
+        self.params = params
+        self.index = index
+        self.rng = rng
+
+        self.genome_length = params.Population.genome_length
+        self.mutation_rate_tolerance = params.Population.mutation_rate_tolerance
+        self.mutation_rate_social = params.Population.mutation_rate_social
+        self.mutation_rate_adaptation = params.Population.mutation_rate_adaptation
+        self.dilution_factor = params.Population.dilution_factor
+        self.dilution_prob_min = params.Population.dilution_prob_min
+        self.capacity_min = params.Population.capacity_min
+        self.capacity_max = params.Population.capacity_max
+        self.production_cost = params.Population.production_cost
+        self.initialize = params.Population.initialize
 
         # Create an empty population
         if self.initialize.lower() == 'empty':
@@ -82,6 +71,51 @@ class Population(object):
         self.delta = zeros(self.abundances.size, dtype=np.int32)
         self.diluted = True
 
+    @property
+    def abundances(self):
+        """The abundance of each genotype in the population
+
+        The abundances of all populations are stored together in the
+        metapopulation's abundances array, with one row per population, so
+        that operations on the whole metapopulation can be vectorized. This is
+        a view of this population's row, and assigning to it fills the row.
+        """
+        return self.metapopulation.abundances[self.index]
+
+    @abundances.setter
+    def abundances(self, value):
+        # Updates made in place, as by census, keep the type of the row
+        if not np.may_share_memory(value, self.metapopulation.abundances):
+            self.signed_counts = value.dtype.kind == 'i'
+        self.metapopulation.abundances[self.index] = value
+
+    @property
+    def diluted(self):
+        """Whether or not the population was diluted in the last cycle
+
+        Like the abundances, this is stored in an array in the metapopulation.
+        """
+        return self.metapopulation.diluted[self.index]
+
+    @diluted.setter
+    def diluted(self, value):
+        self.metapopulation.diluted[self.index] = value
+
+    @property
+    def signed_counts(self):
+        """Whether or not the abundances were last replaced by signed integers
+
+        Earlier versions kept each population's abundances in their own
+        array, whose type was that of the array last assigned to it, and wrote
+        counts derived from them as integers only when it was signed. Like the
+        abundances, this is stored in an array in the metapopulation.
+        """
+        return self.metapopulation.signed_counts[self.index]
+
+    @signed_counts.setter
+    def signed_counts(self, value):
+        self.metapopulation.signed_counts[self.index] = value
+
     def __repr__(self):
         """Return a string representation of a Population object"""
         res = "Population: Size {s}, {p:.1%} producers".format(s=self.size(),
@@ -94,9 +128,9 @@ class Population(object):
 
     def randomize(self):
         """Create a random population"""
-        self.abundances = np.random.random_integers(low=0,
-                                                    high=self.capacity_min,
-                                                    size=2**(self.genome_length+1))
+        self.abundances = self.rng.random_integers(low=0,
+                                                  high=self.capacity_min,
+                                                  size=2**(self.genome_length+1))
 
 
     def dilute(self, stochastic=True):
@@ -114,10 +148,10 @@ class Population(object):
 
         prob_dilute = self.dilution_prob_min + (1.0 - self.dilution_prob_min) * self.prop_producers()
 
-        if prob_dilute == 1 or binomial(n=1, p=prob_dilute, size=1)[0]:
+        if prob_dilute == 1 or self.rng.binomial(n=1, p=prob_dilute, size=1)[0]:
             self.diluted = True
             if stochastic:
-                self.abundances = binomial(self.abundances, self.dilution_factor)
+                self.abundances = self.rng.binomial(self.abundances, self.dilution_factor)
             else:
                 self.abundances = np.floor(self.abundances * self.dilution_factor).astype(np.uint32)
         else:
@@ -149,7 +183,7 @@ class Population(object):
 
         if nsum(grow_probs) > 0:
             norm_grow_probs = grow_probs/nsum(grow_probs)
-            self.abundances = multinomial(final_size, norm_grow_probs, 1)[0]
+            self.abundances = self.rng.multinomial(final_size, norm_grow_probs, 1)[0]
 
 
     def mutate(self):
@@ -172,9 +206,9 @@ class Population(object):
         mutated_population = zeros(self.abundances.size, dtype=np.uint32)
 
         for i in np.nonzero(self.abundances)[0]:
-            mutated_population += multinomial(self.abundances[i],
-                                              self.metapopulation.mutation_probs[i],
-                                              size=1)[0]
+            mutated_population += self.rng.multinomial(self.abundances[i],
+                                                       self.metapopulation.mutation_probs[i],
+                                                       size=1)[0]
 
         self.abundances = mutated_population
 
@@ -189,7 +223,7 @@ class Population(object):
 
         assert migration_rate >= 0 and migration_rate <= 1
 
-        migrants = binomial(self.abundances, migration_rate)
+        migrants = self.rng.binomial(self.abundances, migration_rate)
 
         return migrants
 
@@ -235,7 +269,7 @@ class Population(object):
         num_producers = self.num_producers()                                    
         num_nonproducers = self.num_nonproducers()                              
 
-        self.abundances = zeros(self.abundances.size, dtype=np.int)      
+        self.abundances.fill(0)
         self.abundances[0] = num_nonproducers                                   
         self.abundances[2**self.genome_length] = num_producers              
 
@@ -251,7 +285,7 @@ class Population(object):
         assert survival_rate >= 0
         assert survival_rate <= 1
 
-        self.abundances = binomial(self.abundances, survival_rate)
+        self.abundances = self.rng.binomial(self.abundances, survival_rate)
 
     def size(self):
         """Get the size of the population"""
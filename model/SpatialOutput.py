@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from OutputWriter import OutputWriter
+
+
+def census(abundances):
+    """Get the size, proportion of producers, and occupancy of each population
+
+    The proportion of producers is 0 for empty populations.
+
+    * abundances: array of genotype abundances with one row per population
+
+    """
+    first_producer = abundances.shape[1] // 2
+    sizes = abundances.sum(axis=1, dtype=np.int64)
+    producers = abundances[:, first_producer:].sum(axis=1, dtype=np.int64)
+    occupied = sizes > 0
+    prop_producers = 1.0 * producers / np.maximum(sizes, 1)
+    return sizes, producers, prop_producers, occupied
+
+
+def edge_arrays(topology):
+    """Get the source and target of each directed edge of a topology.Graph"""
+    degree = np.diff(np.asarray(topology.indptr, dtype=np.int64))
+    sources = np.repeat(np.arange(degree.size), degree)
+    targets = np.asarray(topology.indices, dtype=np.int64)
+    return sources, targets
+
+
+def morans_i(values, sources, targets):
+    """Calculate Moran's I for values on a graph with unit edge weights
+
+    Returns 'NA' if there are no edges or the values do not vary.
+
+    * values: the value at each node
+    * sources, targets: the endpoints of each directed edge
+
+    """
+    if sources.size == 0:
+        return 'NA'
+
+    z = values - values.mean()
+    denominator = np.dot(z, z)
+    if denominator == 0:
+        return 'NA'
+
+    return float(values.size * np.dot(z[sources], z[targets]) / (sources.size * denominator))
+
+
+def components(num_nodes, sources, targets):
+    """Label the connected components of a graph
+
+    Components are found by repeatedly hooking the root of each edge's larger
+    label to its smaller label and then following labels to their roots, so
+    the number of passes grows with the logarithm of the size of the
+    components rather than their diameter. Returns the label of each node,
+    which is the smallest node in its component.
+
+    * num_nodes: the number of nodes
+    * sources, targets: the endpoints of each edge
+
+    """
+    labels = np.arange(num_nodes)
+
+    while True:
+        source_labels = labels[sources]
+        target_labels = labels[targets]
+        differ = source_labels != target_labels
+        if not differ.any():
+            return labels
+
+        high = np.maximum(source_labels[differ], target_labels[differ])
+        low = np.minimum(source_labels[differ], target_labels[differ])
+        np.minimum.at(labels, high, low)
+
+        while True:
+            roots = labels[labels]
+            if np.array_equal(roots, labels):
+                break
+            labels = roots
+
+
+class SpatialOutput(OutputWriter):
+    """Write coarse-grained statistics of the spatial structure
+
+    Each row describes the metapopulation at one time with the number of
+    occupied populations, a histogram of the proportion of producers among
+    occupied populations, Moran's I of the proportion of producers among
+    neighboring occupied populations, and the number, mean size, and largest
+    size of producer clusters: groups of connected occupied populations in
+    which producers are the majority. The size of each row does not depend on
+    the number of populations.
+
+    * bins: the number of equal-width histogram bins between 0 and 1
+
+    """
+
+    def __init__(self, metapopulation, filename='spatial.csv.bz2', bins=10,
+                 delimiter=','):
+        super(SpatialOutput, self).__init__(metapopulation=metapopulation,
+                                            filename=filename,
+                                            delimiter=delimiter)
+
+        self.bins = bins
+        self.sources, self.targets = edge_arrays(metapopulation.topology)
+
+        self.writeheader(['Time', 'N', 'MoransI', 'ProducerClusters',
+                          'MeanProducerClusterSize', 'LargestProducerCluster'] +
+                         ['Bin{b}'.format(b=b+1) for b in range(bins)])
+
+    def update(self, time):
+        sizes, producers, prop_producers, occupied = census(self.metapopulation.abundances)
+
+        histogram = np.histogram(prop_producers[occupied], bins=self.bins,
+                                 range=(0, 1))[0]
+
+        # Only edges between occupied populations are considered
+        both = occupied[self.sources] & occupied[self.targets]
+        sources = self.sources[both]
+        targets = self.targets[both]
+
+        # Renumber the occupied populations so that empty ones do not count
+        # towards the mean
+        number = np.cumsum(occupied) - 1
+        moran = morans_i(prop_producers[occupied], number[sources],
+                         number[targets])
+
+        majority = prop_producers > 0.5
+        members = np.flatnonzero(majority)
+        if members.size == 0:
+            clusters = [0, 'NA', 0]
+        else:
+            within = majority[sources] & majority[targets]
+            labels = components(num_nodes=majority.size,
+                                sources=sources[within],
+                                targets=targets[within])
+            cluster_sizes = np.bincount(labels[members])
+            cluster_sizes = cluster_sizes[cluster_sizes > 0]
+            clusters = [cluster_sizes.size, float(cluster_sizes.mean()),
+                        int(cluster_sizes.max())]
+
+        self.writerow([time, int(occupied.sum()), moran] + clusters +
+                      histogram.tolist())
+
+
+class TileOutput(OutputWriter):
+    """Write averages over square tiles of a lattice
+
+    The lattice is divided into tiles of tile_size by tile_size populations,
+    starting from its first row and column, so tiles at the far edges may be
+    smaller. Each row describes one tile at one time with the number of
+    occupied populations, the proportion of producers in the tile, and the
+    mean proportion of producers among its occupied populations.
+
+    * rows, columns: the dimensions of the lattice
+    * tile_size: the width and height of each tile, in populations
+
+    """
+
+    def __init__(self, metapopulation, rows, columns, tile_size=10,
+                 filename='tiles.csv.bz2', delimiter=','):
+        super(TileOutput, self).__init__(metapopulation=metapopulation,
+                                         filename=filename,
+                                         delimiter=delimiter)
+
+        self.tile_rows = -(-rows // tile_size)
+        self.tile_columns = -(-columns // tile_size)
+
+        # The row-major position of each population
+        nodes = metapopulation.topology.positions
+        if nodes is None:
+            nodes = np.arange(rows * columns)
+        self.tiles = (nodes // columns // tile_size) * self.tile_columns + \
+                     (nodes % columns) // tile_size
+        self.num_tiles = self.tile_rows * self.tile_columns
+
+        self.writeheader(['Time', 'TileRow', 'TileColumn', 'N',
+                          'ProducerProportion', 'MeanProducerProportion'])
+
+    def update(self, time):
+        sizes, producers, prop_producers, occupied = census(self.metapopulation.abundances)
+
+        n = self.num_tiles
+        num_occupied = np.bincount(self.tiles, weights=occupied, minlength=n)
+        tile_sizes = np.bincount(self.tiles, weights=sizes, minlength=n)
+        tile_producers = np.bincount(self.tiles, weights=producers, minlength=n)
+        prop_sums = np.bincount(self.tiles, weights=prop_producers, minlength=n)
+
+        for tile in range(n):
+            if num_occupied[tile] == 0:
+                values = [0, 'NA', 'NA']
+            else:
+                values = [int(num_occupied[tile]),
+                          tile_producers[tile] / tile_sizes[tile],
+                          prop_sums[tile] / num_occupied[tile]]
+
+            self.writerow([time, tile // self.tile_columns,
+                           tile % self.tile_columns] + values)
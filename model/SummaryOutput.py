@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+from OutputWriter import OutputWriter
+
+
+def population_structure(params):
+    """Describe the population structure as in the PopulationStructure column
+    of the result data sets
+
+    Well-mixed (complete) topologies are 'well-mixed, N', and regular
+    topologies are 'NA', since the data sets describe them with the Treatment
+    and Degree columns instead (see treatment_values). Von Neumann lattices and
+    small-world topologies do not appear in the data sets, so they are
+    described in the same form as lattices.
+    """
+    topology = params.Metapopulation.topology.lower()
+
+    if topology == 'moore':
+        p = params.MooreTopology
+        if p.width * p.height == 1:
+            return 'single'
+        return 'lattice, {w}x{h}'.format(w=p.width, h=p.height)
+    elif topology == 'vonneumann':
+        p = params.VonNeumannTopology
+        return 'vonneumann lattice, {w}x{h}'.format(w=p.width, h=p.height)
+    elif topology == 'smallworld':
+        return 'smallworld, {s}'.format(s=params.SmallWorldTopology.size)
+    elif topology == 'complete':
+        return 'well-mixed, {s}'.format(s=params.CompleteTopology.size)
+    elif topology == 'regular':
+        return 'NA'
+
+
+PARAMETER_COLUMNS = ['GenomeLength', 'PopulationStructure',
+                     'FitnessDistribution', 'MigrationRate',
+                     'MutationRateSocial', 'MutationRateTolerance',
+                     'MutationRateAdaptation', 'ProductionCost',
+                     'MinCarryingCapacity', 'MaxCarryingCapacity', 'MixingFreq',
+                     'EnvChangeFreq', 'Replicate']
+
+# The columns that data/figureS5.csv adds to tell the topologies apart. They
+# are written for runs with regular topologies (see uses_treatments).
+TREATMENT_COLUMNS = ['Treatment', 'Degree']
+
+
+def parameter_values(params):
+    """Get the values of the parameter columns of the result data sets (e.g.,
+    data/figure1.csv) for a run, in the order of PARAMETER_COLUMNS"""
+
+    pop = params.Population
+    meta = params.Metapopulation
+
+    if params.Simulation.replicate is None:
+        replicate = params.Simulation.seed
+    else:
+        replicate = params.Simulation.replicate
+
+    return [pop.genome_length,
+            population_structure(params),
+            'exponential' if pop.fitness_exponential else 'uniform',
+            meta.migration_rate,
+            pop.mutation_rate_social,
+            pop.mutation_rate_tolerance,
+            pop.mutation_rate_adaptation,
+            pop.production_cost,
+            pop.capacity_min,
+            pop.capacity_max,
+            meta.mix_frequency or 'NA',
+            meta.env_change_frequency or 'NA',
+            replicate]
+
+
+def uses_treatments(params):
+    """Whether the PopulationStructure column alone cannot describe a run's
+    topology, so the TREATMENT_COLUMNS are needed"""
+    return params.Metapopulation.topology.lower() == 'regular'
+
+
+def treatment_values(params):
+    """Get the values of the TREATMENT_COLUMNS for a run, as in
+    data/figureS5.csv"""
+    topology = params.Metapopulation.topology.lower()
+
+    if topology == 'moore':
+        p = params.MooreTopology
+        if p.width * p.height == 1:
+            return ['Single Population', 'NA']
+        return ['Lattice', 'NA']
+    elif topology == 'vonneumann':
+        return ['VonNeumann Lattice', 'NA']
+    elif topology == 'smallworld':
+        return ['Smallworld', 'NA']
+    elif topology == 'complete':
+        return ['Complete', 'NA']
+    elif topology == 'regular':
+        degree = params.RegularTopology.degree
+        return ['{d}-Regular'.format(d=degree), degree]
+
+
+def summarize(abundances):
+    """Summarize the state of a metapopulation
+
+    Returns a list containing the number of occupied populations, the
+    proportion of producers in the metapopulation, and the mean proportion of
+    producers among occupied populations. Proportions are 'NA' when there are
+    no individuals.
+
+    * abundances: array of genotype abundances with one row per population
+
+    """
+    first_producer = abundances.shape[1] // 2
+    sizes = abundances.sum(axis=1, dtype=np.int64)
+    producers = abundances[:, first_producer:].sum(axis=1, dtype=np.int64)
+    occupied = sizes > 0
+    num_occupied = int(occupied.sum())
+
+    if num_occupied == 0:
+        return [0, 'NA', 'NA']
+
+    return [num_occupied, 1.0 * producers.sum() / sizes.sum(),
+            float(np.mean(1.0 * producers[occupied] / sizes[occupied]))]
+
+
+SUMMARY_COLUMNS = ['Time', 'N', 'ProducerProportion', 'MeanProducerProportion']
+
+
+class SummaryOutput(OutputWriter):
+    """Write the summaries used in the result data sets
+
+    Each row describes the metapopulation at one time with the number of
+    occupied populations, the proportion of producers overall and the mean
+    among occupied populations, and the run's parameters and replicate, using
+    the same columns as the files in the data directory. Runs with regular
+    topologies also have the Treatment and Degree columns of
+    data/figureS5.csv.
+    """
+
+    def __init__(self, metapopulation, filename='summary.csv.bz2', delimiter=','):
+        super(SummaryOutput, self).__init__(metapopulation=metapopulation,
+                                            filename=filename,
+                                            delimiter=delimiter)
+
+        params = self.metapopulation.params
+        columns = PARAMETER_COLUMNS
+        self.parameter_values = parameter_values(params)
+        if uses_treatments(params):
+            columns = columns + TREATMENT_COLUMNS
+            self.parameter_values += treatment_values(params)
+
+        self.writeheader(SUMMARY_COLUMNS + columns)
+
+    def update(self, time):
+        self.writerow([time] + summarize(self.metapopulation.abundances) +
+                      self.parameter_values)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+
+from InPlaceEngine import abundance_dtype
+
+
+def load_trajectory(data_dir, mode='r'):
+    """Load a trajectory written by TrajectoryOutput
+
+    Returns a memory-mapped array with one entry for each logged time, each
+    holding the abundance of each genotype at each population, and the
+    trajectory's header, which contains the time and reason for each entry.
+    Since the array is memory-mapped, only the parts of it that are used are
+    read from disk.
+
+    * data_dir: the directory containing trajectory.dat and trajectory.json
+    * mode: the mode used to open the array (see numpy.memmap)
+
+    """
+    with open(os.path.join(data_dir, 'trajectory.json'), 'r') as infile:
+        header = json.load(infile)
+
+    if header['shape'][0] == 0:
+        return np.zeros(header['shape'], dtype=header['dtype']), header
+
+    snapshots = np.memmap(os.path.join(data_dir, header['filename']),
+                          dtype=header['dtype'], mode=mode,
+                          shape=tuple(header['shape']))
+    return snapshots, header
+
+
+class TrajectoryOutput(object):
+    """Store the complete state of the metapopulation at each logged time
+
+    Each time the state is logged, the abundances of every genotype at every
+    population are copied into a memory-mapped array file (trajectory.dat)
+    with shape (time, population, genotype). The file is allocated ahead of
+    time for the expected number of logs, and is extended when that is not
+    enough. A JSON header (trajectory.json) gives the array's shape and type
+    and the time and reason for each entry; it is rewritten whenever the array
+    is flushed, so the trajectory of an unfinished run can still be read.
+    Abundances are stored using the narrowest type that can hold them (see
+    abundance_dtype).
+
+    The interface matches that of OutputWriter.
+
+    * metapopulation: the Metapopulation to store
+    * filename: the name of the array file. The header has the same name,
+        with extension .json.
+    * flush_frequency: the number of entries written between flushes
+
+    """
+
+    def __init__(self, metapopulation, filename='trajectory.dat',
+                 flush_frequency=10):
+        self.metapopulation = metapopulation
+        self.filename = filename
+        self.header_filename = os.path.splitext(filename)[0] + '.json'
+        self.flush_frequency = flush_frequency
+
+        params = metapopulation.params
+        self.dtype = np.dtype(abundance_dtype(params=params,
+                                              topology=metapopulation.topology))
+        self.entry_shape = metapopulation.abundances.shape
+
+        self.times = []
+        self.reasons = []
+        self.reason = None
+
+        # The fixed schedule logs a known number of times. Other schedules
+        # start with this and grow as needed.
+        capacity = params.Simulation.num_cycles // params.Simulation.log_frequency + 1
+        self.snapshots = None
+        self.allocate(capacity=max(1, capacity))
+
+    def allocate(self, capacity):
+        """Set the number of entries the array file can hold
+
+        * capacity: the number of entries
+
+        """
+        if self.snapshots is not None:
+            self.snapshots.flush()
+            self.snapshots = None
+
+        entry_size = self.dtype.itemsize * int(np.prod(self.entry_shape))
+
+        # Extending the file with truncate does not write the new space, so
+        # allocation is fast
+        with open(self.filename, 'ab') as outfile:
+            outfile.truncate(capacity * entry_size)
+
+        self.capacity = capacity
+        self.snapshots = np.memmap(self.filename, dtype=self.dtype, mode='r+',
+                                   shape=(capacity,) + self.entry_shape)
+
+    def log(self, time, reason):
+        """Log the state of the metapopulation
+
+        * time: the current time
+        * reason: the reason the state is being logged (see LogSchedule)
+
+        """
+        self.reason = reason
+        self.update(time=time)
+
+    def update(self, time):
+        index = len(self.times)
+
+        if index == self.capacity:
+            self.allocate(capacity=2 * self.capacity)
+
+        self.snapshots[index] = self.metapopulation.abundances
+        self.times.append(time)
+        self.reasons.append(self.reason)
+
+        if len(self.times) % self.flush_frequency == 0:
+            self.flush()
+
+    def flush(self):
+        """Write any stored entries and the header to disk"""
+        self.snapshots.flush()
+
+        header = {'filename': os.path.basename(self.filename),
+                  'dtype': self.dtype.str,
+                  'shape': [len(self.times)] + list(self.entry_shape),
+                  'times': self.times,
+                  'reasons': self.reasons}
+
+        # Write the header atomically, so readers never see a partial header
+        tmpname = self.header_filename + '.tmp'
+        with open(tmpname, 'w') as outfile:
+            json.dump(header, outfile)
+        os.rename(tmpname, self.header_filename)
+
+    def close(self):
+        self.flush()
+        self.snapshots = None
+
+        # Remove the unused space allocated at the end of the file
+        entry_size = self.dtype.itemsize * int(np.prod(self.entry_shape))
+        with open(self.filename, 'ab') as outfile:
+            outfile.truncate(len(self.times) * entry_size)
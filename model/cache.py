@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# Entries written with a different schema version are never re-used. Increase
+# this whenever the layout or meaning of stored arrays changes.
+SCHEMA_VERSION = 2
+
+# The MemoryCache shared by every Metapopulation created in this process, if
+# any. Long-lived processes, such as the workers of server.py, set this so
+# that structures are kept in memory from one run to the next.
+shared = None
+
+
+def entry_key(builder, params):
+    """Get the key identifying the entry for a builder and parameters"""
+    desc = json.dumps({'builder': builder, 'params': params,
+                       'schema': SCHEMA_VERSION}, sort_keys=True)
+    return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+
+class Cache(object):
+    """Content-addressed on-disk cache of precomputed arrays
+
+    Each entry is a directory whose name is a hash of the builder that produced
+    it, the builder's parameters, and SCHEMA_VERSION. Within an entry, each
+    array is stored as a .npy file, and entry.json describes the entry. Arrays
+    are loaded read-only with memory mapping, so runs that use the same entry
+    share its pages through the operating system rather than each holding a
+    private copy.
+
+    Entries are written to a temporary directory and then renamed into place,
+    so concurrent runs never see partially-written entries.
+
+    * directory: the directory in which entries are stored
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, builder, params):
+        """Get the key identifying the entry for a builder and parameters"""
+        return entry_key(builder, params)
+
+    def path(self, builder, params):
+        """Get the directory containing the entry for a builder and parameters"""
+        return os.path.join(self.directory, builder, self.key(builder, params))
+
+    def load(self, builder, params):
+        """Load an entry
+
+        Returns a tuple containing a dict of memory-mapped arrays and a dict of
+        attributes, or None if there is no such entry.
+
+        """
+        entry = self.path(builder, params)
+
+        try:
+            with open(os.path.join(entry, 'entry.json'), 'r') as infile:
+                desc = json.load(infile)
+        except (IOError, OSError):
+            return None
+
+        arrays = {}
+        for name in desc['arrays']:
+            arrays[name] = np.load(os.path.join(entry, name + '.npy'),
+                                   mmap_mode='r')
+
+        return (arrays, desc['attributes'])
+
+    def store(self, builder, params, arrays, attributes=None):
+        """Store a dict of arrays and a dict of attributes as an entry"""
+        entry = self.path(builder, params)
+        parent = os.path.dirname(entry)
+
+        try:
+            os.makedirs(parent)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+
+        for name, array in arrays.items():
+            np.save(os.path.join(tmpdir, name + '.npy'), array)
+
+        with open(os.path.join(tmpdir, 'entry.json'), 'w') as outfile:
+            json.dump({'builder': builder, 'params': params,
+                       'schema': SCHEMA_VERSION, 'arrays': sorted(arrays),
+                       'attributes': attributes or {}}, outfile,
+                      sort_keys=True)
+
+        try:
+            os.rename(tmpdir, entry)
+        except OSError:
+            # Another run stored this entry first
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def get(self, builder, params, build):
+        """Load an entry, building and storing it first if necessary
+
+        * build: a function taking no arguments that returns the arrays and
+            attributes to be stored as a tuple
+
+        """
+        entry = self.load(builder, params)
+
+        if entry is None:
+            arrays, attributes = build()
+            self.store(builder, params, arrays=arrays, attributes=attributes)
+            entry = self.load(builder, params)
+
+        return entry
+
+
+class MemoryCache(object):
+    """In-memory cache of precomputed arrays
+
+    Entries are kept for the life of the process, up to max_entries of them,
+    after which the least recently used entry is dropped. Stored arrays are
+    made read-only, since they are shared by every run that uses them. If a
+    Cache is given when getting an entry, entries not in memory are loaded
+    from (or built and stored in) it.
+
+    * max_entries: the largest number of entries to keep
+
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def get(self, builder, params, build, backing=None):
+        """Get an entry, building it first if necessary
+
+        * build: a function taking no arguments that returns the arrays and
+            attributes to be stored as a tuple
+        * backing: a Cache to load entries from and store them in
+
+        """
+        key = entry_key(builder, params)
+
+        if key in self.entries:
+            entry = self.entries.pop(key)
+        else:
+            if backing is not None:
+                entry = backing.get(builder, params, build=build)
+            else:
+                entry = build()
+
+            for array in entry[0].values():
+                array.flags.writeable = False
+
+        # The most recently used entries are at the end
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+        return entry
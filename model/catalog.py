@@ -0,0 +1,415 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Index run directories in an SQLite catalog for fast querying
+
+Finding the runs with given parameters otherwise means reading the
+configuration of every run. The catalog records, for each run directory (a
+directory containing a configuration.cfg written by hankshaw.py), its
+parameters, seed, model version, status, number of cycles, wall time, and
+output files. Refreshing the catalog only reads runs that are new or whose
+configuration.cfg or run.json has changed since they were indexed, and
+forgets runs whose directories have been removed.
+
+    python catalog.py refresh runs.db data/
+    python catalog.py query runs.db --where Population genome_length 8 \\
+                                    --where Metapopulation topology regular
+
+Each parameter is stored in a column named after its section and option
+(e.g., "Population/genome_length"). Runs written before run.json was
+recorded have the status 'unknown'.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+try:
+    from ConfigParser import SafeConfigParser
+except ImportError:
+    from configparser import SafeConfigParser
+
+# Values can be str or unicode in Python 2
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+from consolidate import find_runs
+from parameters import SCHEMA, Parameters
+
+# The columns describing each run, other than its parameters
+RUN_COLUMNS = [('path', 'TEXT UNIQUE NOT NULL'),
+               ('version', 'TEXT'),
+               ('status', 'TEXT'),
+               ('cycles', 'INTEGER'),
+               ('wall_seconds', 'REAL'),
+               ('started', 'TEXT'),
+               ('finished', 'TEXT'),
+               ('config_mtime', 'REAL'),
+               ('status_mtime', 'REAL'),
+               ('indexed', 'REAL')]
+
+SQL_TYPES = {int: 'INTEGER', float: 'REAL', bool: 'INTEGER', str: 'TEXT'}
+
+BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                  '0': False, 'no': False, 'false': False, 'off': False}
+
+
+def parameter_column(section, option):
+    """Get the name of the column holding a parameter"""
+    return '{s}/{o}'.format(s=section, o=option)
+
+
+def quote(name):
+    """Quote a column name for use in SQL"""
+    return '"{n}"'.format(n=name.replace('"', '""'))
+
+
+def parameter_type(section, option):
+    """Get the type of a parameter
+
+    As in configuration files, option names are not case-sensitive. Raises
+    ValueError if there is no such parameter.
+
+    * section: the parameter's section
+    * option: the parameter's option
+
+    """
+    for s, o, kind, default in SCHEMA:
+        if (s, o) == (section, option.lower()):
+            return kind
+
+    raise ValueError('Unknown parameter: {s} {o}'.format(s=section, o=option))
+
+
+def convert(section, option, value):
+    """Convert a value given as text to the type of a parameter
+
+    * section: the parameter's section
+    * option: the parameter's option
+    * value: the value as text
+
+    """
+    kind = parameter_type(section, option)
+
+    if kind is bool:
+        assert value.lower() in BOOLEAN_STATES, 'Not a boolean: {v}'.format(v=value)
+        return BOOLEAN_STATES[value.lower()]
+    return kind(value)
+
+
+def parse_where(parser, where):
+    """Convert the values of --where arguments to their parameters' types
+
+    Returns a list of (section, option, values) tuples. Unknown parameters
+    and values that cannot be converted are reported through the parser,
+    which exits.
+
+    * parser: the argparse.ArgumentParser that read the arguments
+    * where: a list of (section, option, value) lists, where value may hold
+        several values separated by commas
+
+    """
+    conditions = []
+
+    for section, option, value in where or []:
+        try:
+            values = [convert(section, option, v) for v in value.split(',')]
+        except (ValueError, AssertionError) as e:
+            parser.error('--where {s} {o} {v}: {e}'.format(s=section, o=option,
+                                                           v=value, e=e))
+        conditions.append((section, option, values))
+
+    return conditions
+
+
+def read_version(filename):
+    """Get the model version recorded in a configuration.cfg header"""
+    with open(filename, 'r') as infile:
+        for line in infile:
+            if not line.startswith('#'):
+                break
+            if line.startswith('# hankshaw.py version:'):
+                return line.split(':', 1)[1].strip()
+    return None
+
+
+def mtime(filename):
+    """Get the modification time of a file, or None if it does not exist"""
+    try:
+        return os.path.getmtime(filename)
+    except OSError:
+        return None
+
+
+def describe_run(run_dir):
+    """Read the information indexed for a run
+
+    Returns a dict of column values and a list of (name, size) tuples for
+    the run's files.
+
+    * run_dir: the run's directory
+
+    """
+    config_file = os.path.join(run_dir, 'configuration.cfg')
+    status_file = os.path.join(run_dir, 'run.json')
+
+    config = SafeConfigParser()
+    config.read(config_file)
+    params = Parameters(config)
+
+    row = {'path': run_dir,
+           'version': read_version(config_file),
+           'status': 'unknown',
+           'config_mtime': mtime(config_file),
+           'status_mtime': mtime(status_file),
+           'indexed': time.time()}
+
+    if row['status_mtime'] is not None:
+        with open(status_file, 'r') as infile:
+            desc = json.load(infile)
+        for column in ['status', 'cycles', 'wall_seconds', 'started',
+                       'finished']:
+            row[column] = desc.get(column)
+        row['version'] = desc.get('version', row['version'])
+
+    for section, option, kind, default in SCHEMA:
+        if hasattr(params, section):
+            row[parameter_column(section, option)] = getattr(getattr(params, section), option)
+
+    files = []
+    for name in sorted(os.listdir(run_dir)):
+        filename = os.path.join(run_dir, name)
+        if os.path.isfile(filename):
+            files.append((name, os.path.getsize(filename)))
+
+    return row, files
+
+
+class Catalog(object):
+    """An SQLite index of run directories
+
+    Runs are described by the runs table, with one row per run and one
+    column per parameter (see parameter_column), and their files by the files
+    table. Queries return rows as dicts.
+
+    * filename: the SQLite database file, which is created if needed
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.create()
+
+    def create(self):
+        """Create the tables, adding columns for any new parameters"""
+        db = self.connection
+        columns = ['id INTEGER PRIMARY KEY'] + \
+                  ['{c} {t}'.format(c=quote(c), t=t) for c, t in RUN_COLUMNS]
+        db.execute('CREATE TABLE IF NOT EXISTS runs ({c})'.format(c=', '.join(columns)))
+        db.execute('CREATE TABLE IF NOT EXISTS files (run_id INTEGER NOT NULL '\
+                   'REFERENCES runs(id), name TEXT NOT NULL, size INTEGER, '\
+                   'PRIMARY KEY (run_id, name))')
+
+        existing = set(r[1] for r in db.execute('PRAGMA table_info(runs)'))
+        for section, option, kind, default in SCHEMA:
+            column = parameter_column(section, option)
+            if column not in existing:
+                db.execute('ALTER TABLE runs ADD COLUMN {c} {t}'.format(c=quote(column),
+                                                                         t=SQL_TYPES[kind]))
+        db.commit()
+
+    def close(self):
+        """Close the database"""
+        self.connection.close()
+
+    def refresh(self, paths, quiet=True):
+        """Index new and changed runs in the given directories, and forget
+        runs within them that no longer exist
+
+        Returns the number of runs indexed and the number forgotten.
+
+        * paths: a list of directories containing run directories
+        * quiet: if False, report runs that cannot be read
+
+        """
+        db = self.connection
+        runs = [os.path.abspath(r) for r in find_runs(paths)]
+        found = set(runs)
+
+        known = {}
+        roots = [os.path.join(os.path.abspath(p), '') for p in paths]
+        for row in db.execute('SELECT id, path, config_mtime, status_mtime FROM runs'):
+            path = row['path']
+            if path in found or any((path + os.sep).startswith(r) for r in roots):
+                known[path] = row
+
+        forgotten = [row['id'] for path, row in known.items() if path not in found]
+        for run_id in forgotten:
+            db.execute('DELETE FROM files WHERE run_id = ?', (run_id,))
+            db.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+
+        indexed = 0
+        for run_dir in runs:
+            previous = known.get(run_dir)
+            if previous is not None and \
+                    previous['config_mtime'] == mtime(os.path.join(run_dir, 'configuration.cfg')) and \
+                    previous['status_mtime'] == mtime(os.path.join(run_dir, 'run.json')):
+                continue
+
+            try:
+                row, files = describe_run(run_dir)
+            except Exception as e:
+                if not quiet:
+                    sys.stderr.write('Skipping {d}: {e}\n'.format(d=run_dir, e=e))
+                continue
+
+            if previous is not None:
+                db.execute('DELETE FROM files WHERE run_id = ?', (previous['id'],))
+                db.execute('DELETE FROM runs WHERE id = ?', (previous['id'],))
+
+            columns = sorted(row.keys())
+            cursor = db.execute('INSERT INTO runs ({c}) VALUES ({v})'.format(c=', '.join(quote(c) for c in columns),
+                                                                             v=', '.join('?' * len(columns))),
+                                [row[c] for c in columns])
+            db.executemany('INSERT INTO files (run_id, name, size) VALUES (?, ?, ?)',
+                           [(cursor.lastrowid, name, size) for name, size in files])
+            indexed += 1
+
+        db.commit()
+        return indexed, len(forgotten)
+
+    def query(self, where=None, status=None):
+        """Find the runs with the given parameter values
+
+        Returns a list of dicts, one for each run, ordered by path.
+
+        * where: a list of (section, option, value) tuples. Values given as
+            text are converted to the parameter's type, and lists or tuples
+            of values match any of them.
+        * status: a status or list of statuses to match (e.g., 'complete')
+
+        """
+        clauses = []
+        values = []
+
+        for section, option, value in where or []:
+            # Columns are named after the options as stored, in lower case
+            parameter_type(section, option)
+            option = option.lower()
+            options = value if isinstance(value, (list, tuple)) else [value]
+            options = [convert(section, option, v) if isinstance(v, string_types) else v
+                       for v in options]
+            clauses.append('{c} IN ({v})'.format(c=quote(parameter_column(section, option)),
+                                                 v=', '.join('?' * len(options))))
+            values.extend(options)
+
+        if status is not None:
+            statuses = [status] if isinstance(status, string_types) else list(status)
+            clauses.append('status IN ({v})'.format(v=', '.join('?' * len(statuses))))
+            values.extend(statuses)
+
+        sql = 'SELECT * FROM runs'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY path'
+
+        return [dict(zip(row.keys(), row)) for row in self.connection.execute(sql, values)]
+
+    def files(self, run):
+        """Get a list of (filename, size) tuples for the files of a run
+
+        * run: a run, as returned by query
+
+        """
+        rows = self.connection.execute('SELECT name, size FROM files WHERE '\
+                                       'run_id = ? ORDER BY name', (run['id'],))
+        return [(os.path.join(run['path'], name), size) for name, size in rows]
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='catalog.py',
+                                     description='Index run directories for '\
+                                     'fast querying')
+    subparsers = parser.add_subparsers(dest='action')
+
+    refresh_parser = subparsers.add_parser('refresh', help='Index new and '\
+                                           'changed runs')
+    refresh_parser.add_argument('catalog', metavar='CATALOG',
+                                help='Catalog file')
+    refresh_parser.add_argument('paths', nargs='+', metavar='DIR',
+                                help='Directories containing run directories')
+    refresh_parser.add_argument('--quiet', '-q', action='store_true',
+                                default=False, help='Suppress output messages')
+
+    query_parser = subparsers.add_parser('query', help='Find runs')
+    query_parser.add_argument('catalog', metavar='CATALOG',
+                              help='Catalog file')
+    query_parser.add_argument('--where', '-w', nargs=3,
+                              metavar=('SECTION', 'OPTION', 'VALUE'),
+                              action='append', help='Only find runs with '\
+                              'this parameter value. Separate several values '\
+                              'with commas to match any of them.')
+    query_parser.add_argument('--status', metavar='STATUS', action='append',
+                              help='Only find runs with this status (e.g., '\
+                              'complete)')
+    query_parser.add_argument('--details', action='store_true', default=False,
+                              help='Write every indexed column as CSV, rather '\
+                              'than only the run directories')
+    query_parser.add_argument('--output', '-o', metavar='FILE', help='File '\
+                              'to write (default: standard output)')
+
+    args = parser.parse_args()
+
+    if args.action == 'query':
+        args.where = parse_where(query_parser, args.where)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    if args.action == 'refresh':
+        catalog = Catalog(args.catalog)
+        indexed, forgotten = catalog.refresh(args.paths, quiet=args.quiet)
+        if not args.quiet:
+            print('Indexed {i} runs. Forgot {f} removed runs.'.format(i=indexed,
+                                                                      f=forgotten))
+        catalog.close()
+
+    elif args.action == 'query':
+        assert os.path.exists(args.catalog), 'No such catalog: {c}'.format(c=args.catalog)
+
+        catalog = Catalog(args.catalog)
+        runs = catalog.query(where=args.where, status=args.status)
+        catalog.close()
+
+        outfile = sys.stdout if args.output is None else open(args.output, 'w')
+
+        if args.details:
+            columns = [c for c, t in RUN_COLUMNS] + \
+                      [parameter_column(s, o) for s, o, k, d in SCHEMA]
+            writer = csv.writer(outfile)
+            writer.writerow(columns)
+            for run in runs:
+                writer.writerow(['NA' if run[c] is None else run[c] for c in columns])
+        else:
+            for run in runs:
+                outfile.write(run['path'] + '\n')
+
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Combine the results of many runs into one table
+
+Each run directory (a directory containing a configuration.cfg written by
+hankshaw.py) is reduced to one row per logged time giving the number of
+occupied populations, the proportion of producers, and the mean proportion of
+producers among occupied populations, along with the run's parameters. The
+result has the same columns as the files in the data directory, including
+the Treatment and Degree columns of data/figureS5.csv if any run has a
+regular topology. If any run used the adaptive log schedule, a Reason column
+gives the reason each row was logged ('interval' for runs with the fixed
+schedule), since rows logged before and after mixing or a change of
+environment have the same time.
+
+Runs that wrote a summary.csv.bz2 are read from it directly. Otherwise, the
+run's demographics.csv.bz2 is decompressed and reduced one row at a time, so
+memory use does not depend on the size of the run. Runs are reduced in
+parallel, and their rows are written as soon as each run is done.
+"""
+
+import argparse
+import bz2
+import csv
+import multiprocessing
+import os
+import sys
+
+try:
+    from ConfigParser import SafeConfigParser
+except ImportError:
+    from configparser import SafeConfigParser
+
+from parameters import Parameters
+from SummaryOutput import PARAMETER_COLUMNS, SUMMARY_COLUMNS, \
+                          TREATMENT_COLUMNS, parameter_values, \
+                          treatment_values, uses_treatments
+
+# The statuses of the runs combined from a catalog by default. Runs without a
+# run.json have the status 'unknown' (see catalog.py).
+DEFAULT_STATUSES = ['complete', 'reused', 'unknown']
+
+
+def find_runs(paths):
+    """Find the run directories within the given paths
+
+    * paths: a list of directories to search
+
+    """
+    runs = []
+
+    for path in paths:
+        for dirpath, dirnames, filenames in os.walk(path):
+            if 'configuration.cfg' in filenames:
+                runs.append(dirpath)
+            dirnames.sort()
+
+    return runs
+
+
+def read_parameters(run_dir):
+    """Read the parameters of a run from its stored configuration
+
+    * run_dir: the run's directory
+
+    """
+    config = SafeConfigParser()
+    config.read(os.path.join(run_dir, 'configuration.cfg'))
+    return Parameters(config)
+
+
+def summarize_demographics(filename):
+    """Reduce a demographics file to one summary row per log
+
+    Returns a list of (row, reason) tuples. Rows are read one at a time.
+    Since the rows of each log are written together, only the totals for the
+    current log are kept. With the adaptive log schedule, the logs before and
+    after an event have the same time, so each log is identified by its time
+    and reason.
+
+    * filename: the name of the demographics.csv.bz2 file
+
+    """
+    infile = bz2.BZ2File(filename, 'r')
+    reader = csv.DictReader(infile)
+
+    log = None
+    summaries = []
+
+    for row in reader:
+        if (row['Time'], row.get('Reason', 'interval')) != log:
+            if log is not None:
+                summaries.append((summary_row(log[0], occupied, size,
+                                              producers, prop_producers),
+                                  log[1]))
+            log = (row['Time'], row.get('Reason', 'interval'))
+            occupied = size = producers = 0
+            prop_producers = 0.0
+
+        row_size = int(row['Size'])
+        if row_size > 0:
+            row_producers = int(row['Producers'])
+            occupied += 1
+            size += row_size
+            producers += row_producers
+            prop_producers += 1.0 * row_producers / row_size
+
+    if log is not None:
+        summaries.append((summary_row(log[0], occupied, size, producers,
+                                      prop_producers), log[1]))
+
+    infile.close()
+    return summaries
+
+
+def summary_row(time, occupied, size, producers, prop_producers):
+    """Build a summary row from the totals for one time"""
+    if occupied == 0:
+        return [time, 0, 'NA', 'NA']
+
+    return [time, occupied, 1.0 * producers / size, prop_producers / occupied]
+
+
+def reduce_run(job):
+    """Get the rows of the combined table for one run
+
+    * job: a tuple containing the run's directory, whether to include the
+        treatment columns (see SummaryOutput.TREATMENT_COLUMNS), and whether
+        to include the Reason column
+
+    """
+    run_dir, treatments, reasons = job
+    params = read_parameters(run_dir)
+    values = parameter_values(params)
+    if treatments:
+        values += treatment_values(params)
+
+    summary_file = os.path.join(run_dir, 'summary.csv.bz2')
+    demographics_file = os.path.join(run_dir, 'demographics.csv.bz2')
+
+    if os.path.exists(summary_file):
+        # The parameter columns are filled in from the configuration, so that
+        # every run has the same columns
+        infile = bz2.BZ2File(summary_file, 'r')
+        reader = csv.reader(infile)
+        header = next(reader)
+        reason = header.index('Reason') if 'Reason' in header else None
+        summaries = [(row[:len(SUMMARY_COLUMNS)],
+                      'interval' if reason is None else row[reason])
+                     for row in reader]
+        infile.close()
+    elif os.path.exists(demographics_file):
+        summaries = summarize_demographics(demographics_file)
+    else:
+        summaries = []
+
+    rows = [row + values + ([r] if reasons else []) for row, r in summaries]
+
+    return run_dir, rows
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='consolidate.py',
+                                     description='Combine the results of many runs')
+    parser.add_argument('paths', nargs='+', metavar='DIR',
+                        help='Directories containing run directories')
+    parser.add_argument('--output', '-o', metavar='FILE', help='File to '\
+                        'write (default: standard output). Files ending in '\
+                        '.bz2 are compressed')
+    parser.add_argument('--processes', '-n', metavar='N', type=int,
+                        default=None, help='Number of processes to use '\
+                        '(default: number of CPUs)')
+    parser.add_argument('--catalog', metavar='CATALOG', help='Catalog of '\
+                        'runs to refresh and select runs from (see '\
+                        'catalog.py)')
+    parser.add_argument('--where', '-w', nargs=3,
+                        metavar=('SECTION', 'OPTION', 'VALUE'),
+                        action='append', help='Only combine runs with this '\
+                        'parameter value (requires --catalog). Separate '\
+                        'several values with commas to match any of them.')
+    parser.add_argument('--status', metavar='STATUS', action='append',
+                        help='Only combine runs with this status (requires '\
+                        '--catalog; default: complete, reused, and unknown)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                       help='Suppress output messages')
+
+    args = parser.parse_args()
+
+    assert args.where is None or args.catalog, '--where requires --catalog'
+    assert args.status is None or args.catalog, '--status requires --catalog'
+
+    if args.where:
+        from catalog import parse_where
+        args.where = parse_where(parser, args.where)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    if args.catalog:
+        # Only runs that are new or have changed are read, so selecting runs
+        # from a catalog is fast even when there are many
+        from catalog import Catalog
+        catalog = Catalog(args.catalog)
+        catalog.refresh(args.paths, quiet=args.quiet)
+        roots = [os.path.join(os.path.abspath(p), '') for p in args.paths]
+        # Runs that are still running, failed, or were interrupted are
+        # left out unless asked for
+        status = args.status or DEFAULT_STATUSES
+        runs = [r['path'] for r in catalog.query(where=args.where, status=status)
+                if any(os.path.join(r['path'], '').startswith(root) for root in roots)]
+        catalog.close()
+    else:
+        runs = find_runs(args.paths)
+
+    if args.output is None:
+        outfile = sys.stdout
+    elif args.output.endswith('.bz2'):
+        outfile = bz2.BZ2File(args.output, 'w')
+    else:
+        outfile = open(args.output, 'w')
+
+    # The treatment columns are needed to tell regular topologies apart, as
+    # in data/figureS5.csv
+    run_params = [read_parameters(r) for r in runs]
+    treatments = any(uses_treatments(p) for p in run_params)
+    columns = PARAMETER_COLUMNS + (TREATMENT_COLUMNS if treatments else [])
+
+    # Rows logged before and after an event have the same time, and are told
+    # apart by their reason
+    reasons = any(p.Simulation.log_schedule == 'adaptive' for p in run_params)
+    if reasons:
+        columns = columns + ['Reason']
+
+    jobs = [(r, treatments, reasons) for r in runs]
+
+    writer = csv.writer(outfile)
+    writer.writerow(SUMMARY_COLUMNS + columns)
+
+    if args.processes == 1:
+        results = (reduce_run(j) for j in jobs)
+    else:
+        pool = multiprocessing.Pool(processes=args.processes)
+        results = pool.imap(reduce_run, jobs)
+
+    for run_dir, rows in results:
+        if len(rows) == 0 and not args.quiet:
+            sys.stderr.write('No results in {d}\n'.format(d=run_dir))
+        writer.writerows(rows)
+
+    if args.processes != 1:
+        pool.close()
+        pool.join()
+
+    if outfile is not sys.stdout:
+        outfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Calculate bootstrap confidence intervals for replicate summaries
+
+This does the same calculation as scripts/figsummary.R, which wraps ggplot's
+mean_cl_boot, for every time of every treatment in a table of results (such
+as one written by consolidate.py). For each treatment, the replicates are
+arranged in a matrix with one row per time and one column per replicate, and
+the bootstrap resamples for all times are drawn together. The resulting table
+has the treatment's parameter columns and Time, followed by the mean (y) and
+the lower and upper confidence limits (ymin and ymax), clipped to [0, 1]. It
+can be read in R and plotted with geom_line and geom_ribbon.
+
+Tables from runs with the adaptive log schedule have a Reason column, and the
+rows logged before and after mixing or a change of environment have the same
+time. These are kept apart by their step (see LogSchedule.step), which is
+written in a Step column after Time. A table with two rows for the same time,
+step, and replicate of a treatment is an error.
+"""
+
+import argparse
+import bz2
+import csv
+import sys
+
+import numpy as np
+
+from LogSchedule import step
+from SummaryOutput import PARAMETER_COLUMNS, TREATMENT_COLUMNS
+
+
+def bootstrap(values, num_resamples=5000, confidence=0.95, random_state=None,
+              chunk_size=2**22):
+    """Calculate bootstrap means and confidence limits for each row
+
+    Returns arrays containing the mean of each row and the lower and upper
+    percentile confidence limits of the mean. Missing values (NaN) are
+    ignored. As with mean_cl_boot, the limits are NaN for rows with fewer than
+    two values.
+
+    * values: a two-dimensional array with one row per time and one column per
+      replicate
+    * num_resamples: the number of bootstrap resamples
+    * confidence: the confidence level
+    * random_state: the numpy.random.RandomState to draw resamples from
+    * chunk_size: the maximum number of values to resample at once. Resamples
+      are drawn in batches no larger than this to limit memory use.
+
+    """
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    values = np.sort(np.asarray(values, dtype=float), axis=1)
+    num_rows, num_columns = values.shape
+
+    # Sorting places missing values after the others, so the values of each
+    # row are in its first counts[i] columns
+    counts = (~np.isnan(values)).sum(axis=1)
+    valid = np.arange(num_columns) < counts[:, np.newaxis]
+    denominators = np.maximum(counts, 1)
+
+    values = np.where(valid, values, 0)
+    means = values.sum(axis=1) / denominators
+    means[counts == 0] = np.nan
+
+    resampled = np.zeros((num_rows, num_resamples))
+    batch = max(1, chunk_size // max(1, num_rows * num_columns))
+    rows = np.arange(num_rows)[:, np.newaxis, np.newaxis]
+
+    for start in range(0, num_resamples, batch):
+        stop = min(start + batch, num_resamples)
+
+        # Draw the resampled column of each value, from among only the
+        # columns with values in its row
+        u = random_state.random_sample((num_rows, stop - start, num_columns))
+        columns = (u * counts[:, np.newaxis, np.newaxis]).astype(np.intp)
+
+        samples = values[rows, columns]
+        samples *= valid[:, np.newaxis, :]
+        samples.sum(axis=2, out=resampled[:, start:stop])
+        resampled[:, start:stop] /= denominators[:, np.newaxis]
+
+    alpha = 100.0 * (1 - confidence) / 2
+    lower = np.percentile(resampled, alpha, axis=1)
+    upper = np.percentile(resampled, 100 - alpha, axis=1)
+    lower[counts < 2] = np.nan
+    upper[counts < 2] = np.nan
+
+    return means, lower, upper
+
+
+def default_group_columns(columns):
+    """Get the parameter columns, other than Replicate, among the given
+    columns"""
+    return [c for c in PARAMETER_COLUMNS + TREATMENT_COLUMNS
+            if c in columns and c != 'Replicate']
+
+
+def read_groups(filename, measure='MeanProducerProportion', group_columns=None):
+    """Read a table of results and split it into treatments
+
+    Returns the list of group columns, a list of (group, times, values)
+    tuples, one per treatment, and whether the table has a Reason column.
+    group is the list of the treatment's values in group_columns, times is
+    the sorted list of (time, step) pairs logged, and values is an array with
+    one row per time and step and one column per replicate. Missing values are
+    NaN. Without a Reason column, every step is 0.
+
+    * filename: the name of the file to read. Files ending in .bz2 are
+      decompressed.
+    * measure: the column to summarize
+    * group_columns: the columns that identify each treatment (default: the
+      table's parameter columns except Replicate)
+
+    """
+    if filename.endswith('.bz2'):
+        infile = bz2.BZ2File(filename, 'r')
+    else:
+        infile = open(filename, 'r')
+
+    reader = csv.DictReader(infile)
+    reasons = 'Reason' in reader.fieldnames
+
+    if group_columns is None:
+        group_columns = default_group_columns(reader.fieldnames)
+
+    groups = {}
+    for row in reader:
+        group = tuple(row[c] for c in group_columns)
+        series = groups.setdefault(group, {})
+        time = (int(float(row['Time'])),
+                step(row['Reason']) if reasons else 0)
+
+        # Rather than keep one of them, refuse rows that cannot be told apart
+        key = (time, row['Replicate'])
+        if key in series:
+            msg = '{f}: more than one row for Time {t}, step {s}, ' \
+                  'Replicate {r} of {g}'.format(f=filename, t=time[0],
+                                                s=time[1], r=row['Replicate'],
+                                                g=', '.join(group))
+            raise ValueError(msg)
+
+        value = row[measure]
+        series[key] = np.nan if value == 'NA' else float(value)
+
+    infile.close()
+
+    result = []
+    for group in sorted(groups):
+        series = groups[group]
+        times = sorted(set(t for t, r in series))
+        replicates = sorted(set(r for t, r in series))
+        time_index = dict((t, i) for i, t in enumerate(times))
+        replicate_index = dict((r, i) for i, r in enumerate(replicates))
+
+        values = np.empty((len(times), len(replicates)))
+        values.fill(np.nan)
+        for (t, r), v in series.items():
+            values[time_index[t], replicate_index[r]] = v
+
+        result.append((list(group), times, values))
+
+    return group_columns, result, reasons
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='figsummary.py',
+                                     description='Calculate bootstrap '\
+                                     'confidence intervals for replicate '\
+                                     'summaries')
+    parser.add_argument('infile', metavar='FILE',
+                        help='Table of results (e.g., from consolidate.py)')
+    parser.add_argument('--output', '-o', metavar='FILE', help='File to '\
+                        'write (default: standard output)')
+    parser.add_argument('--measure', '-m', metavar='COLUMN',
+                        default='MeanProducerProportion',
+                        help='Column to summarize (default: '\
+                        'MeanProducerProportion)')
+    parser.add_argument('--by', metavar='COLUMN', action='append',
+                        help='Column identifying treatments (default: the '\
+                        'parameter columns except Replicate)')
+    parser.add_argument('--resamples', '-B', metavar='B', type=int,
+                        default=5000, help='Number of bootstrap resamples '\
+                        '(default: 5000)')
+    parser.add_argument('--confidence', metavar='C', type=float, default=0.95,
+                        help='Confidence level (default: 0.95)')
+    parser.add_argument('--seed', '-s', metavar='S', type=int, default=0,
+                        help='Set the pseudorandom number generator seed '\
+                        '(default: 0)')
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    random_state = np.random.RandomState(seed=args.seed)
+    group_columns, groups, steps = read_groups(args.infile,
+                                               measure=args.measure,
+                                               group_columns=args.by)
+
+    if args.output is None:
+        outfile = sys.stdout
+    else:
+        outfile = open(args.output, 'w')
+
+    writer = csv.writer(outfile)
+    writer.writerow(group_columns + ['Time'] + (['Step'] if steps else []) +
+                    ['y', 'ymin', 'ymax'])
+
+    for group, times, values in groups:
+        means, lower, upper = bootstrap(values, num_resamples=args.resamples,
+                                        confidence=args.confidence,
+                                        random_state=random_state)
+
+        # Clip the limits to [0, 1] so that ribbons aren't broken
+        np.maximum(lower, 0, out=lower, where=~np.isnan(lower))
+        np.minimum(upper, 1, out=upper, where=~np.isnan(upper))
+
+        for t, y, ymin, ymax in zip(times, means, lower, upper):
+            writer.writerow(group + (list(t) if steps else [t[0]]) +
+                            ['NA' if np.isnan(v) else float(v)
+                             for v in (y, ymin, ymax)])
+
+    if outfile is not sys.stdout:
+        outfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import time
+_start_time = time.time()
+
 import argparse
 import datetime
 import getpass
+import json
 import os
-import shutil
 import signal
 import sys
 import warnings
@@ -15,15 +18,78 @@ try:
 except ImportError:
     from configparser import SafeConfigParser
 
-import networkx as nx
-import numpy as np
-
-from Metapopulation import Metapopulation
+# NumPy and the model are imported in main(), after the command line has been
+# parsed, so that --help and --version do not pay for them. NetworkX is only
+# imported by the model when the chosen topology or output requires it.
 
 __version__ = '1.0.1'
 
-def parse_arguments():
-    """Parse command line arguments"""
+
+def write_configuration(config, data_dir, command, note=None):
+    """Write the configuration of a run and information about how it was run
+    to configuration.cfg in its data directory
+
+    * config: a ConfigParser object containing the configuration
+    * data_dir: the run's data directory
+    * command: the command line that started the run
+    * note: a line of text to add to the header
+
+    """
+    import numpy as np
+
+    cfg_out = os.path.join(data_dir, 'configuration.cfg')
+    with open(cfg_out, 'w') as configfile:
+        configfile.write('# Hankshaw Effect Model Configuration\n')
+        configfile.write('# Generated: {when} by {who}\n'.format(when=datetime.datetime.now().isoformat(),
+                                                                 who=getpass.getuser()))
+        configfile.write('# hankshaw.py version: {v}\n'.format(v=__version__))
+        configfile.write('# Python version: {v}\n'.format(v= ".".join(map(str, sys.version_info[:3]))))
+        configfile.write('# NumPy version: {v}\n'.format(v=np.version.version))
+        if 'networkx' in sys.modules:
+            configfile.write('# NetworkX version: {v}\n'.format(v=sys.modules['networkx'].__version__))
+        configfile.write('# Command: {cmd}\n'.format(cmd=command))
+        if note:
+            configfile.write('# {note}\n'.format(note=note))
+        configfile.write('# {line}\n\n'.format(line='-'*77))
+        config.write(configfile)
+
+
+def write_status(data_dir, status, start_time, cycles=None, info=None):
+    """Record the status of a run in run.json in its data directory
+
+    The file is replaced, so it always describes the latest status. It is
+    read by catalog.py.
+
+    * data_dir: the run's data directory
+    * status: 'running', 'complete', 'failed', 'interrupted', or 'reused'
+    * start_time: the time at which the run started
+    * cycles: the number of cycles that have passed
+    * info: a dict of other information to record
+
+    """
+    now = time.time()
+    desc = {'status': status,
+            'version': __version__,
+            'started': datetime.datetime.fromtimestamp(start_time).isoformat(),
+            'wall_seconds': now - start_time,
+            'cycles': cycles}
+    if status != 'running':
+        desc['finished'] = datetime.datetime.fromtimestamp(now).isoformat()
+    desc.update(info or {})
+
+    # Write a new file and rename it, so the file is never partially written
+    filename = os.path.join(data_dir, 'run.json')
+    with open(filename + '.tmp', 'w') as outfile:
+        json.dump(desc, outfile, sort_keys=True, indent=1)
+    os.rename(filename + '.tmp', filename)
+
+
+def parse_arguments(argv=None):
+    """Parse command line arguments
+
+    * argv: the arguments to parse (default: sys.argv[1:])
+
+    """
 
     parser = argparse.ArgumentParser(prog='hankshaw.py',
                                      description='Run a simluation')
@@ -39,16 +105,51 @@ def parse_arguments():
                         'pseudorandom number generator seed', type=int)
     parser.add_argument('--quiet', '-q', action='store_true', default=False,
                        help='Suppress output messages')
+    parser.add_argument('--timing', action='store_true', default=False,
+                        help='Print a breakdown of startup time')
+    parser.add_argument('--plan', action='store_true', default=False,
+                        help='Print the estimated memory and time needed '\
+                        'and exit without running')
+    parser.add_argument('--resume', metavar='FILE', help='Continue from a '\
+                        'saved state')
+    parser.add_argument('--save-state', metavar='FILE', dest='save_state',
+                        help='Save the final state to a file')
     parser.add_argument('--version', action='version', version=__version__)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
 
-def main():
+def main(argv=None, start_time=None):
+    """Run a simulation
+
+    * argv: the command line arguments (default: sys.argv[1:])
+    * start_time: the time at which the run was requested, used for the
+        startup timing (default: when this module was imported)
+
+    """
+    if start_time is None:
+        start_time = _start_time
+
+    if argv is None:
+        command = ' '.join(sys.argv)
+    else:
+        command = ' '.join(['hankshaw.py'] + list(argv))
+
     # Get the command line arguments
-    args = parse_arguments()
+    args = parse_arguments(argv)
+
+    # startup_times records how long each stage of startup took
+    startup_times = [('interpreter and arguments', time.time() - start_time)]
+    tic = time.time()
+
+    import numpy as np
+    from Metapopulation import Metapopulation
+    from parameters import Parameters
+
+    startup_times.append(('imports', time.time() - tic))
+    tic = time.time()
 
     # Read the configuration file
     config = SafeConfigParser()
@@ -69,10 +170,18 @@ def main():
         seed = np.random.randint(low=0, high=np.iinfo(np.uint32).max)
         config.set(section='Simulation', option='seed', value=str(seed))
 
-    # Set the seed for the pseudorandom number generator
-    if config.has_option(section='Simulation', option='seed'):
-        np.random.seed(seed=config.getint(section='Simulation', option='seed'))
-
+    # Only estimate the memory and time needed, without creating anything
+    if args.plan:
+        import resources
+        params = Parameters(config)
+        print(resources.format_estimate(params=params,
+                                        estimate=resources.estimate(params)))
+        if params.Simulation.engine == 'reference':
+            lean = resources.estimate(params, engine='inplace')
+            print('With the inplace engine: {m} peak memory, {t} per '\
+                  'cycle'.format(m=resources.format_bytes(lean['peak']),
+                                 t=resources.format_seconds(lean['cycle_seconds'])))
+        return
 
     # If the data directory is specified, add it to the config, overwriting any
     # previous value
@@ -98,25 +207,72 @@ def main():
         data_dir = newname
         config.set(section='Simulation', option='data_dir', value=data_dir)
 
+    # Read and validate all parameters
+    params = Parameters(config)
+
+    # Set the seed for the pseudorandom number generator
+    np.random.seed(seed=params.Simulation.seed)
+
+    startup_times.append(('configuration', time.time() - tic))
+
     os.mkdir(data_dir)
 
-    # Write the configuration file and some additional information
-    cfg_out = os.path.join(data_dir, 'configuration.cfg')
-    with open(cfg_out, 'w') as configfile:
-        configfile.write('# Hankshaw Effect Model Configuration\n')
-        configfile.write('# Generated: {when} by {who}\n'.format(when=datetime.datetime.now().isoformat(),
-                                                                 who=getpass.getuser()))
-        configfile.write('# hankshaw.py version: {v}\n'.format(v=__version__))
-        configfile.write('# Python version: {v}\n'.format(v= ".".join(map(str, sys.version_info[:3]))))
-        configfile.write('# NumPy version: {v}\n'.format(v=np.version.version))
-        configfile.write('# NetworkX version: {v}\n'.format(v=nx.__version__))
-        configfile.write('# Command: {cmd}\n'.format(cmd=' '.join(sys.argv)))
-        configfile.write('# {line}\n\n'.format(line='-'*77))
-        config.write(configfile)
+    # If the results of a run with the same configuration and seed are in the
+    # result cache, use them instead of running again. Runs that save their
+    # state are always run.
+    result_cache = None
+    if params.Simulation.result_cache and not args.save_state:
+        import runcache
+        sim = params.Simulation
+        result_cache = runcache.RunCache(directory=sim.result_cache,
+                                         max_size=sim.result_cache_max_size,
+                                         max_age=sim.result_cache_max_age)
+        resumed = runcache.file_hash(args.resume) if args.resume else None
+        key = runcache.config_key(params=params, version=__version__,
+                                  extra={'resume': resumed})
+        entry = result_cache.load(key)
+
+        if entry is not None:
+            result_cache.restore(entry=entry, data_dir=data_dir,
+                                 mode=sim.result_cache_mode)
+            write_configuration(config=config, data_dir=data_dir,
+                                command=command,
+                                note='Results re-used from {e}'.format(e=entry['path']))
+            write_status(data_dir=data_dir, status='reused',
+                         start_time=start_time,
+                         cycles=entry['attributes'].get('cycles'),
+                         info={'entry': entry['path']})
+            if not args.quiet:
+                print('Re-using the results in {e}'.format(e=entry['path']))
+            return
 
 
     # Create and initialize the metapopulation
-    m = Metapopulation(config=config)
+    m = Metapopulation(config=config, params=params)
+
+    # Continue from a saved state, such as the end of a burn-in
+    if args.resume:
+        m.restore_state(np.load(args.resume))
+
+    startup_times.extend(m.setup_times)
+    tic = time.time()
+
+
+    # Write the configuration file and some additional information. This is
+    # done after the metapopulation is created, since that determines whether
+    # NetworkX was needed.
+    write_configuration(config=config, data_dir=data_dir, command=command)
+    write_status(data_dir=data_dir, status='running', start_time=start_time,
+                 cycles=m.time)
+
+    startup_times.append(('write configuration', time.time() - tic))
+
+    if args.timing:
+        sys.stderr.write('Startup time:\n')
+        for stage, seconds in startup_times:
+            sys.stderr.write('  {s:<28}{t:8.3f}s\n'.format(s=stage, t=seconds))
+        sys.stderr.write('  {s:<28}{t:8.3f}s\n'.format(s='total',
+                                                        t=time.time() - start_time))
 
 
     # Handle SIGINFO signals on OS X and BSD
@@ -127,17 +283,38 @@ def main():
         signal.signal(signal.SIGINFO, handle_siginfo)
 
 
-    # Run the simulation
-    for t in range(config.getint(section='Simulation', option='num_cycles')):
-        m.cycle()
+    # Run the simulation until num_cycles cycles have passed. Resumed runs
+    # start at the time of their saved state.
+    try:
+        while m.time < params.Simulation.num_cycles:
+            t = m.time
+            m.cycle()
+
+            if not args.quiet:
+                msg = "[{t}] {m}".format(t=t, m=m)
+                print(msg)
 
-        if not args.quiet:
-            msg = "[{t}] {m}".format(t=t, m=m)
-            print(msg)
+        if args.save_state:
+            m.save_state(args.save_state)
 
-    m.cleanup()
+        m.cleanup()
+    except KeyboardInterrupt:
+        write_status(data_dir=data_dir, status='interrupted',
+                     start_time=start_time, cycles=m.time)
+        raise
+    except Exception:
+        write_status(data_dir=data_dir, status='failed',
+                     start_time=start_time, cycles=m.time)
+        raise
+
+    write_status(data_dir=data_dir, status='complete', start_time=start_time,
+                 cycles=m.time)
+
+    if result_cache is not None:
+        files = [os.path.join(data_dir, f) for f in sorted(os.listdir(data_dir))
+                 if f not in ['configuration.cfg', 'run.json']]
+        result_cache.store(key=key, files=files, attributes={'cycles': m.time})
 
 
 if __name__ == "__main__":
     main()
-
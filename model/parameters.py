@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+# The options read from a configuration. Each entry gives the section, the
+# option, its type, and its default value. Options with a default of REQUIRED
+# must be present in the configuration. Options in the topology sections are
+# only read for the topology being used.
+REQUIRED = object()
+
+SCHEMA = [
+    ('Simulation', 'num_cycles', int, REQUIRED),
+    ('Simulation', 'seed', int, None),
+    ('Simulation', 'replicate', str, None),
+    ('Simulation', 'data_dir', str, 'data'),
+    ('Simulation', 'export_topology', bool, False),
+    ('Simulation', 'topology_format', str, 'gml'),
+    ('Simulation', 'cache_dir', str, ''),
+    ('Simulation', 'result_cache', str, ''),
+    ('Simulation', 'result_cache_mode', str, 'link'),
+    ('Simulation', 'result_cache_max_size', float, 0.0),
+    ('Simulation', 'result_cache_max_age', float, 0.0),
+    ('Simulation', 'engine', str, 'reference'),
+    ('Simulation', 'random_streams', str, 'shared'),
+    ('Simulation', 'memory_budget', float, 0.0),
+    ('Simulation', 'over_budget', str, 'switch'),
+    ('Simulation', 'log_frequency', int, REQUIRED),
+    ('Simulation', 'log_schedule', str, 'fixed'),
+    ('Simulation', 'log_threshold', float, 0.05),
+    ('Simulation', 'log_thinning', float, 2.0),
+    ('Simulation', 'log_max_interval', int, 100),
+    ('Simulation', 'log_demographics', bool, REQUIRED),
+    ('Simulation', 'log_genotypes', bool, REQUIRED),
+    ('Simulation', 'log_fitness', bool, REQUIRED),
+    ('Simulation', 'log_summary', bool, False),
+    ('Simulation', 'log_trajectory', bool, False),
+    ('Simulation', 'log_spatial', bool, False),
+    ('Simulation', 'spatial_tile_size', int, 10),
+    ('Simulation', 'spatial_bins', int, 10),
+
+    ('Metapopulation', 'migration_rate', float, REQUIRED),
+    ('Metapopulation', 'migration_dest', str, REQUIRED),
+    ('Metapopulation', 'migration_p_far', float, REQUIRED),
+    ('Metapopulation', 'topology', str, REQUIRED),
+    ('Metapopulation', 'initial_state', str, REQUIRED),
+    ('Metapopulation', 'mix_frequency', int, 0),
+    ('Metapopulation', 'env_change_frequency', int, 0),
+
+    ('MooreTopology', 'width', int, REQUIRED),
+    ('MooreTopology', 'height', int, REQUIRED),
+    ('MooreTopology', 'radius', int, REQUIRED),
+    ('MooreTopology', 'periodic', bool, REQUIRED),
+
+    ('VonNeumannTopology', 'width', int, REQUIRED),
+    ('VonNeumannTopology', 'height', int, REQUIRED),
+    ('VonNeumannTopology', 'periodic', bool, REQUIRED),
+
+    ('SmallWorldTopology', 'size', int, REQUIRED),
+    ('SmallWorldTopology', 'neighbors', int, REQUIRED),
+    ('SmallWorldTopology', 'edgeprob', float, REQUIRED),
+    ('SmallWorldTopology', 'seed', int, None),
+
+    ('CompleteTopology', 'size', int, REQUIRED),
+
+    ('RegularTopology', 'size', int, REQUIRED),
+    ('RegularTopology', 'degree', int, REQUIRED),
+    ('RegularTopology', 'seed', int, None),
+
+    ('Population', 'genome_length', int, REQUIRED),
+    ('Population', 'mutation_rate_social', float, REQUIRED),
+    ('Population', 'mutation_rate_adaptation', float, REQUIRED),
+    ('Population', 'mutation_rate_tolerance', float, REQUIRED),
+    ('Population', 'dilution_factor', float, REQUIRED),
+    ('Population', 'dilution_prob_min', float, REQUIRED),
+    ('Population', 'dilution_stochastic', bool, REQUIRED),
+    ('Population', 'capacity_min', int, REQUIRED),
+    ('Population', 'capacity_max', int, REQUIRED),
+    ('Population', 'initial_producer_proportion', float, REQUIRED),
+    ('Population', 'production_cost', float, REQUIRED),
+    ('Population', 'initialize', str, REQUIRED),
+    ('Population', 'base_fitness', float, REQUIRED),
+    ('Population', 'fitness_exponential', bool, REQUIRED),
+    ('Population', 'fitness_avg_effect', float, REQUIRED),
+    ('Population', 'fitness_min_effect', float, REQUIRED),
+]
+
+TOPOLOGY_SECTIONS = {'moore': 'MooreTopology',
+                     'vonneumann': 'VonNeumannTopology',
+                     'smallworld': 'SmallWorldTopology',
+                     'complete': 'CompleteTopology',
+                     'regular': 'RegularTopology'}
+
+
+class Section(object):
+    """The parameter values from one section of a configuration"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        values = ', '.join('{o}={v!r}'.format(o=o, v=v) for o, v in
+                           sorted(self.__dict__.items()) if o != 'name')
+        return '{s}({v})'.format(s=self.name, v=values)
+
+
+class Parameters(object):
+    """Typed, validated parameter values
+
+    A Parameters object reads every option used by the model from a
+    configuration once, converts each to its type, fills in defaults, and
+    checks that the values are valid. Values are then available as attributes
+    named after the configuration's sections and options, for example
+    params.Population.genome_length. The configuration itself is not modified.
+
+    * config: a ConfigParser object containing the configuration
+
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        topology = config.get(section='Metapopulation', option='topology')
+        topology_section = TOPOLOGY_SECTIONS.get(topology.lower())
+
+        for section, option, kind, default in SCHEMA:
+            if section.endswith('Topology') and section != topology_section:
+                continue
+
+            if not hasattr(self, section):
+                setattr(self, section, Section(name=section))
+
+            if config.has_option(section=section, option=option):
+                if kind is int:
+                    value = config.getint(section=section, option=option)
+                elif kind is float:
+                    value = config.getfloat(section=section, option=option)
+                elif kind is bool:
+                    value = config.getboolean(section=section, option=option)
+                else:
+                    value = config.get(section=section, option=option).strip()
+            elif default is REQUIRED:
+                # Let the configuration raise its usual error
+                value = config.get(section=section, option=option)
+            else:
+                value = default
+
+            setattr(getattr(self, section), option, value)
+
+        # Random topologies use the simulation's seed unless given their own
+        for section in ['SmallWorldTopology', 'RegularTopology']:
+            if hasattr(self, section) and getattr(self, section).seed is None:
+                getattr(self, section).seed = self.Simulation.seed
+
+        self.validate()
+
+    def validate(self):
+        """Check that the parameter values are valid"""
+        sim = self.Simulation
+        meta = self.Metapopulation
+        pop = self.Population
+
+        assert sim.num_cycles >= 0, 'num_cycles must be non-negative'
+        assert sim.log_frequency > 0, 'log_frequency must be positive'
+        assert sim.log_schedule in ['fixed', 'adaptive'], "log_schedule must be one of 'fixed', 'adaptive'"
+        assert sim.log_threshold >= 0, 'log_threshold must be non-negative'
+        assert sim.log_thinning >= 1, 'log_thinning must be at least 1'
+        assert sim.log_max_interval > 0, 'log_max_interval must be positive'
+        assert sim.spatial_tile_size > 0, 'spatial_tile_size must be positive'
+        assert sim.spatial_bins > 0, 'spatial_bins must be positive'
+        assert sim.topology_format in ['gml', 'edgelist'], "topology_format must be one of 'gml', 'edgelist'"
+        assert sim.engine in ['reference', 'inplace'], "engine must be one of 'reference', 'inplace'"
+        assert sim.random_streams in ['shared', 'paired'], "random_streams must be one of 'shared', 'paired'"
+        assert sim.random_streams == 'shared' or sim.seed is not None, 'paired random streams require a seed'
+        assert sim.memory_budget >= 0, 'memory_budget must be non-negative'
+        assert sim.result_cache_mode in ['link', 'copy'], "result_cache_mode must be one of 'link', 'copy'"
+        assert sim.result_cache_max_size >= 0, 'result_cache_max_size must be non-negative'
+        assert sim.result_cache_max_age >= 0, 'result_cache_max_age must be non-negative'
+        assert sim.over_budget in ['switch', 'refuse'], "over_budget must be one of 'switch', 'refuse'"
+
+        assert meta.migration_rate >= 0 and meta.migration_rate <= 1
+        assert meta.migration_dest in ['single', 'neighbors']
+        assert 0 <= meta.migration_p_far <= 1
+        assert meta.topology.lower() in TOPOLOGY_SECTIONS, 'Unknown topology: {t}'.format(t=meta.topology)
+        assert meta.mix_frequency >= 0
+        assert meta.env_change_frequency >= 0
+
+        if meta.topology.lower() == 'moore':
+            assert self.MooreTopology.width > 0
+            assert self.MooreTopology.height > 0
+            assert self.MooreTopology.radius > 0
+        elif meta.topology.lower() == 'vonneumann':
+            assert self.VonNeumannTopology.width > 0
+            assert self.VonNeumannTopology.height > 0
+        elif meta.topology.lower() == 'smallworld':
+            assert self.SmallWorldTopology.size > 0
+            assert self.SmallWorldTopology.neighbors >= 0
+            assert self.SmallWorldTopology.edgeprob >= 0 and self.SmallWorldTopology.edgeprob <= 1
+        elif meta.topology.lower() == 'complete':
+            assert self.CompleteTopology.size > 0
+        elif meta.topology.lower() == 'regular':
+            assert self.RegularTopology.size > 0
+            assert self.RegularTopology.degree >= 0
+
+        assert pop.genome_length >= 0, 'genome_length must be non-negative'
+        assert pop.mutation_rate_tolerance >= 0 and pop.mutation_rate_tolerance <= 1
+        assert pop.mutation_rate_social >= 0 and pop.mutation_rate_social <= 1
+        assert pop.mutation_rate_adaptation >= 0 and pop.mutation_rate_adaptation <= 1
+        assert pop.dilution_factor >=0 and pop.dilution_factor <= 1, 'dilution_factor must be between 0 and 1'
+        assert pop.dilution_prob_min >=0 and pop.dilution_prob_min <= 1, 'dilution_prob_min must be between 0 and 1'
+        assert pop.capacity_min >= 0
+        assert pop.capacity_max >= 0 and pop.capacity_max >= pop.capacity_min
+        assert pop.initialize.lower() in ['empty', 'random'], "initialize must be one of 'empty', 'random'"
+        assert pop.base_fitness >= 0
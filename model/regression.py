@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Check that runs are identical to those of an earlier version of the model
+
+Changes that are not meant to change results, such as speeding up the
+reference engine, should give exactly the same outputs with the same seed.
+This runs each configuration with each seed using both the model in this
+directory and an earlier version (a copy of its model directory, e.g. from
+git worktree), and compares the contents of the output files they both
+write, after uncompressing them. Only the reference engine can be compared
+this way, since the in-place engine draws random numbers in a different
+order (see validate.py).
+
+    python regression.py --baseline ../../hankshaw-1.0.1/model \\
+                         -c ../configuration/figure3a.cfg --seed 1 --seed 2 \\
+                         -p Simulation num_cycles 100
+
+The first differing line of each file that differs is printed, and the exit
+status is 1 if any file differs or is missing.
+"""
+
+import argparse
+import bz2
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+# Files that describe a run rather than its results
+IGNORED_FILES = ['configuration.cfg', 'run.json']
+
+
+def run(model_dir, config_file, seed, data_dir, params=None):
+    """Run hankshaw.py from a model directory
+
+    * model_dir: the directory containing hankshaw.py
+    * config_file: the configuration file
+    * seed: the seed
+    * data_dir: the directory to write the results to, which must not exist
+    * params: a list of (section, option, value) tuples to set
+
+    """
+    command = [sys.executable, os.path.join(model_dir, 'hankshaw.py'), '-q',
+               '-c', os.path.abspath(config_file), '-s', str(seed),
+               '-d', data_dir]
+    for section, option, value in params or []:
+        command.extend(['-p', section, option, value])
+
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(command, cwd=model_dir, stdout=devnull)
+
+
+def read_lines(filename):
+    """Read the lines of an output file, uncompressing it if needed"""
+    if filename.endswith('.bz2'):
+        infile = bz2.BZ2File(filename, 'r')
+    elif filename.endswith('.gz'):
+        infile = gzip.GzipFile(filename, 'r')
+    else:
+        infile = open(filename, 'rb')
+
+    lines = infile.read().splitlines()
+    infile.close()
+    return lines
+
+
+def compare_runs(baseline_dir, data_dir):
+    """Compare the outputs of two runs
+
+    Returns a list of (filename, message) tuples, one for each output of the
+    baseline run that is missing from or differs in the other run.
+
+    * baseline_dir: the results of the baseline run
+    * data_dir: the results of the run to check
+
+    """
+    differences = []
+
+    for name in sorted(os.listdir(baseline_dir)):
+        if name in IGNORED_FILES:
+            continue
+
+        filename = os.path.join(data_dir, name)
+        if not os.path.exists(filename):
+            differences.append((name, 'missing'))
+            continue
+
+        expected = read_lines(os.path.join(baseline_dir, name))
+        lines = read_lines(filename)
+        for i, (a, b) in enumerate(zip(expected, lines)):
+            if a != b:
+                differences.append((name, 'line {i}: {a!r} != {b!r}'.format(i=i+1,
+                                                                           a=a, b=b)))
+                break
+        else:
+            if len(expected) != len(lines):
+                differences.append((name, '{n} lines != {m} lines'.format(n=len(expected),
+                                                                         m=len(lines))))
+
+    return differences
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='regression.py',
+                                     description='Check that runs are '\
+                                     'identical to those of an earlier '\
+                                     'version of the model')
+    parser.add_argument('--baseline', '-b', metavar='DIR', required=True,
+                        help='Model directory of the earlier version')
+    parser.add_argument('--config', '-c', metavar='FILE', action='append',
+                        dest='configfiles', help='Configuration file to '\
+                        'use. Can be given more than once (default: run.cfg)')
+    parser.add_argument('--seed', '-s', metavar='S', type=int,
+                        action='append', dest='seeds', help='Seed to use. '\
+                        'Can be given more than once (default: 1)')
+    parser.add_argument('--param', '-p', nargs=3, metavar=('SECTION', 'NAME',
+                                                           'VALUE'),
+                        action='append', help='Set a parameter value for '\
+                        'both versions')
+    parser.add_argument('--keep', metavar='DIR', help='Keep the results of '\
+                        'every run in this directory (default: they are '\
+                        'removed)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                       help='Suppress output messages')
+
+    args = parser.parse_args()
+
+    assert os.path.exists(os.path.join(args.baseline, 'hankshaw.py')), \
+            'No hankshaw.py in {d}'.format(d=args.baseline)
+    assert args.keep is None or not os.path.exists(args.keep), \
+            '{d} already exists'.format(d=args.keep)
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    model_dir = os.path.dirname(os.path.abspath(__file__))
+    baseline = os.path.abspath(args.baseline)
+
+    # Only the reference engine can match an earlier version
+    params = [('Simulation', 'engine', 'reference')] + \
+             [tuple(p) for p in args.param or []]
+
+    work_dir = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp()
+    if args.keep:
+        os.makedirs(work_dir)
+
+    failed = False
+    try:
+        for i, config_file in enumerate(args.configfiles or ['run.cfg']):
+            for seed in args.seeds or [1]:
+                run_dir = os.path.join(work_dir, '{i}-seed{s}'.format(i=i,
+                                                                      s=seed))
+                os.mkdir(run_dir)
+                baseline_dir = os.path.join(run_dir, 'baseline')
+                data_dir = os.path.join(run_dir, 'current')
+
+                # The earlier version may not have the engine option
+                run(model_dir=baseline, config_file=config_file, seed=seed,
+                    data_dir=baseline_dir, params=params[1:])
+                run(model_dir=model_dir, config_file=config_file, seed=seed,
+                    data_dir=data_dir, params=params)
+
+                differences = compare_runs(baseline_dir=baseline_dir,
+                                           data_dir=data_dir)
+                failed = failed or len(differences) > 0
+
+                for name, message in differences:
+                    print('DIFFERS {c} seed {s}: {f}: {m}'.format(c=config_file,
+                                                                   s=seed,
+                                                                   f=name,
+                                                                   m=message))
+                if not differences and not args.quiet:
+                    print('same {c} seed {s}'.format(c=config_file, s=seed))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
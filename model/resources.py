@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+"""Estimate the memory and time a run will need
+
+The estimates are made from the parameters alone, before anything is
+allocated, so that runs that cannot fit can be refused or changed up front.
+They are rough: sizes of arrays are exact, but the overhead of Python objects,
+NetworkX graphs, and temporary arrays, and the time per cycle, are based on
+measurements of typical runs.
+"""
+
+import warnings
+
+import numpy as np
+
+from InPlaceEngine import bounded_dtype
+
+
+MB = 1024.0 * 1024.0
+
+# The memory used by the interpreter, NumPy, and the model's modules
+BASE_BYTES = 30 * MB
+
+# The memory used by each Population object and its node in the topology
+POPULATION_BYTES = 1500
+
+# The memory used by each directed edge of a NetworkX graph, which is only
+# held while small-world and random regular topologies, and lattices for the
+# reference engine, are built
+NETWORKX_EDGE_BYTES = 400
+
+# The memory used by each directed edge while a topology is converted to its
+# compact form
+EDGE_BUILD_BYTES = 50
+
+# The memory used by each population's numpy.random.RandomState with paired
+# random streams and the reference engine
+STREAM_BYTES = 5400
+
+# The peak memory used while building the table of mutation probabilities,
+# relative to the size of the table
+MUTATION_TABLE_FACTOR = 14
+
+# The time per cycle for each population, plus the time for each genotype
+# each population can hold, for each engine
+CYCLE_SECONDS = {'reference': (1.3e-4, 1.2e-7),
+                 'inplace': (8e-6, 3e-8)}
+
+
+def topology_size(params):
+    """Estimate the size of the topology
+
+    Returns the number of populations, the number of directed edges, and the
+    largest number of neighbors of any population. For lattices and small-world
+    graphs, the number of edges is an upper bound.
+
+    * params: a Parameters object containing the parameter values
+
+    """
+    topology = params.Metapopulation.topology.lower()
+
+    if topology in ['moore', 'vonneumann']:
+        if topology == 'moore':
+            p = params.MooreTopology
+            neighbors = (2 * p.radius + 1)**2 - 1
+        else:
+            p = params.VonNeumannTopology
+            neighbors = 4
+        num_populations = p.width * p.height
+        max_degree = min(neighbors, num_populations - 1)
+        num_edges = num_populations * max_degree
+
+    elif topology == 'smallworld':
+        p = params.SmallWorldTopology
+        num_populations = p.size
+        neighbors = 2 * (p.neighbors // 2)
+        num_edges = int(num_populations * neighbors * (1 + p.edgeprob))
+        max_degree = min(2 * neighbors, num_populations - 1)
+
+    elif topology == 'complete':
+        num_populations = params.CompleteTopology.size
+        max_degree = num_populations - 1
+        num_edges = num_populations * max_degree
+
+    elif topology == 'regular':
+        p = params.RegularTopology
+        num_populations = p.size
+        max_degree = p.degree
+        num_edges = num_populations * max_degree
+
+    return num_populations, num_edges, max(0, max_degree)
+
+
+def estimate(params, engine=None):
+    """Estimate the memory and time needed for a run
+
+    Returns a dict containing:
+
+    * engine: the engine the estimate is for
+    * num_populations, num_edges, num_genotypes: the size of the model
+    * memory: a list of (component, bytes) tuples for the memory held
+        throughout the run
+    * setup: a list of (component, bytes) tuples for memory that is only
+        needed while the metapopulation is created
+    * peak: the estimated peak memory use in bytes
+    * cycle_seconds: the estimated time per cycle in seconds
+    * disk: a list of (file, bytes) tuples for output files whose size is
+        known in advance
+
+    * params: a Parameters object containing the parameter values
+    * engine: the engine to estimate for (default: Simulation/engine)
+
+    """
+    sim = params.Simulation
+    pop = params.Population
+    engine = engine or sim.engine
+
+    num_populations, num_edges, max_degree = topology_size(params)
+    num_genotypes = 2**(pop.genome_length + 1)
+    entries = num_populations * num_genotypes
+
+    if engine == 'inplace':
+        dtype = np.dtype(bounded_dtype(params=params,
+                                       num_populations=num_populations,
+                                       max_degree=max_degree))
+    else:
+        dtype = np.dtype(np.uint32)
+
+    memory = [('interpreter and modules', BASE_BYTES),
+              ('topology', 8 * (num_populations + 1 + num_edges)),
+              ('populations', POPULATION_BYTES * num_populations),
+              ('abundances', entries * dtype.itemsize)]
+    setup = [('topology construction', EDGE_BUILD_BYTES * num_edges)]
+
+    topology = params.Metapopulation.topology.lower()
+    if topology in ['smallworld', 'regular'] or \
+            (topology in ['moore', 'vonneumann'] and engine == 'reference') or \
+            (sim.export_topology and sim.topology_format == 'gml'):
+        setup.append(('networkx graph', NETWORKX_EDGE_BYTES * num_edges))
+
+    if engine == 'inplace':
+        # The buffer for migration, and the indices, weights, and samples of
+        # the non-zero abundances, which can cover the array
+        memory.append(('engine buffers', 8 * entries + 100 * num_populations))
+        capacity = max(pop.capacity_max, pop.capacity_min)
+        memory.append(('cycle temporaries',
+                       40 * min(entries, num_populations * capacity)))
+    else:
+        table = 8 * num_genotypes**2
+        memory.append(('mutation table', table))
+        if sim.random_streams == 'paired':
+            memory.append(('random streams', STREAM_BYTES * num_populations))
+        memory.append(('cycle temporaries', 64 * num_genotypes))
+        setup.append(('mutation table construction',
+                      (MUTATION_TABLE_FACTOR - 1) * table))
+
+    held = sum(b for c, b in memory)
+    peak = held + max(b for c, b in setup)
+
+    per_population, per_genotype = CYCLE_SECONDS[engine]
+    cycle_seconds = num_populations * (per_population + per_genotype * num_genotypes)
+
+    disk = []
+    if sim.log_trajectory:
+        logs = sim.num_cycles // sim.log_frequency + 1
+        disk.append(('trajectory.dat', logs * entries * dtype.itemsize))
+
+    return {'engine': engine,
+            'num_populations': num_populations,
+            'num_edges': num_edges,
+            'num_genotypes': num_genotypes,
+            'memory': memory,
+            'setup': setup,
+            'peak': peak,
+            'cycle_seconds': cycle_seconds,
+            'disk': disk}
+
+
+def format_bytes(size):
+    """Format a number of bytes for reading"""
+    for unit in ['bytes', 'KB', 'MB', 'GB']:
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024.0
+    if unit == 'bytes':
+        return '{s:d} bytes'.format(s=int(size))
+    return '{s:.1f} {u}'.format(s=size, u=unit)
+
+
+def format_seconds(seconds):
+    """Format a duration for reading"""
+    for unit, length in [('days', 86400), ('hours', 3600), ('minutes', 60)]:
+        if seconds >= length:
+            return '{s:.1f} {u}'.format(s=seconds / length, u=unit)
+    return '{s:.2g} seconds'.format(s=seconds)
+
+
+def format_estimate(params, estimate):
+    """Describe an estimate (see estimate) as text"""
+    lines = ['Populations: {p} ({e} directed edges)'.format(p=estimate['num_populations'],
+                                                           e=estimate['num_edges']),
+             'Genotypes: {g}'.format(g=estimate['num_genotypes']),
+             'Engine: {e}'.format(e=estimate['engine']),
+             '',
+             'Memory held during the run:']
+
+    for component, size in estimate['memory']:
+        lines.append('  {c:<32}{s:>12}'.format(c=component, s=format_bytes(size)))
+
+    lines.append('Memory needed while starting:')
+    for component, size in estimate['setup']:
+        lines.append('  {c:<32}{s:>12}'.format(c=component, s=format_bytes(size)))
+
+    lines.append('{c:<34}{s:>12}'.format(c='Estimated peak memory:',
+                                         s=format_bytes(estimate['peak'])))
+
+    num_cycles = params.Simulation.num_cycles
+    lines.append('Estimated time: {c} per cycle, {t} for {n} cycles'.format(c=format_seconds(estimate['cycle_seconds']),
+                                                                          t=format_seconds(estimate['cycle_seconds'] * num_cycles),
+                                                                          n=num_cycles))
+
+    for filename, size in estimate['disk']:
+        lines.append('Disk: {f} {s}'.format(f=filename, s=format_bytes(size)))
+
+    budget = params.Simulation.memory_budget
+    if budget > 0:
+        fits = estimate['peak'] <= budget * MB
+        lines.append('Memory budget: {b} ({f})'.format(b=format_bytes(budget * MB),
+                                                     f='fits' if fits else 'exceeded'))
+
+    return '\n'.join(lines)
+
+
+def check_budget(params, config=None):
+    """Check that a run fits within Simulation/memory_budget
+
+    If the estimated peak memory exceeds the budget and
+    Simulation/over_budget is 'switch', the in-place engine is used instead
+    of the reference engine when it fits, and params (and config, if given)
+    are changed to match. Otherwise, MemoryError is raised before anything is
+    allocated. Returns the estimate for the engine that will be used, or None
+    if there is no budget.
+
+    * params: a Parameters object containing the parameter values
+    * config: the ConfigParser object params was read from
+
+    """
+    sim = params.Simulation
+    if sim.memory_budget <= 0:
+        return None
+
+    budget = sim.memory_budget * MB
+    result = estimate(params)
+    if result['peak'] <= budget:
+        return result
+
+    if sim.engine == 'reference' and sim.over_budget == 'switch':
+        lean = estimate(params, engine='inplace')
+        if lean['peak'] <= budget:
+            msg = 'Estimated peak memory {p} exceeds the budget of {b}. '\
+                  'Using the inplace engine ({l}).'.format(p=format_bytes(result['peak']),
+                                                         b=format_bytes(budget),
+                                                         l=format_bytes(lean['peak']))
+            warnings.warn(msg)
+
+            sim.engine = 'inplace'
+            if config is not None:
+                config.set(section='Simulation', option='engine',
+                           value='inplace')
+            return lean
+
+    largest = max(result['memory'] + result['setup'], key=lambda c: c[1])
+    msg = 'Estimated peak memory {p} exceeds the budget of {b} (largest: '\
+          '{c}, {s}). Use hankshaw.py --plan for details.'.format(p=format_bytes(result['peak']),
+                                                                b=format_bytes(budget),
+                                                                c=largest[0],
+                                                                s=format_bytes(largest[1]))
+    raise MemoryError(msg)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Re-use the results of runs that have already been done
+
+Runs are identified by their effective configuration: the value of every
+option used by the model after command line overrides and the seed are
+applied, converted to its type, together with the model's version. Options
+that only say where files go are left out. Runs with the same key produce the
+same results, so a run whose key is in the cache can re-use the stored
+outputs instead of running again. Changing the model's version
+(hankshaw.__version__) invalidates every entry.
+
+Run as a script, this removes entries from a cache:
+
+    python runcache.py cache/results --max-size 10000 --max-age 30
+"""
+
+import argparse
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from parameters import SCHEMA
+
+# Entries written with a different schema version are never re-used. Increase
+# this whenever the layout of entries changes.
+SCHEMA_VERSION = 1
+
+# Options that do not affect the results of a run
+IGNORED_OPTIONS = [('Simulation', 'data_dir'),
+                   ('Simulation', 'cache_dir'),
+                   ('Simulation', 'result_cache'),
+                   ('Simulation', 'result_cache_mode'),
+                   ('Simulation', 'result_cache_max_size'),
+                   ('Simulation', 'result_cache_max_age')]
+
+
+def config_key(params, version, extra=None):
+    """Get the key identifying the results of a run
+
+    * params: a Parameters object containing the parameter values
+    * version: the version of the model
+    * extra: anything else that affects the results, such as a hash of the
+        state a run continues from. It must be serializable as JSON.
+
+    """
+    values = {}
+    for section, option, kind, default in SCHEMA:
+        if (section, option) in IGNORED_OPTIONS or not hasattr(params, section):
+            continue
+        values['{s}/{o}'.format(s=section, o=option)] = getattr(getattr(params, section), option)
+
+    desc = json.dumps({'config': values, 'version': version, 'extra': extra,
+                       'schema': SCHEMA_VERSION}, sort_keys=True)
+    return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+
+def file_hash(filename):
+    """Get the SHA-1 hash of a file's contents"""
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as infile:
+        for block in iter(lambda: infile.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class RunCache(object):
+    """On-disk store of the results of runs
+
+    Each entry is a directory named by its key (see config_key) containing
+    the run's output files and entry.json, which describes the entry and may
+    hold other results (attributes). Files are hard-linked into the entry when
+    possible, so storing them takes no extra space. Entries are written to a
+    temporary directory and then renamed into place, so concurrent runs never
+    see partially-written entries.
+
+    The modification time of each entry.json records when the entry was last
+    used. After each entry is stored, entries not used for more than max_age
+    days are removed, followed by the least recently used entries until the
+    cache is no larger than max_size megabytes.
+
+    * directory: the directory in which entries are stored
+    * max_size: the largest size of the cache in megabytes (0 for no limit)
+    * max_age: the largest number of days since an entry was used (0 for no
+        limit)
+
+    """
+
+    def __init__(self, directory, max_size=0, max_age=0):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def path(self, key):
+        """Get the directory containing the entry for a key"""
+        return os.path.join(self.directory, key[:2], key)
+
+    def load(self, key):
+        """Load an entry, marking it as used
+
+        Returns a dict describing the entry, which includes its directory
+        ('path'), its files ('files'), and its attributes ('attributes'), or
+        None if there is no such entry.
+
+        """
+        entry = self.path(key)
+        desc_file = os.path.join(entry, 'entry.json')
+
+        try:
+            with open(desc_file, 'r') as infile:
+                desc = json.load(infile)
+            os.utime(desc_file, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        desc['path'] = entry
+        return desc
+
+    def store(self, key, files=None, attributes=None):
+        """Store the results of a run as an entry
+
+        * key: the run's key
+        * files: a list of the names of the run's output files
+        * attributes: a dict of other results, which must be serializable as
+            JSON
+
+        """
+        entry = self.path(key)
+        parent = os.path.dirname(entry)
+
+        try:
+            os.makedirs(parent)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+
+        names = []
+        for filename in files or []:
+            name = os.path.basename(filename)
+            try:
+                os.link(filename, os.path.join(tmpdir, name))
+            except (OSError, AttributeError):
+                shutil.copy2(filename, os.path.join(tmpdir, name))
+            names.append(name)
+
+        with open(os.path.join(tmpdir, 'entry.json'), 'w') as outfile:
+            json.dump({'key': key, 'schema': SCHEMA_VERSION,
+                       'files': sorted(names),
+                       'attributes': attributes or {}}, outfile,
+                      sort_keys=True)
+
+        try:
+            os.rename(tmpdir, entry)
+        except OSError:
+            # Another run stored this entry first
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        self.evict()
+
+    def restore(self, entry, data_dir, mode='link'):
+        """Place the files of an entry in a data directory
+
+        * entry: the entry, as returned by load
+        * data_dir: the directory in which to place the files
+        * mode: 'link' to hard-link the stored files where possible, or
+            'copy' to copy them. Hard links keep the files when their entry
+            is removed.
+
+        """
+        for name in entry['files']:
+            source = os.path.join(entry['path'], name)
+            destination = os.path.join(data_dir, name)
+            if mode == 'link':
+                try:
+                    os.link(source, destination)
+                    continue
+                except (OSError, AttributeError):
+                    pass
+            shutil.copy2(source, destination)
+
+    def entries(self):
+        """Get a list of (directory, size in bytes, time last used) tuples
+        for the stored entries"""
+        entries = []
+
+        if not os.path.isdir(self.directory):
+            return entries
+
+        for prefix in os.listdir(self.directory):
+            parent = os.path.join(self.directory, prefix)
+            if not os.path.isdir(parent):
+                continue
+
+            for name in os.listdir(parent):
+                entry = os.path.join(parent, name)
+                try:
+                    used = os.path.getmtime(os.path.join(entry, 'entry.json'))
+                    size = sum(os.path.getsize(os.path.join(entry, f))
+                               for f in os.listdir(entry))
+                except OSError:
+                    # Being written or removed by another run
+                    continue
+                entries.append((entry, size, used))
+
+        return entries
+
+    def evict(self):
+        """Remove old entries and the least recently used entries
+
+        Returns the number of entries removed.
+        """
+        if self.max_size <= 0 and self.max_age <= 0:
+            return 0
+
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for entry, size, used in entries)
+        oldest = time.time() - self.max_age * 86400
+        removed = 0
+
+        for entry, size, used in entries:
+            too_old = self.max_age > 0 and used < oldest
+            too_big = self.max_size > 0 and total > self.max_size * 1024 * 1024
+            if not (too_old or too_big):
+                continue
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+
+        return removed
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='runcache.py',
+                                     description='Remove entries from a '\
+                                     'cache of run results')
+    parser.add_argument('directory', metavar='DIR', help='Cache directory')
+    parser.add_argument('--max-size', metavar='MB', type=float, default=0,
+                        help='Remove the least recently used entries until '\
+                        'the cache is no larger than this (default: no '\
+                        'limit)')
+    parser.add_argument('--max-age', metavar='DAYS', type=float, default=0,
+                        help='Remove entries not used for this many days '\
+                        '(default: no limit)')
+
+    args = parser.parse_args()
+
+    assert args.max_size >= 0, 'max-size must be non-negative'
+    assert args.max_age >= 0, 'max-age must be non-negative'
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    cache = RunCache(directory=args.directory, max_size=args.max_size,
+                     max_age=args.max_age)
+    removed = cache.evict()
+    entries = cache.entries()
+
+    print('Removed {r} entries. {n} entries remain, using {s:.1f} MB.'.format(r=removed,
+                                                                          n=len(entries),
+                                                                          s=sum(e[1] for e in entries) / 1024.0 / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
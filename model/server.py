@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run simulations in long-lived worker processes
+
+Starting hankshaw.py for each run pays for starting the interpreter,
+importing the model, and building the topology and mutation table every
+time, which dominates the time taken by short runs. The server keeps a pool
+of worker processes that have already imported the model, and each worker
+keeps the topologies and mutation tables it has built in memory (see
+cache.MemoryCache), so later runs with the same structure skip building
+them. Several runs are carried out at once, one in each worker.
+
+Start the server, then submit runs with the same arguments as hankshaw.py:
+
+    python server.py serve --processes 4 &
+    python server.py submit -- -c run.cfg -s 1 -d data/run1
+    python server.py submit --jobs jobs.txt
+    python server.py stop
+
+Each line of a jobs file holds the arguments of one run. Runs write their
+results exactly as hankshaw.py does, with relative paths taken from the
+directory submit is run in. submit waits for its runs to finish, and exits
+with status 1 if any of them failed.
+
+The server and clients communicate over a Unix socket. Each message is a
+JSON object on one line. Requests are runs ({"id": ..., "cwd": ..., "args":
+[...]}) or commands ({"command": "status"} or {"command": "stop"}), and
+replies to runs give their id, status ('ok' or 'error'), duration, and
+anything they printed.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shlex
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(),
+                              'hankshaw-{u}.sock'.format(u=os.getuid()))
+
+
+def start_worker(max_entries):
+    """Prepare a worker process: import the model and keep structures in
+    memory between runs
+
+    * max_entries: the number of structures to keep (see cache.MemoryCache)
+
+    """
+    import cache
+    import hankshaw
+    import Metapopulation
+
+    cache.shared = cache.MemoryCache(max_entries=max_entries)
+
+
+def run_job(job):
+    """Run hankshaw.py's main function in a worker
+
+    Returns a reply giving the run's id, status, duration, and output.
+
+    * job: a dict with the run's id, working directory, and arguments
+
+    """
+    import hankshaw
+
+    start_time = time.time()
+    output = StringIO()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output
+
+    try:
+        os.chdir(job['cwd'])
+        hankshaw.main(argv=[str(a) for a in job['args']],
+                      start_time=start_time)
+        status = 'ok'
+    except SystemExit as e:
+        # Raised by argparse for bad arguments and --help
+        status = 'ok' if not e.code else 'error'
+    except Exception:
+        traceback.print_exc(file=output)
+        status = 'error'
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+    return {'id': job.get('id'), 'status': status,
+            'seconds': time.time() - start_time, 'output': output.getvalue()}
+
+
+def send(conn, lock, message):
+    """Send a message as a line of JSON"""
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    with lock:
+        conn.sendall(data)
+
+
+class Server(object):
+    """Accept runs over a Unix socket and carry them out in a worker pool
+
+    * path: the path of the socket
+    * processes: the number of worker processes (default: number of CPUs)
+    * max_entries: the number of structures each worker keeps in memory
+
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, processes=None, max_entries=32):
+        self.path = path
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(processes=self.processes,
+                                         initializer=start_worker,
+                                         initargs=(max_entries,))
+        self.running = 0
+        self.finished = 0
+        self.counts_lock = threading.Lock()
+        self.stopping = False
+
+        if os.path.exists(path):
+            os.remove(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(16)
+
+    def serve(self):
+        """Accept connections until a stop command is received"""
+        try:
+            while not self.stopping:
+                try:
+                    conn, address = self.socket.accept()
+                except socket.error:
+                    if self.stopping:
+                        break
+                    raise
+
+                t = threading.Thread(target=self.handle, args=(conn,))
+                t.daemon = True
+                t.start()
+        finally:
+            self.socket.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+            # Let submitted runs finish
+            self.pool.close()
+            self.pool.join()
+
+    def handle(self, conn):
+        """Read the requests sent over a connection"""
+        lock = threading.Lock()
+
+        def finished(reply):
+            with self.counts_lock:
+                self.running -= 1
+                self.finished += 1
+            try:
+                send(conn, lock, reply)
+            except socket.error:
+                # The client went away
+                pass
+
+        # Python 2's file iterator reads ahead, so lines are read one at a
+        # time to handle each request as soon as it arrives
+        infile = conn.makefile('r')
+        for line in iter(infile.readline, ''):
+            if not line.strip():
+                continue
+
+            request = json.loads(line)
+            command = request.get('command', 'run')
+
+            if command == 'run':
+                with self.counts_lock:
+                    self.running += 1
+                self.pool.apply_async(run_job, (request,), callback=finished)
+            elif command == 'status':
+                with self.counts_lock:
+                    send(conn, lock, {'processes': self.processes,
+                                      'running': self.running,
+                                      'finished': self.finished})
+            elif command == 'stop':
+                send(conn, lock, {'stopping': True})
+                self.stopping = True
+                # Wake up accept so the server can stop
+                try:
+                    wake = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    wake.connect(self.path)
+                    wake.close()
+                except socket.error:
+                    pass
+            else:
+                send(conn, lock, {'status': 'error',
+                                  'output': 'Unknown command: {c}'.format(c=command)})
+
+
+def connect(path=DEFAULT_SOCKET):
+    """Connect to a server"""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(path)
+    return conn
+
+
+def submit(jobs, path=DEFAULT_SOCKET, callback=None):
+    """Submit runs to a server and wait for them to finish
+
+    Returns a list of replies, in the order the runs finished.
+
+    * jobs: a list of argument lists, one for each run
+    * path: the path of the server's socket
+    * callback: a function called with each reply as it arrives
+
+    """
+    if len(jobs) == 0:
+        return []
+
+    conn = connect(path)
+    cwd = os.getcwd()
+
+    # Send every run before reading replies. The server reads requests as
+    # they arrive, so this cannot block forever.
+    lines = [json.dumps({'id': i, 'cwd': cwd, 'args': list(args)})
+             for i, args in enumerate(jobs)]
+    conn.sendall(('\n'.join(lines) + '\n').encode('utf-8'))
+    conn.shutdown(socket.SHUT_WR)
+
+    replies = []
+    infile = conn.makefile('r')
+    for line in iter(infile.readline, ''):
+        if not line.strip():
+            continue
+        reply = json.loads(line)
+        replies.append(reply)
+        if callback is not None:
+            callback(reply)
+        if len(replies) == len(jobs):
+            break
+
+    conn.close()
+    return replies
+
+
+def command(name, path=DEFAULT_SOCKET):
+    """Send a command to a server and get its reply"""
+    conn = connect(path)
+    conn.sendall((json.dumps({'command': name}) + '\n').encode('utf-8'))
+    reply = json.loads(conn.makefile('r').readline())
+    conn.close()
+    return reply
+
+
+def read_jobs(filename):
+    """Read the arguments of each run from a file, one run per line. Blank
+    lines and lines starting with # are skipped."""
+    infile = sys.stdin if filename == '-' else open(filename, 'r')
+    jobs = [shlex.split(line) for line in infile
+            if line.strip() and not line.strip().startswith('#')]
+    if infile is not sys.stdin:
+        infile.close()
+    return jobs
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='server.py',
+                                     description='Run simulations in '\
+                                     'long-lived worker processes')
+    parser.add_argument('--socket', metavar='PATH', default=DEFAULT_SOCKET,
+                        help='Path of the server\'s socket (default: '\
+                        '{d})'.format(d=DEFAULT_SOCKET))
+    subparsers = parser.add_subparsers(dest='action')
+
+    serve_parser = subparsers.add_parser('serve', help='Start a server')
+    serve_parser.add_argument('--processes', '-n', metavar='N', type=int,
+                              default=None, help='Number of worker '\
+                              'processes (default: number of CPUs)')
+    serve_parser.add_argument('--cache-entries', metavar='N', type=int,
+                              default=32, help='Number of topologies and '\
+                              'mutation tables each worker keeps in memory '\
+                              '(default: 32)')
+
+    submit_parser = subparsers.add_parser('submit', help='Submit runs and '\
+                                          'wait for them to finish')
+    submit_parser.add_argument('--jobs', metavar='FILE', help='File with '\
+                               'the arguments of one run on each line (- '\
+                               'for standard input)')
+    submit_parser.add_argument('--verbose', '-v', action='store_true',
+                               default=False, help='Print the output of '\
+                               'every run')
+    submit_parser.add_argument('args', nargs=argparse.REMAINDER,
+                               help='Arguments of a run, after --')
+
+    subparsers.add_parser('status', help='Print the status of a server')
+    subparsers.add_parser('stop', help='Stop a server after its runs finish')
+
+    args = parser.parse_args()
+
+    if args.action == 'serve':
+        assert args.processes is None or args.processes > 0, 'processes must be positive'
+        assert args.cache_entries > 0, 'cache-entries must be positive'
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    if args.action == 'serve':
+        server = Server(path=args.socket, processes=args.processes,
+                        max_entries=args.cache_entries)
+        server.serve()
+
+    elif args.action == 'submit':
+        jobs = read_jobs(args.jobs) if args.jobs else []
+        run_args = args.args[1:] if args.args[:1] == ['--'] else args.args
+        if run_args:
+            jobs.append(run_args)
+
+        def finished(reply):
+            failed = reply['status'] != 'ok'
+            out = sys.stderr if failed else sys.stdout
+            out.write('[{i}] {s} ({t:.2f}s)\n'.format(i=reply['id'],
+                                                      s=reply['status'],
+                                                      t=reply['seconds']))
+            if (failed or args.verbose) and reply['output']:
+                out.write(reply['output'])
+
+        replies = submit(jobs, path=args.socket, callback=finished)
+
+        if any(r['status'] != 'ok' for r in replies):
+            sys.exit(1)
+
+    elif args.action in ['status', 'stop']:
+        print(json.dumps(command(args.action, path=args.socket), sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
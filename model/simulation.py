@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+"""Run simulations from Python
+
+This module runs simulations within an analysis script or notebook, without
+going through hankshaw.py and the files it writes. For example, to follow the
+proportion of producers every 10 cycles until producers are lost:
+
+    import simulation
+
+    for s in simulation.simulate({'Population': {'genome_length': 4}},
+                                 every=10, seed=1):
+        print(s.time, s.prop_producers)
+
+        if s.prop_producers == 0:
+            break
+
+Parameters not given are taken from run.cfg. No files are written unless a
+data directory is given.
+"""
+
+import collections
+import os
+
+try:
+    from ConfigParser import SafeConfigParser
+except ImportError:
+    from configparser import SafeConfigParser
+
+# Filenames can be str or unicode in Python 2
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+import numpy as np
+
+from Metapopulation import Metapopulation
+from parameters import Parameters
+from SummaryOutput import summarize
+
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'run.cfg')
+
+# The options that cause files to be written
+OUTPUT_OPTIONS = ['log_demographics', 'log_genotypes', 'log_fitness',
+                  'log_summary', 'log_trajectory', 'log_spatial',
+                  'export_topology']
+
+
+class Snapshot(collections.namedtuple('Snapshot', ['time', 'reason',
+                                                    'num_occupied',
+                                                    'prop_producers',
+                                                    'mean_prop_producers',
+                                                    'abundances'])):
+    """The state of a metapopulation at one time
+
+    * time: the simulation cycle
+    * reason: the reason the state was logged (see LogSchedule)
+    * num_occupied: the number of populations containing individuals
+    * prop_producers: the proportion of producers in the metapopulation, or
+        'NA'
+    * mean_prop_producers: the mean proportion of producers among occupied
+        populations, or 'NA'
+    * abundances: a read-only copy of the abundance of each genotype at each
+        population, or None if not requested
+
+    """
+    __slots__ = ()
+
+
+def make_config(params=None, config=None):
+    """Build a configuration
+
+    * params: a dict mapping section names to dicts of option values, which
+        override those in config
+    * config: a ConfigParser object or the name of a configuration file
+        (default: run.cfg)
+
+    """
+    if config is None or isinstance(config, string_types):
+        filename = config or DEFAULT_CONFIG
+        config = SafeConfigParser()
+        with open(filename, 'r') as infile:
+            config.readfp(infile)
+
+    if params:
+        for section, options in params.items():
+            if not config.has_section(section):
+                config.add_section(section)
+            for option, value in options.items():
+                config.set(section=section, option=option, value=str(value))
+
+    return config
+
+
+class SnapshotCollector(object):
+    """Collect snapshots of the metapopulation when its state is logged
+
+    The interface matches that of OutputWriter.
+
+    * metapopulation: the Metapopulation to collect snapshots of
+    * abundances: whether or not to include a copy of the abundances
+
+    """
+
+    def __init__(self, metapopulation, abundances=False):
+        self.metapopulation = metapopulation
+        self.abundances = abundances
+        self.snapshots = []
+        self.reason = None
+
+    def log(self, time, reason):
+        self.reason = reason
+        self.update(time=time)
+
+    def update(self, time):
+        state = self.metapopulation.abundances
+
+        if self.abundances:
+            copy = state.copy()
+            copy.flags.writeable = False
+        else:
+            copy = None
+
+        self.snapshots.append(Snapshot(time, self.reason, *summarize(state),
+                                       abundances=copy))
+
+    def close(self):
+        pass
+
+
+def configure(params=None, config=None, seed=None, data_dir=None):
+    """Build the configuration of a run
+
+    If data_dir is given, the outputs enabled in the configuration are
+    written there. Otherwise, all outputs are turned off. The seed is set to
+    seed, the seed in the configuration, or a randomly-chosen seed, in that
+    order.
+
+    * params: a dict mapping section names to dicts of option values (see
+        make_config)
+    * config: a ConfigParser object or the name of a configuration file
+        (default: run.cfg). A ConfigParser object is modified.
+    * seed: the seed for the pseudorandom number generator
+    * data_dir: a directory to write output files to
+
+    """
+    config = make_config(params=params, config=config)
+
+    if seed is None and not config.has_option(section='Simulation',
+                                              option='seed'):
+        seed = np.random.randint(low=0, high=np.iinfo(np.uint32).max)
+    if seed is not None:
+        config.set(section='Simulation', option='seed', value=str(seed))
+
+    if data_dir is None:
+        for option in OUTPUT_OPTIONS:
+            config.set(section='Simulation', option=option, value='False')
+    else:
+        config.set(section='Simulation', option='data_dir', value=data_dir)
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+
+    return config
+
+
+def build(params=None, config=None, seed=None, data_dir=None, state=None):
+    """Create a Metapopulation
+
+    If data_dir is given, the outputs enabled in the configuration are
+    written there. Otherwise, no files are written. The pseudorandom number
+    generator is seeded with seed, the seed in the configuration, or a
+    randomly-chosen seed, in that order, and the seed used is stored in the
+    Metapopulation's configuration (see configure).
+
+    * params: a dict mapping section names to dicts of option values (see
+        make_config)
+    * config: a ConfigParser object or the name of a configuration file
+        (default: run.cfg). A ConfigParser object is modified.
+    * seed: the seed for the pseudorandom number generator
+    * data_dir: a directory to write output files to
+    * state: a state to continue from (see Metapopulation.get_state)
+
+    """
+    config = configure(params=params, config=config, seed=seed,
+                       data_dir=data_dir)
+    params = Parameters(config)
+    np.random.seed(seed=params.Simulation.seed)
+
+    m = Metapopulation(config=config, params=params)
+
+    if state is not None:
+        m.restore_state(state)
+
+    return m
+
+
+def simulate(params=None, config=None, every=None, callback=None,
+             abundances=False, seed=None, data_dir=None, state=None):
+    """Run a simulation, yielding a Snapshot each time its state is logged
+
+    The simulation runs until Simulation/num_cycles cycles have passed
+    (counting from time 0, even when continuing from a state) or until it is
+    stopped. It can be stopped by leaving the loop over the snapshots, or by
+    giving a callback, which is called with each snapshot and stops the
+    simulation by returning True.
+
+    * params: a dict mapping section names to dicts of option values (see
+        make_config)
+    * config: a ConfigParser object or the name of a configuration file
+        (default: run.cfg)
+    * every: the number of cycles between snapshots (default:
+        Simulation/log_frequency). With the adaptive log schedule, this is
+        the initial interval, and snapshots are also taken at events.
+    * callback: a function called with each snapshot
+    * abundances: whether or not snapshots include a copy of the abundances
+    * seed: the seed for the pseudorandom number generator
+    * data_dir: a directory to write output files to (see build)
+    * state: a state to continue from (see Metapopulation.get_state)
+
+    """
+    if every is not None:
+        params = dict(params or {})
+        params['Simulation'] = dict(params.get('Simulation', {}),
+                                    log_frequency=every)
+
+    m = build(params=params, config=config, seed=seed, data_dir=data_dir,
+              state=state)
+
+    collector = SnapshotCollector(metapopulation=m, abundances=abundances)
+    m.log_objects.append(collector)
+
+    try:
+        while m.time < m.params.Simulation.num_cycles:
+            m.cycle()
+
+            snapshots = collector.snapshots
+            collector.snapshots = []
+
+            for snapshot in snapshots:
+                yield snapshot
+
+                if callback is not None and callback(snapshot):
+                    return
+    finally:
+        m.cleanup()
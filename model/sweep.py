@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Run replicate simulations over a grid of parameter values
+
+Rather than running a fixed number of replicates at each point of the grid,
+replicates are run at each point until the 95% confidence interval of the
+outcome is narrower than a target width, subject to a minimum and maximum
+number of replicates. The outcome of each replicate is either the final
+proportion of producers (an empty metapopulation counts as 0) or whether
+producers fixed, meaning that their final proportion is at least a
+threshold. Confidence intervals are based on the normal approximation for
+proportions of producers and on the Wilson score interval for fixation.
+
+Whenever a process is free, the next replicate is given to the point that
+needs it most: points with fewer than the minimum number of replicates come
+first, followed by the points with the widest expected confidence interval.
+Points where the outcome is nearly certain, such as those where producers
+always fix or always die out, therefore stop after the minimum number of
+replicates, and the remaining replicates go to borderline points.
+
+Searches for the value at which the outcome crosses a level (see
+threshold.py) can also stop a point once its confidence interval excludes
+that level, with the level argument of sweep and run_points. This is off by
+default, so plain sweeps run each point until its interval is narrow enough.
+
+For example, to vary the genome length and maximum carrying capacity:
+
+    python sweep.py --vary Population genome_length 0,4,8 \\
+                    --vary Population capacity_max 1000,2000 \\
+                    --output replicates.csv --summary points.csv
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import multiprocessing
+import sys
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+
+from hankshaw import __version__
+from parameters import Parameters
+import resources
+import runcache
+import simulation
+
+
+# The z value for a 95% confidence interval
+Z = 1.959963984540054
+
+
+def run_replicate(config_file, params, seed, result_cache=None):
+    """Run one replicate and get the final proportion of producers
+
+    * config_file: the name of the configuration file
+    * params: a dict mapping section names to dicts of option values
+    * seed: the seed for the pseudorandom number generator
+    * result_cache: a runcache.RunCache in which the results of replicates
+        are stored and from which they are re-used
+
+    """
+    config = simulation.configure(params=params, config=config_file, seed=seed)
+
+    if result_cache is not None:
+        key = runcache.config_key(params=Parameters(config),
+                                  version=__version__)
+        entry = result_cache.load(key)
+        if entry is not None:
+            return entry['attributes']['prop_producers']
+
+    m = simulation.build(config=config)
+
+    for t in range(m.params.Simulation.num_cycles):
+        m.cycle()
+
+    m.cleanup()
+
+    prop_producers = m.prop_producers()
+    if prop_producers == 'NA':
+        prop_producers = 0.0
+    prop_producers = float(prop_producers)
+
+    if result_cache is not None:
+        result_cache.store(key=key,
+                           attributes={'prop_producers': prop_producers})
+
+    return prop_producers
+
+
+def _run_replicate(args):
+    """Run a replicate with the arguments packed in a tuple (for Pool)
+
+    Errors are returned rather than raised, so that they can be reported.
+    """
+    point, replicate, config_file, params, seed, result_cache = args
+    try:
+        return point, replicate, seed, run_replicate(config_file, params, seed,
+                                                     result_cache)
+    except Exception:
+        return point, replicate, seed, traceback.format_exc()
+
+
+def interval_width(outcomes, measure):
+    """Get the width of the 95% confidence interval of the outcomes
+
+    * outcomes: a list of the outcomes of a point's replicates
+    * measure: 'proportion' or 'fixation'
+
+    """
+    n = len(outcomes)
+
+    if measure == 'fixation':
+        if n == 0:
+            return 1.0
+        p = 1.0 * sum(outcomes) / n
+        z2 = Z * Z
+        return 2 * Z * math.sqrt(p * (1 - p) / n + z2 / (4.0 * n * n)) / (1 + z2 / n)
+    else:
+        if n < 2:
+            return float('inf')
+        return 2 * Z * np.std(outcomes, ddof=1) / math.sqrt(n)
+
+
+class Point(object):
+    """A point in the parameter grid and the outcomes of its replicates
+
+    * index: the point's position in the grid. Along with the sweep's seed
+        and the replicate's number, this determines each replicate's seed.
+    * values: a list of (section, option, value) tuples
+    * measure: 'proportion' or 'fixation'
+    * fixation_threshold: the final proportion of producers at or above which
+        producers are considered fixed
+
+    """
+
+    def __init__(self, index, values, measure, fixation_threshold):
+        self.index = index
+        self.values = values
+        self.measure = measure
+        self.fixation_threshold = fixation_threshold
+        self.outcomes = []
+        self.running = 0
+        self.launched = 0
+
+    def params(self):
+        """Get the point's parameter values as a dict of sections"""
+        params = {}
+        for section, option, value in self.values:
+            params.setdefault(section, {})[option] = value
+        return params
+
+    def record(self, prop_producers):
+        """Record the final proportion of producers of a replicate"""
+        if self.measure == 'fixation':
+            self.outcomes.append(int(prop_producers >= self.fixation_threshold))
+        else:
+            self.outcomes.append(prop_producers)
+
+    def add(self, prop_producers):
+        """Record the final proportion of producers of a running replicate"""
+        self.record(prop_producers)
+        self.running -= 1
+
+    def width(self):
+        """Get the width of the point's confidence interval"""
+        return interval_width(self.outcomes, self.measure)
+
+    def priority(self, min_replicates, max_replicates, target_width,
+                 level=None):
+        """Get the priority of running another replicate at this point
+
+        Returns None if no more replicates are needed. Higher values are more
+        urgent.
+
+        * min_replicates: the minimum number of replicates per point
+        * max_replicates: the maximum number of replicates per point
+        * target_width: the target width of the confidence interval
+        * level: if given, no more replicates are needed once the confidence
+            interval excludes this value, even if it is wider than the target
+            (default: None, off)
+
+        """
+        n = len(self.outcomes)
+        planned = n + self.running
+
+        if planned >= max_replicates:
+            return None
+        elif planned < min_replicates:
+            return (1, -planned)
+        elif n < min_replicates:
+            # Wait for the minimum number of replicates to finish
+            return None
+
+        width = self.width()
+        if width <= target_width:
+            return None
+
+        if level is not None:
+            n, mean, lower, upper = self.summary()
+            if lower != 'NA' and (lower > level or upper < level):
+                return None
+
+        # Account for replicates that are already running, which are
+        # expected to narrow the interval by a factor of sqrt(n / planned)
+        if n > 0 and planned > n:
+            width *= math.sqrt(1.0 * n / planned)
+            if width <= target_width:
+                return None
+
+        return (0, width)
+
+    def summary(self):
+        """Get the number of replicates, the mean outcome, and the limits of
+        its confidence interval"""
+        n = len(self.outcomes)
+        if n == 0:
+            return [0, 'NA', 'NA', 'NA']
+
+        mean = 1.0 * sum(self.outcomes) / n
+        half = self.width() / 2
+
+        if self.measure == 'fixation':
+            z2 = Z * Z
+            center = (mean + z2 / (2.0 * n)) / (1 + z2 / n)
+        else:
+            center = mean
+
+        if math.isinf(half):
+            return [n, mean, 'NA', 'NA']
+        return [n, mean, max(0.0, center - half), min(1.0, center + half)]
+
+
+def sweep(config_file, grid, fixed=None, measure='proportion',
+          fixation_threshold=0.9, target_width=0.1, min_replicates=5,
+          max_replicates=100, processes=None, seed=0, paired=False,
+          memory=None, result_cache=None, level=None, callback=None):
+    """Run replicates over a grid of parameter values until each point's
+    confidence interval is narrower than target_width
+
+    Returns the list of Points.
+
+    * config_file: the name of the configuration file
+    * grid: a list of (section, option, values) tuples. Every combination of
+        values is run.
+    * fixed: a list of (section, option, value) tuples set at every point
+    * measure: 'proportion' or 'fixation'
+    * fixation_threshold: the final proportion of producers at or above which
+        producers are considered fixed
+    * target_width: the target width of each point's confidence interval
+    * min_replicates: the minimum number of replicates per point
+    * max_replicates: the maximum number of replicates per point
+    * processes: the number of processes to use (default: number of CPUs)
+    * seed: the seed used to derive each replicate's seed
+    * paired: if True, replicates with the same number use the same seed at
+        every point, with paired random streams (see Metapopulation)
+    * memory: the memory available in megabytes. Replicates are only started
+        while the total of their estimated peak memory fits.
+    * result_cache: a runcache.RunCache in which the results of replicates
+        are stored and from which they are re-used
+    * level: if given, a point also stops once its confidence interval
+        excludes this value (default: None, off; see Point.priority)
+    * callback: a function called with each Point, replicate number, seed,
+        and final proportion of producers as replicates finish
+
+    """
+    fixed = fixed or []
+    combinations = itertools.product(*[[(s, o, v) for v in values]
+                                       for s, o, values in grid])
+    points = [Point(index=i, values=list(fixed) + list(c), measure=measure,
+                    fixation_threshold=fixation_threshold)
+              for i, c in enumerate(combinations)]
+
+    return run_points(points=points, config_file=config_file,
+                      target_width=target_width,
+                      min_replicates=min_replicates,
+                      max_replicates=max_replicates, processes=processes,
+                      seed=seed, paired=paired, memory=memory,
+                      result_cache=result_cache, level=level,
+                      callback=callback)
+
+
+def run_points(points, config_file, target_width=0.1, min_replicates=5,
+               max_replicates=100, processes=None, seed=0, paired=False,
+               memory=None, result_cache=None, level=None, callback=None):
+    """Run replicates at the given points until each point's confidence
+    interval is narrower than target_width
+
+    Replicates already recorded at a point count towards its total. Returns
+    the list of Points.
+
+    * points: a list of Points
+    * config_file: the name of the configuration file
+    * target_width: the target width of each point's confidence interval
+    * min_replicates: the minimum number of replicates per point
+    * max_replicates: the maximum number of replicates per point
+    * processes: the number of processes to use (default: number of CPUs)
+    * seed: the seed used to derive each replicate's seed
+    * paired: if True, replicates with the same number use the same seed at
+        every point, with paired random streams (see Metapopulation)
+    * memory: the memory available in megabytes. Replicates are only started
+        while the total of their estimated peak memory fits.
+    * result_cache: a runcache.RunCache in which the results of replicates
+        are stored and from which they are re-used
+    * level: if given, a point also stops once its confidence interval
+        excludes this value (default: None, off; see Point.priority)
+    * callback: a function called with each Point, replicate number, seed,
+        and final proportion of producers as replicates finish
+
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    pool = multiprocessing.Pool(processes=processes)
+    results = queue.Queue()
+    running = 0
+
+    # The estimated peak memory of a replicate at each point, and the total
+    # for the running replicates
+    peaks = {}
+    used = 0
+
+    def peak(p):
+        if p not in peaks:
+            params = Parameters(simulation.make_config(params=p.params(),
+                                                       config=config_file))
+            estimate = resources.check_budget(params) or resources.estimate(params)
+            peaks[p] = estimate['peak']
+        return peaks[p]
+
+    def next_point():
+        best = None
+        best_priority = None
+        for p in points:
+            priority = p.priority(min_replicates, max_replicates, target_width,
+                                  level=level)
+            if priority is not None and (best is None or priority > best_priority):
+                best = p
+                best_priority = priority
+        return best
+
+    try:
+        while True:
+            # Keep every process busy with the points that need it most
+            while running < processes:
+                p = next_point()
+                if p is None:
+                    break
+
+                # Pack replicates into the available memory. One replicate
+                # always runs, even if it is not expected to fit.
+                if memory is not None:
+                    if running > 0 and used + peak(p) > memory * resources.MB:
+                        break
+                    used += peak(p)
+
+                replicate = p.launched
+                # Each replicate's seed depends only on the sweep's seed and
+                # its position, not on the order in which replicates finish
+                params = p.params()
+                if paired:
+                    rs = np.random.RandomState([seed, replicate])
+                    params.setdefault('Simulation', {})['random_streams'] = 'paired'
+                else:
+                    rs = np.random.RandomState([seed, p.index, replicate])
+                replicate_seed = int(rs.randint(0, 2**31 - 1))
+                p.launched += 1
+                p.running += 1
+                running += 1
+
+                pool.apply_async(_run_replicate,
+                                 ((points.index(p), replicate, config_file,
+                                   params, replicate_seed, result_cache),),
+                                 callback=results.put)
+
+            if running == 0:
+                break
+
+            # Wait with a timeout, so that interrupts are handled
+            while True:
+                try:
+                    index, replicate, replicate_seed, prop_producers = results.get(timeout=1)
+                    break
+                except queue.Empty:
+                    continue
+
+            running -= 1
+            if memory is not None:
+                used -= peak(points[index])
+
+            if not isinstance(prop_producers, float):
+                msg = 'Replicate {r} of point {p} failed:\n{e}'.format(r=replicate,
+                                                                      p=points[index].index,
+                                                                      e=prop_producers)
+                raise RuntimeError(msg)
+
+            points[index].add(prop_producers)
+
+            if callback is not None:
+                callback(points[index], replicate, replicate_seed,
+                         prop_producers)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return points
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='sweep.py',
+                                     description='Run replicate simulations '\
+                                     'over a grid of parameter values')
+    parser.add_argument('--config', '-c', metavar='FILE', help='Configuration '\
+                        'file to use (default: run.cfg)', default='run.cfg',
+                        dest='configfile')
+    parser.add_argument('--vary', nargs=3, metavar=('SECTION', 'NAME',
+                                                    'VALUES'),
+                        action='append', required=True,
+                        help='Vary a parameter over comma-separated values')
+    parser.add_argument('--param', '-p', nargs=3, metavar=('SECTION', 'NAME',
+                                                           'VALUE'),
+                        action='append', help='Set a parameter value')
+    parser.add_argument('--measure', choices=['proportion', 'fixation'],
+                        default='proportion', help='Outcome of each '\
+                        'replicate: final proportion of producers or '\
+                        'fixation of producers (default: proportion)')
+    parser.add_argument('--fixation-threshold', metavar='P', type=float,
+                        default=0.9, help='Final proportion of producers '\
+                        'at which producers are considered fixed (default: '\
+                        '0.9)')
+    parser.add_argument('--width', metavar='W', type=float, default=0.1,
+                        help='Target width of the 95%% confidence interval '\
+                        '(default: 0.1)')
+    parser.add_argument('--min-replicates', metavar='N', type=int, default=5,
+                        help='Minimum replicates per point (default: 5)')
+    parser.add_argument('--max-replicates', metavar='N', type=int,
+                        default=100, help='Maximum replicates per point '\
+                        '(default: 100)')
+    parser.add_argument('--processes', '-n', metavar='N', type=int,
+                        default=None, help='Number of processes to use '\
+                        '(default: number of CPUs)')
+    parser.add_argument('--seed', '-s', metavar='S', type=int, default=0,
+                        help='Seed from which replicate seeds are derived '\
+                        '(default: 0)')
+    parser.add_argument('--paired', action='store_true', default=False,
+                        help='Give replicates with the same number the same '\
+                        'seed and paired random streams at every point')
+    parser.add_argument('--memory', metavar='MB', type=float, default=None,
+                        help='Memory available for replicates in megabytes. '\
+                        'Replicates are packed by their estimated peak '\
+                        'memory (default: no limit)')
+    parser.add_argument('--result-cache', metavar='DIR', help='Directory in '\
+                        'which to store the results of replicates and from '\
+                        'which to re-use them')
+    parser.add_argument('--output', '-o', metavar='FILE', help='File to '\
+                        'write the result of each replicate to')
+    parser.add_argument('--summary', metavar='FILE', help='File to write '\
+                        'the summary of each point to (default: standard '\
+                        'output)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                       help='Suppress output messages')
+
+    args = parser.parse_args()
+
+    assert args.min_replicates >= 1, 'min-replicates must be at least 1'
+    assert args.max_replicates >= args.min_replicates, 'max-replicates must be at least min-replicates'
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    grid = [(s, o, [v.strip() for v in values.split(',')])
+            for s, o, values in args.vary]
+    fixed = [tuple(p) for p in args.param or []]
+    columns = [o for s, o, values in grid]
+
+    outfile = None
+    if args.output:
+        outfile = open(args.output, 'w')
+        writer = csv.writer(outfile)
+        writer.writerow(columns + ['Replicate', 'Seed', 'ProducerProportion'])
+
+    def finished(point, replicate, seed, prop_producers):
+        if outfile is not None:
+            writer.writerow([v for s, o, v in point.values[len(fixed):]] +
+                            [replicate, seed, prop_producers])
+        if not args.quiet:
+            sys.stderr.write('[{p}] replicate {r}: {v} (n={n}, width={w:.3})\n'.format(
+                p=', '.join('{o}={v}'.format(o=o, v=v) for s, o, v in point.values[len(fixed):]),
+                r=replicate, v=prop_producers, n=len(point.outcomes),
+                w=point.width()))
+
+    result_cache = None
+    if args.result_cache:
+        result_cache = runcache.RunCache(directory=args.result_cache)
+
+    points = sweep(config_file=args.configfile, grid=grid, fixed=fixed,
+                   measure=args.measure,
+                   fixation_threshold=args.fixation_threshold,
+                   target_width=args.width,
+                   min_replicates=args.min_replicates,
+                   max_replicates=args.max_replicates,
+                   processes=args.processes, seed=args.seed,
+                   paired=args.paired, memory=args.memory,
+                   result_cache=result_cache, callback=finished)
+
+    if outfile is not None:
+        outfile.close()
+
+    if args.summary:
+        summaryfile = open(args.summary, 'w')
+    else:
+        summaryfile = sys.stdout
+
+    writer = csv.writer(summaryfile)
+    writer.writerow(columns + ['Replicates', 'Mean', 'Lower', 'Upper'])
+    for p in points:
+        writer.writerow([v for s, o, v in p.values[len(fixed):]] + p.summary())
+
+    if summaryfile is not sys.stdout:
+        summaryfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Find the parameter value at which an outcome crosses a level
+
+For example, to find the migration rate at which the mean final proportion of
+producers falls below 0.5:
+
+    python threshold.py Metapopulation migration_rate 0 0.5 --level 0.5
+
+The range is divided into equal parts (two for bisection, the default), and
+replicates are run at each division point using sweep.py's sequential
+stopping rule. The part in which the outcome crosses the level becomes the
+new range, and this is repeated until the range is narrower than the
+tolerance. Since replicates at a point stop as soon as the outcome's
+confidence interval excludes the level, points far from the transition need
+only a few replicates. With --log, the range is divided on a log scale, which
+suits mutation rates.
+
+The final proportion of producers of every replicate is stored in a cache
+file, along with a key identifying the configuration, seed, and model
+version it was run with (see runcache.config_key). Later searches with the
+same key re-use them, and run new replicates only where they are needed.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import zlib
+
+from hankshaw import __version__
+from parameters import SCHEMA, Parameters
+import runcache
+import simulation
+from sweep import Point, run_points
+
+
+class ResultCache(object):
+    """Store the outcome of every replicate in a file
+
+    Each line of the file is a JSON object giving the configuration key, the
+    parameter varied and its value, and the replicate's number, seed, and
+    final proportion of producers. Lines are appended as replicates finish,
+    so results are kept even if a search is interrupted.
+
+    * filename: the name of the cache file
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.results = {}
+
+        if os.path.exists(filename):
+            with open(filename, 'r') as infile:
+                for line in infile:
+                    if not line.strip():
+                        continue
+                    r = json.loads(line)
+                    key = (r['config'], r['section'], r['option'], r['value'])
+                    self.results.setdefault(key, {})[r['replicate']] = r['prop_producers']
+
+        self.outfile = open(filename, 'a')
+
+    def get(self, key):
+        """Get the outcomes stored for a point as a dict mapping replicate
+        numbers to final proportions of producers"""
+        return self.results.get(key, {})
+
+    def add(self, key, replicate, seed, prop_producers):
+        """Store the outcome of a replicate"""
+        self.results.setdefault(key, {})[replicate] = prop_producers
+
+        config, section, option, value = key
+        self.outfile.write(json.dumps({'config': config, 'section': section,
+                                       'option': option, 'value': value,
+                                       'replicate': replicate, 'seed': seed,
+                                       'prop_producers': prop_producers}) + '\n')
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+
+
+def format_value(value, kind):
+    """Format a parameter value so that equal values have the same key"""
+    if kind is int:
+        return str(int(round(value)))
+    return '{v:.6g}'.format(v=value)
+
+
+def search(config_file, section, option, low, high, fixed=None, level=0.5,
+           divisions=2, tolerance=None, log_scale=False, max_rounds=20,
+           measure='proportion', fixation_threshold=0.9, target_width=0.1,
+           min_replicates=5, max_replicates=100, processes=None, seed=0,
+           cache_file='threshold-cache.jsonl', callback=None):
+    """Find the range of values over which the mean outcome crosses level
+
+    Returns the lower and upper ends of the final range (or None for each if
+    the outcome does not cross level within the given range) and a dict
+    mapping each value evaluated to its Point.
+
+    * config_file: the name of the configuration file
+    * section: the section of the parameter to vary
+    * option: the name of the parameter to vary
+    * low: the lower end of the range to search
+    * high: the upper end of the range to search
+    * fixed: a list of (section, option, value) tuples set at every point
+    * level: the level of the outcome that defines the transition
+    * divisions: the number of parts the range is divided into each round
+    * tolerance: the width of the range at which the search stops. With
+        log_scale, this is relative to the lower end. (default: 1/1000 of the
+        range, or 1 for integer parameters)
+    * log_scale: whether or not to divide the range on a log scale
+    * max_rounds: the maximum number of rounds of refinement
+    * measure, fixation_threshold, target_width, min_replicates,
+        max_replicates, processes, seed: see sweep.sweep
+    * cache_file: the name of the file caching replicate outcomes
+    * callback: a function called with the lower and upper ends of the range
+        after each round
+
+    """
+    fixed = fixed or []
+    kinds = dict(((s, o), k) for s, o, k, d in SCHEMA)
+    kind = kinds.get((section, option), float)
+
+    assert high > low, 'The upper end of the range must be greater than the lower end'
+    assert divisions >= 2, 'The range must be divided into at least 2 parts'
+    assert not log_scale or low > 0, 'The range must be positive to use a log scale'
+
+    if tolerance is None:
+        tolerance = 1 if kind is int else (high - low) / 1000.0
+
+    # Replicates are run without outputs, and their seeds are derived from
+    # seed, so the key describes the configuration as they see it
+    params = {}
+    for s, o, v in fixed:
+        params.setdefault(s, {})[o] = v
+    config = simulation.configure(params=params, config=config_file, seed=seed)
+    key = runcache.config_key(params=Parameters(config), version=__version__)
+
+    cache = ResultCache(cache_file)
+    points = {}
+
+    def get_point(value):
+        text = format_value(value, kind)
+        if text not in points:
+            p = Point(index=zlib.crc32(text.encode('utf-8')) & 0x7fffffff,
+                      values=fixed + [(section, option, text)],
+                      measure=measure, fixation_threshold=fixation_threshold)
+            cached = cache.get((key, section, option, text))
+            for replicate in sorted(cached):
+                p.record(cached[replicate])
+            p.launched = max(cached) + 1 if cached else 0
+            points[text] = p
+        return points[text]
+
+    def finished(point, replicate, replicate_seed, prop_producers):
+        cache.add((key, section, option, point.values[-1][2]), replicate,
+                  replicate_seed, prop_producers)
+
+    def divide(low, high):
+        if log_scale:
+            return [math.exp(math.log(low) + (math.log(high) - math.log(low)) * i / divisions)
+                    for i in range(divisions + 1)]
+        return [low + (high - low) * i / float(divisions)
+                for i in range(divisions + 1)]
+
+    def converged(low, high):
+        if log_scale:
+            return high / low - 1 <= tolerance
+        return high - low <= tolerance
+
+    lower = upper = None
+
+    try:
+        for r in range(max_rounds):
+            values = divide(low, high)
+            round_points = [get_point(v) for v in values]
+            run_points(points=round_points, config_file=config_file,
+                       target_width=target_width,
+                       min_replicates=min_replicates,
+                       max_replicates=max_replicates, processes=processes,
+                       seed=seed, level=level, callback=finished)
+
+            sides = [p.summary()[1] >= level for p in round_points]
+            crossings = [i for i in range(divisions) if sides[i] != sides[i + 1]]
+
+            if len(crossings) == 0:
+                break
+
+            i = crossings[0]
+            lower = float(round_points[i].values[-1][2])
+            upper = float(round_points[i + 1].values[-1][2])
+            low, high = lower, upper
+
+            if callback is not None:
+                callback(lower, upper)
+
+            if converged(low, high) or (kind is int and high - low <= 1):
+                break
+    finally:
+        cache.close()
+
+    return lower, upper, points
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='threshold.py',
+                                     description='Find the parameter value '\
+                                     'at which an outcome crosses a level')
+    parser.add_argument('section', metavar='SECTION',
+                        help='Section of the parameter to vary')
+    parser.add_argument('option', metavar='NAME', help='Parameter to vary')
+    parser.add_argument('low', metavar='LOW', type=float,
+                        help='Lower end of the range to search')
+    parser.add_argument('high', metavar='HIGH', type=float,
+                        help='Upper end of the range to search')
+    parser.add_argument('--config', '-c', metavar='FILE', help='Configuration '\
+                        'file to use (default: run.cfg)', default='run.cfg',
+                        dest='configfile')
+    parser.add_argument('--param', '-p', nargs=3, metavar=('SECTION', 'NAME',
+                                                           'VALUE'),
+                        action='append', help='Set a parameter value')
+    parser.add_argument('--level', metavar='L', type=float, default=0.5,
+                        help='Level of the outcome defining the transition '\
+                        '(default: 0.5)')
+    parser.add_argument('--divisions', metavar='D', type=int, default=2,
+                        help='Number of parts the range is divided into '\
+                        'each round (default: 2, bisection)')
+    parser.add_argument('--tolerance', metavar='T', type=float, default=None,
+                        help='Width of the range at which to stop (default: '\
+                        '1/1000 of the range)')
+    parser.add_argument('--log', action='store_true', default=False,
+                        dest='log_scale', help='Divide the range on a log '\
+                        'scale. The tolerance is then relative.')
+    parser.add_argument('--max-rounds', metavar='N', type=int, default=20,
+                        help='Maximum rounds of refinement (default: 20)')
+    parser.add_argument('--measure', choices=['proportion', 'fixation'],
+                        default='proportion', help='Outcome of each '\
+                        'replicate: final proportion of producers or '\
+                        'fixation of producers (default: proportion)')
+    parser.add_argument('--fixation-threshold', metavar='P', type=float,
+                        default=0.9, help='Final proportion of producers '\
+                        'at which producers are considered fixed (default: '\
+                        '0.9)')
+    parser.add_argument('--width', metavar='W', type=float, default=0.1,
+                        help='Target width of the 95%% confidence interval '\
+                        '(default: 0.1)')
+    parser.add_argument('--min-replicates', metavar='N', type=int, default=5,
+                        help='Minimum replicates per point (default: 5)')
+    parser.add_argument('--max-replicates', metavar='N', type=int,
+                        default=100, help='Maximum replicates per point '\
+                        '(default: 100)')
+    parser.add_argument('--processes', '-n', metavar='N', type=int,
+                        default=None, help='Number of processes to use '\
+                        '(default: number of CPUs)')
+    parser.add_argument('--seed', '-s', metavar='S', type=int, default=0,
+                        help='Seed from which replicate seeds are derived '\
+                        '(default: 0)')
+    parser.add_argument('--cache', metavar='FILE',
+                        default='threshold-cache.jsonl', help='File caching '\
+                        'the outcomes of replicates (default: '\
+                        'threshold-cache.jsonl)')
+    parser.add_argument('--output', '-o', metavar='FILE', help='File to '\
+                        'write the summary of each point to (default: '\
+                        'standard output)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                       help='Suppress output messages')
+
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    def refined(lower, upper):
+        if not args.quiet:
+            sys.stderr.write('{o} between {l} and {u}\n'.format(o=args.option,
+                                                                l=lower,
+                                                                u=upper))
+
+    lower, upper, points = search(config_file=args.configfile,
+                                  section=args.section, option=args.option,
+                                  low=args.low, high=args.high,
+                                  fixed=[tuple(p) for p in args.param or []],
+                                  level=args.level, divisions=args.divisions,
+                                  tolerance=args.tolerance,
+                                  log_scale=args.log_scale,
+                                  max_rounds=args.max_rounds,
+                                  measure=args.measure,
+                                  fixation_threshold=args.fixation_threshold,
+                                  target_width=args.width,
+                                  min_replicates=args.min_replicates,
+                                  max_replicates=args.max_replicates,
+                                  processes=args.processes, seed=args.seed,
+                                  cache_file=args.cache, callback=refined)
+
+    if args.output:
+        outfile = open(args.output, 'w')
+    else:
+        outfile = sys.stdout
+
+    writer = csv.writer(outfile)
+    writer.writerow([args.option, 'Replicates', 'Mean', 'Lower', 'Upper'])
+    for value in sorted(points, key=float):
+        writer.writerow([value] + points[value].summary())
+
+    if outfile is not sys.stdout:
+        outfile.close()
+
+    if lower is None:
+        sys.stderr.write('The outcome does not cross {l} between {a} and {b}\n'.format(l=args.level,
+                                                                                         a=args.low,
+                                                                                         b=args.high))
+        sys.exit(1)
+
+    total = sum(len(p.outcomes) for p in points.values())
+    sys.stderr.write('{o} is between {l} and {u} ({n} replicates)\n'.format(o=args.option,
+                                                                           l=lower,
+                                                                           u=upper,
+                                                                           n=total))
+
+
+if __name__ == "__main__":
+    main()
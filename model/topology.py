@@ -1,9 +1,190 @@
 # -*- coding: utf-8 -*-
 
-import networkx as nx
+import numpy as np
 
+# networkx is only imported when a topology or export requires it, since
+# importing it takes a substantial fraction of the startup time of short runs.
 
-def moore_lattice(rows, columns, radius=1, periodic=False):
+
+class Graph(object):
+    """A lightweight, read-only undirected graph
+
+    Graph provides the subset of the networkx graph interface used by the
+    model. The adjacency structure is stored in compressed sparse row form:
+    the neighbors of node n are indices[indptr[n]:indptr[n+1]], in the order
+    neighbors(n) lists them. Graphs built from edges list neighbors in
+    increasing order, and graphs built from networkx graphs in increasing
+    order or in the order the networkx graph lists them. Because the structure is held in flat arrays,
+    it can be stored in and memory-mapped from the topology cache. As with
+    networkx graphs, the attributes of node n are stored in the dictionary
+    node[n].
+
+    Parameters:
+
+    *indptr*
+        Array of num_nodes + 1 offsets into indices
+    *indices*
+        Array containing the neighbors of each node
+    *name*
+        A description of the graph
+    *positions*
+        For lattices whose nodes are not numbered in row-major order, an array
+        giving the row-major position of each node (default: None)
+
+    """
+
+    def __init__(self, indptr, indices, name='', positions=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.name = name
+        self.positions = positions
+        self.node = [dict() for n in range(len(indptr) - 1)]
+
+    @classmethod
+    def from_edges(cls, num_nodes, edges, name=''):
+        """Create a Graph with num_nodes nodes from an array of edges"""
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        src = np.concatenate((edges[:, 0], edges[:, 1]))
+        dst = np.concatenate((edges[:, 1], edges[:, 0]))
+
+        order = np.lexsort((dst, src))
+        src = src[order]
+        dst = dst[order]
+
+        # Remove any duplicate edges
+        keep = np.ones(src.size, dtype=bool)
+        keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        src = src[keep]
+        dst = dst[keep]
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(src, minlength=num_nodes))
+
+        return cls(indptr=indptr, indices=dst.astype(np.int32), name=name)
+
+    @classmethod
+    def from_adjacency(cls, adjacency, name='', positions=None):
+        """Create a Graph from a list containing the neighbors of each node,
+        keeping the order of each node's neighbors"""
+        indptr = np.zeros(len(adjacency) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(a) for a in adjacency])
+        indices = np.fromiter((v for a in adjacency for v in a),
+                              dtype=np.int32, count=indptr[-1])
+        return cls(indptr=indptr, indices=indices, name=name,
+                   positions=positions)
+
+    @classmethod
+    def from_networkx(cls, g, positions=None, networkx_order=True):
+        """Create a Graph from a networkx graph with nodes 0..n-1, keeping the
+        order in which it lists each node's neighbors, or listing them in
+        increasing order if networkx_order is False"""
+        if not networkx_order:
+            return cls.from_edges(num_nodes=g.number_of_nodes(),
+                                  edges=np.array(g.edges(), dtype=np.int64),
+                                  name=g.name)
+        return cls.from_adjacency([g.adj[n] for n in range(g.number_of_nodes())],
+                                  name=g.name, positions=positions)
+
+    def to_networkx(self):
+        """Return a networkx graph with the same structure"""
+        import networkx as nx
+
+        g = nx.empty_graph(n=self.number_of_nodes())
+        g.name = self.name
+        g.add_edges_from(self.edge_array().tolist())
+        return g
+
+    def edge_array(self):
+        """Return an array containing each edge (u, v), where u < v"""
+        src = np.repeat(np.arange(self.number_of_nodes()), np.diff(self.indptr))
+        mask = src < self.indices
+        return np.column_stack((src[mask], self.indices[mask]))
+
+    def number_of_nodes(self):
+        return len(self.indptr) - 1
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+    def __iter__(self):
+        return iter(range(self.number_of_nodes()))
+
+    def nodes(self):
+        return list(range(self.number_of_nodes()))
+
+    def nodes_iter(self, data=False):
+        if data:
+            return iter(enumerate(self.node))
+        else:
+            return iter(range(self.number_of_nodes()))
+
+    def neighbors(self, n):
+        return self.indices[self.indptr[n]:self.indptr[n+1]].tolist()
+
+    def neighbors_iter(self, n):
+        return iter(self.neighbors(n))
+
+    def degree(self, n):
+        return int(self.indptr[n+1] - self.indptr[n])
+
+
+def networkx_adjacency(num_nodes, edges):
+    """Get the neighbors of each node, in the order a networkx graph lists
+    them after the edges are added to it in turn
+
+    networkx lists each node's neighbors in the iteration order of a dict, so
+    this depends on the order in which edges are added and on the version of
+    Python, as it does for networkx graphs.
+
+    * num_nodes: the number of nodes
+    * edges: a sequence of (u, v) pairs, in the order they are added
+
+    """
+    adjacency = [dict() for n in range(num_nodes)]
+    for u, v in edges:
+        adjacency[u][v] = None
+        adjacency[v][u] = None
+    return [list(a) for a in adjacency]
+
+
+def lattice_edges(rows, columns, offsets, periodic=False):
+    """Return the edges of a 2d lattice graph
+
+    Nodes are numbered in row-major order. Each node is connected to the nodes
+    at each (row, column) offset from it. If periodic is True, offsets wrap
+    around the boundaries of the lattice. Otherwise, edges that would cross a
+    boundary are omitted.
+    """
+    nodes = np.arange(rows * columns)
+    myrow = nodes // columns
+    mycol = nodes % columns
+    edges = []
+
+    for dr, dc in offsets:
+        r = myrow + dr
+        c = mycol + dc
+
+        if periodic:
+            mask = np.ones(nodes.size, dtype=bool)
+        else:
+            mask = (r >= 0) & (r < rows) & (c >= 0) & (c < columns)
+
+        neighbor = (columns * (r % rows)) + (c % columns)
+        mask &= nodes != neighbor
+        edges.append(np.column_stack((nodes[mask], neighbor[mask])))
+
+    if len(edges) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    return np.concatenate(edges)
+
+
+
+def moore_lattice(rows, columns, radius=1, periodic=False,
+                  networkx_order=False):
     """ Return the 2d lattice graph of rows x columns nodes, each connected to
     its nearest 8 neighbors within a given radius.  Optional argument
     periodic=True will connect boundary nodes via periodic boundary conditions.
@@ -19,39 +200,35 @@ def moore_lattice(rows, columns, radius=1, periodic=False):
         between a node and all other nodes within N hops)
     *periodic*
         Prevent edge effects using periodic boundaries
+    *networkx_order*
+        List each node's neighbors in the order of the networkx graphs built
+        by earlier versions, so that the reference engine chooses the same
+        neighbors from the same random numbers (default: False)
 
     """
-    G = nx.empty_graph()
-    G.name = "Moore Lattice: {r} rows, {c} columns, radius={rx}".format(r=rows,
-                                                                        c=columns,
-                                                                        rx=radius)
+    name = "Moore Lattice: {r} rows, {c} columns, radius={rx}".format(r=rows,
+                                                                      c=columns,
+                                                                      rx=radius)
     
     if periodic:
-        G.name += ' with periodoc boundaries' 
-
-    G.add_nodes_from(list(range(rows * columns)))
-
-    for n in G.nodes():
-        myrow = n // columns
-        mycol = n % columns
-
-        for r in range(myrow - radius, myrow + radius + 1):
-            if periodic == False and (r < 0 or r >= rows):
-                continue
-
-            for c in range(mycol - radius, mycol + radius + 1):
-                if periodic == False and (c < 0 or c >= columns):
-                    continue
+        name += ' with periodoc boundaries' 
 
-                neighbor = (columns * (r % rows)) + (c % columns)
+    offsets = [(dr, dc) for dr in range(-radius, radius + 1)
+               for dc in range(-radius, radius + 1) if (dr, dc) != (0, 0)]
+    edges = lattice_edges(rows=rows, columns=columns, offsets=offsets,
+                          periodic=periodic)
 
-                if n != neighbor:
-                    G.add_edge(n, neighbor)
+    if networkx_order:
+        # Edges were added for each node in turn, in the order of offsets
+        edges = edges[np.argsort(edges[:, 0], kind='mergesort')]
+        return Graph.from_adjacency(networkx_adjacency(num_nodes=rows * columns,
+                                                       edges=edges.tolist()),
+                                    name=name)
 
-    return G
+    return Graph.from_edges(num_nodes=rows * columns, edges=edges, name=name)
 
 
-def vonneumann_lattice(rows, columns, periodic=False):
+def vonneumann_lattice(rows, columns, periodic=False, networkx_order=False):
     """ Return the 2d lattice graph of rows x columns nodes, each connected to
     its nearest 4 neighbors.  Optional argument periodic=True will connect
     boundary nodes via periodic boundary conditions.
@@ -64,20 +241,46 @@ def vonneumann_lattice(rows, columns, periodic=False):
         The number of columns to be in the graph
     *periodic*
         Prevent edge effects using periodic boundaries
+    *networkx_order*
+        Build the graph with networkx as earlier versions did, so that the
+        reference engine chooses the same neighbors from the same random
+        numbers. Nodes are then numbered in the order networkx lists the
+        lattice's positions rather than in row-major order, and the graph's
+        positions give each node's row-major position (default: False)
     """
 
-    g = nx.grid_2d_graph(m=columns, n=rows, periodic=periodic)
-    g = nx.convert_node_labels_to_integers(g)
-    g.name = "VonNeumann Lattice: {r} rows, {c} columns".format(r=rows,
-                                                                c=columns)
+    name = "VonNeumann Lattice: {r} rows, {c} columns".format(r=rows,
+                                                              c=columns)
 
     if periodic:
-        g.name += ' with periodic boundaries'
+        name += ' with periodic boundaries'
 
-    return g
+    if networkx_order:
+        import networkx as nx
+        g = nx.grid_2d_graph(m=columns, n=rows, periodic=periodic)
+        g = nx.convert_node_labels_to_integers(g, label_attribute='position')
+        g.name = name
+        positions = np.array([g.node[n]['position'][1] * columns + g.node[n]['position'][0]
+                              for n in range(g.number_of_nodes())],
+                             dtype=np.int64)
+        return Graph.from_networkx(g, positions=positions)
 
+    edges = lattice_edges(rows=rows, columns=columns,
+                          offsets=[(-1, 0), (1, 0), (0, -1), (0, 1)],
+                          periodic=periodic)
+
+    return Graph.from_edges(num_nodes=rows * columns, edges=edges, name=name)
+
+
+def complete(size):
+    u, v = np.triu_indices(size, 1)
+    return Graph.from_edges(num_nodes=size, edges=np.column_stack((u, v)),
+                            name='Complete Graph: {s} nodes'.format(s=size))
+
+
+def smallworld(size, neighbors, edgeprob, seed=None, networkx_order=False):
+    import networkx as nx
 
-def smallworld(size, neighbors, edgeprob, seed=None):
     assert size > 0
     assert neighbors >= 0
     assert edgeprob >= 0 and edgeprob <= 1
@@ -92,9 +295,11 @@ def smallworld(size, neighbors, edgeprob, seed=None):
     g.name = 'Small World network: {s} nodes, {n} neighbors, ' \
              '{p} edge probability'.format(s=size, n=neighbors, p=edgeprob)
 
-    return g
+    return Graph.from_networkx(g, networkx_order=networkx_order)
+
+def regular(size, degree, seed=None, networkx_order=False):
+    import networkx as nx
 
-def regular(size, degree, seed=None):
     assert size > 0
     assert degree >= 0
 
@@ -105,4 +310,4 @@ def regular(size, degree, seed=None):
 
     g.name = 'Random Regular Graph: {n} nodes, {d} degree'.format(n=size,
                                                                   d=degree)
-    return g
+    return Graph.from_networkx(g, networkx_order=networkx_order)
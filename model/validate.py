@@ -0,0 +1,654 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Check that an engine reproduces the behavior of the reference engine
+
+Faster engines draw random numbers in a different order than the reference
+engine, so their results cannot be compared exactly. Instead, this runs many
+replicates of each configuration with both engines and compares the
+distributions of observables between them with two-sample
+Kolmogorov-Smirnov tests. The observables, each taken at several times
+during the run, are:
+
+* N: the number of occupied populations
+* Size and MeanSize: the number of individuals in the metapopulation and the
+  mean size of occupied populations
+* Producers and Nonproducers: the number of producers and non-producers
+* ProducerProportion and MeanProducerProportion: the proportion of producers
+  in the metapopulation and the mean among occupied populations
+* MaxFitnessProducers and MaxFitnessNonproducers: the highest fitness among
+  producer and non-producer genotypes present, relative to the highest
+  fitness in the landscape
+* Count P<k> and Count N<k>: the number of producers (P) or non-producers
+  (N) with k adaptations. The effect of each adaptation is drawn for each
+  run, so genotypes with the same number of adaptations are interchangeable
+  between replicates and their counts are added together.
+
+Absolute sizes and counts are compared as well as proportions, so that an
+engine that grows populations to the wrong size does not go unnoticed.
+
+To keep this fast, each configuration is shrunk to at most --populations
+populations and --cycles cycles. Mixing and environmental change
+frequencies are scaled by the same factor as the number of cycles, and the
+survival rate under stress (Population/mutation_rate_tolerance) is raised by
+the factor the number of populations shrank, so that the expected number of
+survivors of the initial stress and environmental changes is unchanged.
+
+Comparisons that cannot tell the engines apart are inconclusive rather than
+passing: those at times when the metapopulation is empty in most replicates
+of either sample, and those where every value of both samples is the same.
+A configuration with no conclusive comparisons, or that is mostly empty at
+its last checkpoint, has not been tested, and the exit status is then 2.
+
+With --data, the engine is also compared against the published results
+(e.g., data/figure1.csv). Rows are used when their parameter columns match
+the (shrunk) configuration, so the configuration must be run at full size
+(e.g., --populations 625 for a 25x25 lattice) for any rows to match.
+
+A difference fails when its p-value is below --alpha after a Bonferroni
+correction for the number of conclusive comparisons and the absolute value
+of its effect size (Cohen's d) is at least --min-effect. Each comparison's
+Kolmogorov-Smirnov statistic (D) and Cohen's d are reported, and the exit
+status is 1 if any comparison fails.
+
+For example:
+
+    python validate.py -c ../configuration/base.cfg -c ../configuration/figure3a.cfg \\
+                       --candidate inplace --replicates 50
+"""
+
+import argparse
+import collections
+import csv
+import math
+import multiprocessing
+import sys
+
+import numpy as np
+
+from LogSchedule import step
+from parameters import Parameters, TOPOLOGY_SECTIONS
+from SummaryOutput import PARAMETER_COLUMNS, TREATMENT_COLUMNS, \
+                          parameter_values, summarize, treatment_values
+import simulation
+
+
+# The columns of the report
+REPORT_COLUMNS = ['Config', 'Against', 'Observable', 'Time', 'ReferenceN',
+                  'CandidateN', 'ReferenceMean', 'CandidateMean', 'D',
+                  'PValue', 'CohensD', 'Note', 'Result']
+
+# Comparisons at times when more than this proportion of the replicates of
+# either sample have no occupied populations are inconclusive
+MAX_EMPTY = 0.5
+
+
+def small_params(config_file, num_populations, num_cycles, fixed=None):
+    """Get the parameter values for a small version of a configuration
+
+    Returns a dict mapping section names to dicts of option values, which
+    includes the given fixed values.
+
+    * config_file: the name of the configuration file
+    * num_populations: the maximum number of populations
+    * num_cycles: the maximum number of cycles
+    * fixed: a dict mapping section names to dicts of option values to use
+
+    """
+    config = simulation.make_config(params=fixed, config=config_file)
+    params = Parameters(config)
+    meta = params.Metapopulation
+
+    small = collections.defaultdict(dict)
+    for section, options in (fixed or {}).items():
+        small[section].update(options)
+
+    cycles = min(num_cycles, params.Simulation.num_cycles)
+    small['Simulation']['num_cycles'] = cycles
+    scale = 1.0 * cycles / params.Simulation.num_cycles
+
+    for option in ['mix_frequency', 'env_change_frequency']:
+        frequency = getattr(meta, option)
+        if frequency > 0:
+            small['Metapopulation'][option] = max(1, int(round(frequency * scale)))
+
+    section = TOPOLOGY_SECTIONS[meta.topology]
+    topology = getattr(params, section)
+
+    # The number of populations in the full and shrunk configurations
+    full_size = small_size = None
+
+    if meta.topology in ['moore', 'vonneumann']:
+        if topology.width * topology.height > num_populations:
+            side = max(1, int(math.sqrt(num_populations)))
+            small[section]['width'] = min(side, topology.width)
+            small[section]['height'] = min(side, topology.height)
+            full_size = topology.width * topology.height
+            small_size = small[section]['width'] * small[section]['height']
+    elif topology.size > num_populations:
+        small[section]['size'] = num_populations
+        full_size = topology.size
+        small_size = num_populations
+
+        if meta.topology == 'smallworld':
+            small[section]['neighbors'] = min(topology.neighbors,
+                                              num_populations - 1)
+        elif meta.topology == 'regular':
+            # Regular graphs need an even number of edge ends
+            degree = min(topology.degree, num_populations - 1)
+            if degree * num_populations % 2 == 1:
+                degree -= 1
+            small[section]['degree'] = degree
+
+    # Individuals survive the stress of the initial state and of
+    # environmental changes with probability mutation_rate_tolerance. In a
+    # shrunk metapopulation, this is raised to keep the expected number of
+    # survivors, or almost every replicate would be empty.
+    if full_size is not None and \
+            'mutation_rate_tolerance' not in small.get('Population', {}):
+        tolerance = params.Population.mutation_rate_tolerance
+        small['Population']['mutation_rate_tolerance'] = min(1.0, tolerance * full_size / small_size)
+
+    return dict(small)
+
+
+def checkpoint_times(num_cycles, log_frequency, num_checkpoints):
+    """Get the times at which the observables are measured
+
+    The times are evenly spaced up to the end of the run, and are multiples of
+    the logging frequency so that they can be found in the published results.
+
+    * num_cycles: the number of cycles in the run
+    * log_frequency: the number of cycles between logs
+    * num_checkpoints: the number of times
+
+    """
+    times = set()
+    for k in range(1, num_checkpoints + 1):
+        t = int(round(1.0 * num_cycles * k / num_checkpoints / log_frequency)) * log_frequency
+        times.add(min(max(t, log_frequency), num_cycles))
+    return sorted(times)
+
+
+def observe(metapopulation):
+    """Measure the observables of a metapopulation
+
+    Returns a list of (name, value) tuples. Values that are not defined, such
+    as the proportion of producers in an empty metapopulation, are NaN.
+
+    * metapopulation: the Metapopulation to observe
+
+    """
+    abundances = metapopulation.abundances
+    landscape = metapopulation.fitness_landscape
+    genome_length = metapopulation.params.Population.genome_length
+    num_nonproducers = 2**genome_length
+
+    num_occupied, prop_producers, mean_prop_producers = summarize(abundances)
+    totals = abundances.sum(axis=0, dtype=np.int64)
+    size = totals.sum()
+
+    observables = [('N', num_occupied),
+                   ('Size', size),
+                   ('MeanSize', 1.0 * size / num_occupied if num_occupied > 0 else 'NA'),
+                   ('Producers', totals[num_nonproducers:].sum()),
+                   ('Nonproducers', totals[:num_nonproducers].sum()),
+                   ('ProducerProportion', prop_producers),
+                   ('MeanProducerProportion', mean_prop_producers)]
+
+    present = totals > 0
+    for name, part in [('MaxFitnessProducers', slice(num_nonproducers, None)),
+                       ('MaxFitnessNonproducers', slice(0, num_nonproducers))]:
+        if present[part].any():
+            value = landscape[part][present[part]].max() / landscape.max()
+        else:
+            value = 'NA'
+        observables.append((name, value))
+
+    # Group genotypes by their number of adaptations
+    adaptations = np.array([bin(g).count('1') for g in range(num_nonproducers)])
+    for label, part in [('P', slice(num_nonproducers, None)),
+                        ('N', slice(0, num_nonproducers))]:
+        counts = np.bincount(adaptations, weights=totals[part],
+                             minlength=genome_length + 1)
+        for k in range(genome_length + 1):
+            name = 'Count {l}{k}'.format(l=label, k=k)
+            observables.append((name, counts[k]))
+
+    return [(n, float('nan') if v == 'NA' else float(v))
+            for n, v in observables]
+
+
+def run_observables(config_file, params, seed, num_checkpoints):
+    """Run one replicate and measure its observables at each checkpoint
+
+    Returns a dict mapping (observable, time) to value.
+
+    * config_file: the name of the configuration file
+    * params: a dict mapping section names to dicts of option values
+    * seed: the seed for the pseudorandom number generator
+    * num_checkpoints: the number of times at which to measure
+
+    """
+    m = simulation.build(params=params, config=config_file, seed=seed)
+    sim = m.params.Simulation
+    times = checkpoint_times(num_cycles=sim.num_cycles,
+                             log_frequency=sim.log_frequency,
+                             num_checkpoints=num_checkpoints)
+
+    # Like the log files, the state at time t is measured before cycle t
+    results = {}
+    while True:
+        if m.time in times:
+            for name, value in observe(m):
+                results[(name, m.time)] = value
+        if m.time >= sim.num_cycles:
+            break
+        m.cycle()
+
+    m.cleanup()
+    return results
+
+
+def _run_observables(args):
+    """Run a replicate with the arguments packed in a tuple (for Pool)"""
+    key, config_file, params, seed, num_checkpoints = args
+    return key, run_observables(config_file, params, seed, num_checkpoints)
+
+
+def ks_2samp(a, b):
+    """Two-sample Kolmogorov-Smirnov test
+
+    Returns the statistic D, the largest difference between the empirical
+    distribution functions of the samples, and its p-value. The p-value uses
+    the asymptotic distribution of D with the small-sample correction of
+    Stephens (1970). It is conservative when the samples contain ties.
+
+    * a, b: arrays of values
+
+    """
+    a = np.sort(a)
+    b = np.sort(b)
+    n, m = len(a), len(b)
+
+    values = np.concatenate([a, b])
+    cdf_a = np.searchsorted(a, values, side='right') / float(n)
+    cdf_b = np.searchsorted(b, values, side='right') / float(m)
+    d = np.abs(cdf_a - cdf_b).max()
+
+    en = math.sqrt(1.0 * n * m / (n + m))
+    lam = (en + 0.12 + 0.11 / en) * d
+    if lam < 1e-3:
+        return d, 1.0
+
+    j = np.arange(1, 101)
+    p = 2 * np.sum((-1)**(j - 1) * np.exp(-2 * j**2 * lam**2))
+    return d, min(max(p, 0.0), 1.0)
+
+
+def cohens_d(a, b):
+    """Get the difference between the means of b and a relative to their
+    pooled standard deviation
+
+    * a, b: arrays of values
+
+    """
+    n, m = len(a), len(b)
+    difference = np.mean(b) - np.mean(a)
+    pooled = math.sqrt(((n - 1) * np.var(a, ddof=1) + (m - 1) * np.var(b, ddof=1))
+                       / (n + m - 2))
+
+    if pooled == 0:
+        return 0.0 if difference == 0 else math.copysign(float('inf'), difference)
+    return difference / pooled
+
+
+def compare(reference, candidate):
+    """Compare the distributions of an observable in two samples
+
+    Returns the sizes and means of the samples, the Kolmogorov-Smirnov
+    statistic and p-value, and Cohen's d, or None if either sample has fewer
+    than two defined values.
+
+    * reference, candidate: lists of values, where NaN is undefined
+
+    """
+    reference = np.asarray(reference, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    reference = reference[~np.isnan(reference)]
+    candidate = candidate[~np.isnan(candidate)]
+
+    if len(reference) < 2 or len(candidate) < 2:
+        return None
+
+    d, p = ks_2samp(reference, candidate)
+    return [len(reference), len(candidate), reference.mean(), candidate.mean(),
+            d, p, cohens_d(reference, candidate)]
+
+
+def matches(value, expected):
+    """Check whether a value from a results file matches a parameter value"""
+    try:
+        return abs(float(value) - float(expected)) <= 1e-9 * max(1.0, abs(float(expected)))
+    except ValueError:
+        return str(value) == str(expected)
+
+
+def read_reference_data(filename, params, times):
+    """Read the values of observables in the published results
+
+    Returns a dict mapping (observable, time) to a list of values, one from
+    each replicate whose parameter columns match the parameters. Like the
+    observables of the runs, these are the values logged before any event at
+    that time (see LogSchedule.step).
+
+    * filename: the name of the results file (e.g., data/figure1.csv)
+    * params: a Parameters object
+    * times: the times at which to get values
+
+    """
+    expected = dict(zip(PARAMETER_COLUMNS + TREATMENT_COLUMNS,
+                        parameter_values(params) + treatment_values(params)))
+    del expected['Replicate']
+
+    values = collections.defaultdict(list)
+
+    with open(filename, 'r') as infile:
+        reader = csv.DictReader(infile)
+        columns = [c for c in expected if c in reader.fieldnames]
+        measures = [c for c in ['N', 'ProducerProportion',
+                                'MeanProducerProportion']
+                    if c in reader.fieldnames]
+
+        for row in reader:
+            time = int(float(row['Time']))
+            if time not in times or step(row.get('Reason')) > 0:
+                continue
+            if not all(matches(row[c], expected[c]) for c in columns):
+                continue
+            for measure in measures:
+                value = float('nan') if row[measure] == 'NA' else float(row[measure])
+                values[(measure, time)].append(value)
+
+    return values
+
+
+def degenerate(reference, candidate, name, time):
+    """Get the reason a comparison cannot tell the samples apart, or '' if
+    it can
+
+    Comparisons are degenerate when the metapopulation is empty in most
+    replicates of either sample at that time (see MAX_EMPTY), or when every
+    value of both samples is the same. Two samples of all-zero values agree,
+    but say nothing about whether the engines behave alike.
+
+    * reference, candidate: dicts mapping (observable, time) to lists of
+        values, where NaN is undefined
+    * name: the observable
+    * time: the time
+
+    """
+    for sample in [reference, candidate]:
+        sizes = np.asarray(sample.get(('N', time), []), dtype=float)
+        sizes = sizes[~np.isnan(sizes)]
+        if sizes.size > 0 and np.mean(sizes == 0) > MAX_EMPTY:
+            return 'mostly empty'
+
+    values = np.concatenate([np.asarray(reference[(name, time)], dtype=float),
+                             np.asarray(candidate[(name, time)], dtype=float)])
+    values = values[~np.isnan(values)]
+    if values.min() == values.max():
+        return 'constant'
+
+    return ''
+
+
+def validate(config_files, candidate, reference='reference', fixed=None,
+             num_populations=25, num_cycles=200, num_checkpoints=4,
+             replicates=30, data_file=None, processes=None, seed=0,
+             callback=None):
+    """Compare a candidate engine with the reference engine
+
+    Returns a list of comparisons, each a list with the configuration, what
+    the candidate was compared against ('reference' or 'data'), the
+    observable and time, the results of compare, and the reason the
+    comparison is degenerate ('' if it is not, see degenerate). Comparisons
+    without enough values are left out.
+
+    * config_files: a list of configuration file names
+    * candidate: the name of the engine to validate
+    * reference: the name of the engine to compare against
+    * fixed: a dict mapping section names to dicts of option values to use
+    * num_populations: the maximum number of populations
+    * num_cycles: the maximum number of cycles
+    * num_checkpoints: the number of times at which to measure observables
+    * replicates: the number of replicates of each engine
+    * data_file: the name of a published results file to compare against
+    * processes: the number of processes to use (default: number of CPUs)
+    * seed: the seed from which replicate seeds are derived
+    * callback: a function called with the configuration, engine, and
+        replicate number as each replicate finishes
+
+    """
+    tasks = []
+    for c, config_file in enumerate(config_files):
+        params = small_params(config_file=config_file,
+                              num_populations=num_populations,
+                              num_cycles=num_cycles, fixed=fixed)
+
+        for e, engine in enumerate([reference, candidate]):
+            engine_params = dict(params)
+            engine_params['Simulation'] = dict(params['Simulation'],
+                                               engine=engine)
+
+            # Replicates of the two engines use different seeds, so that
+            # their samples are independent
+            for r in range(replicates):
+                rs = np.random.RandomState([seed, c, e, r])
+                replicate_seed = int(rs.randint(0, 2**31 - 1))
+                tasks.append(((config_file, engine, r), config_file,
+                              engine_params, replicate_seed, num_checkpoints))
+
+    if processes == 1:
+        results = (_run_observables(t) for t in tasks)
+    else:
+        pool = multiprocessing.Pool(processes=processes)
+        results = pool.imap_unordered(_run_observables, tasks)
+
+    samples = collections.defaultdict(lambda: collections.defaultdict(list))
+    for (config_file, engine, r), observables in results:
+        for key, value in observables.items():
+            samples[(config_file, engine)][key].append(value)
+        if callback is not None:
+            callback(config_file, engine, r)
+
+    if processes != 1:
+        pool.close()
+        pool.join()
+
+    comparisons = []
+    for config_file in config_files:
+        cand = samples[(config_file, candidate)]
+        keys = sorted(cand, key=lambda k: (k[1], k[0]))
+
+        against = [('reference', samples[(config_file, reference)])]
+
+        if data_file:
+            params = small_params(config_file=config_file,
+                                  num_populations=num_populations,
+                                  num_cycles=num_cycles, fixed=fixed)
+            config = simulation.make_config(params=params, config=config_file)
+            times = set(t for n, t in keys)
+            against.append(('data', read_reference_data(filename=data_file,
+                                                        params=Parameters(config),
+                                                        times=times)))
+
+        for label, ref in against:
+            for name, time in keys:
+                if (name, time) not in ref:
+                    continue
+                result = compare(ref[(name, time)], cand[(name, time)])
+                if result is not None:
+                    note = degenerate(reference=ref, candidate=cand,
+                                      name=name, time=time)
+                    comparisons.append([config_file, label, name, time] +
+                                       result + [note])
+
+    return comparisons
+
+
+def parse_arguments():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(prog='validate.py',
+                                     description='Check that an engine '\
+                                     'reproduces the behavior of the '\
+                                     'reference engine')
+    parser.add_argument('--config', '-c', metavar='FILE', action='append',
+                        dest='configfiles', help='Configuration file to '\
+                        'use. Can be given more than once (default: run.cfg)')
+    parser.add_argument('--candidate', metavar='ENGINE', default='inplace',
+                        help='Engine to validate (default: inplace)')
+    parser.add_argument('--reference', metavar='ENGINE', default='reference',
+                        help='Engine to compare against (default: reference)')
+    parser.add_argument('--param', '-p', nargs=3, metavar=('SECTION', 'NAME',
+                                                           'VALUE'),
+                        action='append', help='Set a parameter value')
+    parser.add_argument('--populations', metavar='N', type=int, default=25,
+                        help='Maximum number of populations (default: 25)')
+    parser.add_argument('--cycles', metavar='N', type=int, default=200,
+                        help='Maximum number of cycles (default: 200)')
+    parser.add_argument('--checkpoints', metavar='N', type=int, default=4,
+                        help='Number of times at which observables are '\
+                        'measured (default: 4)')
+    parser.add_argument('--replicates', '-r', metavar='N', type=int,
+                        default=30, help='Replicates of each engine for '\
+                        'each configuration (default: 30)')
+    parser.add_argument('--data', metavar='FILE', help='Published results '\
+                        'to also compare against (e.g., ../data/figure1.csv)')
+    parser.add_argument('--alpha', metavar='A', type=float, default=0.01,
+                        help='Significance level before correcting for the '\
+                        'number of comparisons (default: 0.01)')
+    parser.add_argument('--min-effect', metavar='D', type=float, default=0.0,
+                        help='Smallest absolute effect size (Cohen\'s d) '\
+                        'that can fail (default: 0)')
+    parser.add_argument('--processes', '-n', metavar='N', type=int,
+                        default=None, help='Number of processes to use '\
+                        '(default: number of CPUs)')
+    parser.add_argument('--seed', '-s', metavar='S', type=int, default=0,
+                        help='Seed from which replicate seeds are derived '\
+                        '(default: 0)')
+    parser.add_argument('--output', '-o', metavar='FILE', help='File to '\
+                        'write every comparison to (default: only failures '\
+                        'are printed)')
+    parser.add_argument('--quiet', '-q', action='store_true', default=False,
+                       help='Suppress output messages')
+
+    args = parser.parse_args()
+
+    assert args.populations >= 1, 'populations must be at least 1'
+    assert args.cycles >= 1, 'cycles must be at least 1'
+    assert args.checkpoints >= 1, 'checkpoints must be at least 1'
+    assert args.replicates >= 2, 'replicates must be at least 2'
+    assert 0 < args.alpha < 1, 'alpha must be between 0 and 1'
+
+    return args
+
+
+def main():
+    args = parse_arguments()
+
+    fixed = {}
+    for section, option, value in args.param or []:
+        fixed.setdefault(section, {})[option] = value
+
+    def finished(config_file, engine, replicate):
+        if not args.quiet:
+            sys.stderr.write('[{c}] {e} replicate {r} done\n'.format(c=config_file,
+                                                                   e=engine,
+                                                                   r=replicate))
+
+    comparisons = validate(config_files=args.configfiles or ['run.cfg'],
+                           candidate=args.candidate, reference=args.reference,
+                           fixed=fixed, num_populations=args.populations,
+                           num_cycles=args.cycles,
+                           num_checkpoints=args.checkpoints,
+                           replicates=args.replicates, data_file=args.data,
+                           processes=args.processes, seed=args.seed,
+                           callback=finished)
+
+    # Degenerate comparisons are inconclusive, and are left out of the
+    # Bonferroni correction for the number of comparisons
+    conclusive = [c for c in comparisons if not c[-1]]
+    threshold = args.alpha / max(1, len(conclusive))
+
+    rows = []
+    for comparison in comparisons:
+        p, d, note = comparison[-3:]
+        if note:
+            result = 'inconclusive'
+        elif p < threshold and abs(d) >= args.min_effect:
+            result = 'FAIL'
+        else:
+            result = 'pass'
+        rows.append(comparison + [result])
+
+    failures = [r for r in rows if r[-1] == 'FAIL']
+
+    # A configuration with no conclusive comparisons, or whose metapopulations
+    # are mostly empty by the end, has not been tested
+    untested = []
+    for config_file in args.configfiles or ['run.cfg']:
+        config_rows = [r for r in rows if r[0] == config_file]
+        last = max([r[3] for r in config_rows] or [None])
+        if all(r[-1] == 'inconclusive' for r in config_rows) or \
+                any(r[3] == last and r[-2] == 'mostly empty' for r in config_rows):
+            untested.append(config_file)
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(REPORT_COLUMNS)
+            writer.writerows(rows)
+
+    for row in failures:
+        print('FAIL {c} vs {a}: {o} at {t}: mean {rm:.4g} -> {cm:.4g} '\
+              '(D={d:.3f}, p={p:.2g}, d={es:.2f})'.format(c=row[0], a=row[1],
+                                                           o=row[2], t=row[3],
+                                                           rm=row[6], cm=row[7],
+                                                           d=row[8], p=row[9],
+                                                           es=row[10]))
+
+    for config_file in untested:
+        print('INCONCLUSIVE {c}: the metapopulation is empty in most '\
+              'replicates or the observables do not vary. Use more '\
+              '--populations, or raise Population mutation_rate_tolerance '\
+              'with --param.'.format(c=config_file))
+
+    if failures:
+        verdict = 'FAIL'
+    elif untested:
+        verdict = 'INCONCLUSIVE'
+    else:
+        verdict = 'PASS'
+
+    tested = [r for r in rows if r[-1] != 'inconclusive']
+    largest = max(tested, key=lambda r: abs(r[10])) if tested else None
+    print('{r}: {f} of {n} conclusive comparisons differ, {i} inconclusive '\
+          '(alpha={a:.2g} per comparison)'.format(r=verdict, f=len(failures),
+                                                  n=len(tested),
+                                                  i=len(rows) - len(tested),
+                                                  a=threshold))
+    if largest is not None:
+        print('Largest effect: {o} at {t} in {c} vs {a} (d={d:.2f}, '\
+              'D={ks:.3f})'.format(o=largest[2], t=largest[3], c=largest[0],
+                                   a=largest[1], d=largest[10],
+                                   ks=largest[8]))
+
+    if failures:
+        sys.exit(1)
+    elif untested:
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()